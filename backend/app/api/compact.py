@@ -0,0 +1,80 @@
+"""Compact response format and fast JSON encoding.
+
+The default responses spell out every note as an object,
+`{"midi": 62, "duration": "whole"}`. Clients that opt in with
+`?format=compact` or an `Accept: application/vnd.counterpoint.compact+json`
+header get each note list as parallel arrays instead:
+
+    {"midi": [62, 65, 64], "dur": "WWW"}
+
+Durations are one letter per note (see DURATION_CODES); any other per-note
+field, such as `is_extended` on multi-voice notes, becomes an array under
+its own name. Everything else in the response is unchanged.
+
+Both formats are encoded by pydantic-core in one pass, instead of going
+through FastAPI's generic `jsonable_encoder`.
+"""
+
+from typing import Any, Optional
+from fastapi import Request, Response
+from pydantic import BaseModel, TypeAdapter
+from app.models import Duration
+
+COMPACT_MEDIA_TYPE = "application/vnd.counterpoint.compact+json"
+
+DURATION_CODES = {
+    Duration.WHOLE.value: "W",
+    Duration.HALF.value: "H",
+    Duration.QUARTER.value: "Q",
+    Duration.EIGHTH.value: "E",
+    Duration.SIXTEENTH.value: "S",
+}
+
+_PAYLOAD = TypeAdapter(dict[str, Any])
+
+
+def wants_compact(request: Request) -> bool:
+    """Whether a request asked for the compact format."""
+    if request.query_params.get("format") == "compact":
+        return True
+    return COMPACT_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _is_note_list(value: Any) -> bool:
+    return (
+        isinstance(value, list) and value
+        and all(isinstance(note, dict) and "midi" in note and "duration" in note for note in value)
+    )
+
+
+def compact_payload(payload: Any) -> Any:
+    """Copy of a response payload with every note list as parallel arrays."""
+    if _is_note_list(payload):
+        compact = {"midi": [note["midi"] for note in payload], "dur": "".join(
+            DURATION_CODES[note["duration"]] for note in payload
+        )}
+        for field in payload[0]:
+            if field not in ("midi", "duration"):
+                compact[field] = [note.get(field) for note in payload]
+        return compact
+    if isinstance(payload, dict):
+        return {k: compact_payload(v) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [compact_payload(v) for v in payload]
+    return payload
+
+
+def encode_payload(payload: dict, compact: bool, headers: Optional[dict] = None) -> Response:
+    """Encode a JSON-ready payload in the requested format."""
+    if compact:
+        return Response(
+            content=_PAYLOAD.dump_json(compact_payload(payload)), media_type=COMPACT_MEDIA_TYPE, headers=headers
+        )
+    return Response(content=_PAYLOAD.dump_json(payload), media_type="application/json", headers=headers)
+
+
+def encode_response(response: BaseModel, compact: bool) -> Response:
+    """Encode a response model in the requested format."""
+    if compact:
+        return encode_payload(response.model_dump(mode="json"), compact)
+    return Response(content=response.model_dump_json(), media_type="application/json")
@@ -1,14 +1,68 @@
 """API routes for counterpoint generation."""
 
-from fastapi import APIRouter, HTTPException
+import functools
+import inspect
+import os
+import random
+from contextlib import AsyncExitStack
+from typing import Literal
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem
+from app.api.compact import encode_payload, encode_response, wants_compact
+from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem, Duration
 from app.services import generate_cantus_firmus, generate_first_species, evaluate_first_species
 from app.services.multi_voice_generator import generate_multi_voice_first_species
 from app.services.generation_logger import logger
+from app.services.attempt_history import Bucket, generate_adaptive
+from app.services.batch import MAX_BATCH_COUNT, iter_batch
+from app.services.anytime import MAX_DEADLINE_MS, Deadline, expired, species_rhythm
+from app.services.beam_search import MAX_BEAM_WIDTH
+from app.services.portfolio import solve_portfolio
+from app.services.streaming import (
+    MAX_STREAM_COUNT, NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, all_keys, format_event, stream_solutions
+)
+from app.services.response_cache import request_key, response_cache
+from app.services.transposition import (
+    canonical_shift, counterpoint_range, fits_transposition, transpose_midis, transposition_stats
+)
+from app.services.warm_pools import warm_pools
+from app.services.single_flight import single_flight
+from app.services.scheduler import BULK, INTERACTIVE, Priority, current_priority, generation_scheduler, run_generation
+from app.services.admission import AdmissionRejected, admission, cost_model
+from app.services.solution_store import solution_store
+from app.services.repair import DEFAULT_MAX_ITERATIONS, SPECIES_EVALUATORS, repair_line
 
 router = APIRouter()
 
+# Client addresses whose X-Priority header may move a request up to the interactive lane
+PRIORITY_HOSTS = frozenset(host.strip() for host in os.getenv("PRIORITY_HOSTS", "").split(",") if host.strip())
+
+
+class SearchOptions(BaseModel):
+    """Search controls shared by the generation requests."""
+    seed: int | None = None
+    deadline_ms: int | None = Field(
+        default=None, ge=1, le=MAX_DEADLINE_MS,
+        description="Wall-clock budget; on expiry the best line so far is returned with complete=false"
+    )
+    portfolio: bool = Field(default=False, description="Race several strategies across worker processes")
+
+
+class BeamSearchOptions(SearchOptions):
+    """Search options of the generators with a beam search."""
+    beam_width: int | None = Field(
+        default=None, ge=1, le=MAX_BEAM_WIDTH,
+        description="Beam search width; wider trades latency for better-scoring lines"
+    )
+
+
+class GenerationResult(BaseModel):
+    """Fields every generated solution carries."""
+    complete: bool = Field(default=True, description="False if the deadline expired before a full search")
+    solution_id: str | None = Field(default=None, description="Content hash; fetch again with GET /api/solutions/{id}")
+
 
 class GenerateCFRequest(BaseModel):
     tonic: int = Field(ge=0, le=11, description="Tonic pitch class (0-11, C=0)")
@@ -23,18 +77,21 @@ class GenerateCFResponse(BaseModel):
     voice_range: str
 
 
-class GenerateCounterpointRequest(BaseModel):
+class GenerateCounterpointRequest(BeamSearchOptions):
     tonic: int = Field(ge=0, le=11)
     mode: Mode
     cf_notes: list[int] = Field(description="CF as MIDI numbers")
     cf_voice_range: VoiceRange
-    seed: int | None = None
+    optimize: bool = Field(default=False, description="Return the minimum-penalty counterpoint")
 
 
-class GenerateCounterpointResponse(BaseModel):
+class GenerateCounterpointResponse(GenerationResult):
     cf_notes: list[dict]
     cp_notes: list[dict]
     violations: list[dict]
+    search_stats: dict | None = Field(
+        default=None, description="How the line was found: strategy, greedy attempts, branch-and-bound counters"
+    )
 
 
 class EvaluateCounterpointRequest(BaseModel):
@@ -49,66 +106,343 @@ class EvaluateCounterpointResponse(BaseModel):
     is_valid: bool
 
 
-class GenerateMultiVoiceRequest(BaseModel):
+class RepairCounterpointRequest(BaseModel):
+    tonic: int = Field(ge=0, le=11)
+    mode: Mode
+    cf_notes: list[int] = Field(description="CF as MIDI numbers")
+    cp_notes: list[int] = Field(description="Counterpoint to repair, as MIDI numbers")
+    species: SpeciesType = SpeciesType.FIRST
+    cp_durations: list[Duration] | None = Field(
+        default=None, description="Counterpoint rhythm; required for fifth species"
+    )
+    cp_voice_range: VoiceRange | None = Field(
+        default=None, description="Counterpoint range; defaults to the generators' choice"
+    )
+    max_iterations: int = Field(default=DEFAULT_MAX_ITERATIONS, ge=1, le=1000)
+    seed: int | None = None
+
+
+class RepairCounterpointResponse(BaseModel):
+    cp_notes: list[dict]
+    violations: list[dict] = Field(description="Violations left after repair")
+    is_valid: bool
+    changed_indices: list[int] = Field(description="Counterpoint notes whose pitch was changed")
+    iterations: int
+
+
+class GenerateMultiVoiceRequest(SearchOptions):
     tonic: int = Field(ge=0, le=11)
     mode: Mode
     cf_notes: list[int] = Field(description="CF as MIDI numbers")
     cf_voice_range: VoiceRange
     num_voices: int = Field(ge=3, le=4, description="Total voices including CF (3 or 4)")
     use_bass: bool = Field(default=False, description="For 3 voices, use SAB instead of SAT")
-    seed: int | None = None
 
 
-class GenerateMultiVoiceResponse(BaseModel):
+class GenerateMultiVoiceResponse(GenerationResult):
     voices: list[dict] = Field(description="List of voices with notes and range")
     num_voices: int
     violations: list[dict] = Field(default_factory=list, description="Rule violations")
 
 
-class GenerateSecondSpeciesRequest(BaseModel):
+class GenerateSecondSpeciesRequest(BeamSearchOptions):
     tonic: int = Field(ge=0, le=11)
     mode: Mode
     cf_notes: list[int] = Field(description="CF as MIDI numbers")
     cf_voice_range: VoiceRange
-    seed: int | None = None
 
 
-class GenerateSecondSpeciesResponse(BaseModel):
+class GenerateSecondSpeciesResponse(GenerationResult):
     cf_notes: list[dict]
     cp_notes: list[dict]
     violations: list[dict]
 
 
-class GenerateThirdSpeciesRequest(BaseModel):
+class GenerateThirdSpeciesRequest(BeamSearchOptions):
     tonic: int = Field(ge=0, le=11)
     mode: Mode
     cf_notes: list[int] = Field(description="CF as MIDI numbers")
     cf_voice_range: VoiceRange
-    seed: int | None = None
 
 
-class GenerateThirdSpeciesResponse(BaseModel):
+class GenerateThirdSpeciesResponse(GenerationResult):
     cf_notes: list[dict]
     cp_notes: list[dict]
     violations: list[dict]
 
 
-class GenerateFifthSpeciesRequest(BaseModel):
+class GenerateFifthSpeciesRequest(BeamSearchOptions):
     tonic: int = Field(ge=0, le=11)
     mode: Mode
     cf_notes: list[int] = Field(description="CF as MIDI numbers")
     cf_voice_range: VoiceRange
-    seed: int | None = None
 
 
-class GenerateFifthSpeciesResponse(BaseModel):
+class GenerateFifthSpeciesResponse(GenerationResult):
     cf_notes: list[dict]
     cp_notes: list[dict]
     violations: list[dict]
 
 
+class GenerateBatchRequest(BaseModel):
+    tonic: int = Field(ge=0, le=11)
+    mode: Mode
+    cf_notes: list[int] = Field(description="CF as MIDI numbers")
+    cf_voice_range: VoiceRange
+    species: SpeciesType = SpeciesType.FIRST
+    count: int = Field(default=4, ge=1, le=MAX_BATCH_COUNT, description="Distinct solutions wanted")
+    seed: int | None = None
+    deadline_ms: int | None = Field(
+        default=None, ge=1, le=MAX_DEADLINE_MS,
+        description="Wall-clock budget for the whole batch; returns the solutions found so far"
+    )
+
+
+class BatchSolution(GenerationResult):
+    cp_notes: list[dict]
+    violations: list[dict]
+
+
+class GenerateBatchResponse(BaseModel):
+    cf_notes: list[dict]
+    solutions: list[BatchSolution] = Field(description="Distinct solutions, in the order they were found")
+    count: int = Field(description="Number of solutions returned; may be fewer than requested")
+
+
+class GenerateStreamRequest(BaseModel):
+    tonic: int = Field(ge=0, le=11)
+    mode: Mode
+    cf_notes: list[int] = Field(description="CF as MIDI numbers")
+    cf_voice_range: VoiceRange
+    species: SpeciesType = SpeciesType.FIRST
+    count: int = Field(default=1, ge=1, le=MAX_STREAM_COUNT, description="Distinct solutions wanted per key")
+    all_keys: bool = Field(
+        default=False,
+        description="Realize the CF's scale-degree shape in all 84 keys (12 tonics x 7 modes) and solve each"
+    )
+    format: Literal["ndjson", "sse"] | None = Field(
+        default=None, description="Event encoding; defaults to SSE if the Accept header asks for it, else NDJSON"
+    )
+    seed: int | None = None
+    deadline_ms: int | None = Field(
+        default=None, ge=1, le=MAX_DEADLINE_MS,
+        description="Wall-clock budget for the whole stream; no key is started after it expires"
+    )
+
+
+def _deadline(deadline_ms: int | None, header_ms: int | None) -> Deadline | None:
+    """The tighter of the request's deadline_ms and the X-Deadline-Ms header."""
+    budgets = [ms for ms in (deadline_ms, header_ms) if ms is not None]
+    if not budgets:
+        return None
+    return Deadline(min(max(1, min(budgets)), MAX_DEADLINE_MS))
+
+
+def _priority(http_request: Request, lane: str) -> Priority:
+    """The scheduler and admission lane and client of a request.
+
+    The X-Priority header can move any request to the bulk lane, but only
+    requests from PRIORITY_HOSTS to the interactive lane; clients are told
+    apart by their X-Client-Id header, or else their address.
+    """
+    host = http_request.client.host if http_request.client else ""
+    requested = http_request.headers.get("x-priority")
+    if requested == BULK or (requested in generation_scheduler.lanes and host in PRIORITY_HOSTS):
+        lane = requested
+    client = http_request.headers.get("x-client-id") or host
+    return Priority(lane, client or "anonymous")
+
+
+def _cached(
+    endpoint: str,
+    transposable: bool = False,
+    species: SpeciesType | None = None,
+    lane: str = INTERACTIVE,
+    stepwise: bool = False
+):
+    """Serve repeats of a deterministic request from the response cache.
+
+    Requests with a `seed` field are only cached when it is set, and
+    portfolio runs never are, since which strategy wins depends on timing.
+    The deadline is not part of the key: a response is only stored if it
+    finished within its deadline, in which case no stage was cut short.
+    Identical deterministic requests in flight together, deadline included,
+    share one computation (see single_flight.py).
+
+    Transposable (two-voice) requests are solved in their canonical key and
+    transposed back, so the 12 transpositions of a CF share cache entries
+    and generation plans; see transposition.py for when that is rejected.
+    Their generations are logged here, once per request, as the client
+    asked for and received them.
+
+    Generation endpoints name the `species` they solve (or that a request's
+    own `species` field defaults to) so their cost can be estimated; they
+    run under admission control (see admission.py), which answers 429 or
+    503 with a Retry-After when too much expensive work is in progress.
+    `stepwise` handlers are admitted one solution at a time instead (see
+    `_admit_step`).
+
+    Handlers that take a `deadline` get one made when the request arrives,
+    from its deadline_ms and X-Deadline-Ms header (see `_deadline`), so time
+    spent waiting for admission and in the scheduler queue counts against it.
+
+    Plain handlers run as one job on the generation thread, queued in the
+    endpoint's scheduler `lane` (see scheduler.py). Async handlers run on
+    the event loop and queue their own jobs: those with a portfolio option
+    await its worker processes there, not on the generation thread, and
+    `stepwise` ones queue a job per solution, so that other requests can
+    run between them.
+
+    Responses are encoded directly, in the default or the compact format
+    (see compact.py).
+    """
+    def decorate(handler):
+        takes_deadline = "deadline" in inspect.signature(handler).parameters
+        
+        async def run(request: BaseModel, deadline: Deadline | None):
+            kwargs = {"deadline": deadline} if takes_deadline else {}
+            try:
+                if stepwise:
+                    return await handler(request, **kwargs)
+                cost_ms = _cost_ms(request, deadline, species) if species is not None else 0.0
+                async with admission.admit(cost_ms, current_priority.get().lane):
+                    if inspect.iscoroutinefunction(handler):
+                        return await handler(request, **kwargs)
+                    return await run_generation(functools.partial(handler, request, **kwargs))
+            except AdmissionRejected as e:
+                raise _rejected(e)
+        
+        async def compute(key: str, request: BaseModel, deadline: Deadline | None):
+            response = await run(request, deadline)
+            if not expired(deadline):
+                response_cache.put(key, response, len(response.model_dump_json()))
+            return response
+        
+        async def respond(request: BaseModel, deadline: Deadline | None):
+            fields = type(request).model_fields
+            if ("seed" in fields and request.seed is None) or getattr(request, "portfolio", False):
+                return await run(request, deadline)
+            
+            key = request_key(endpoint, request.model_dump(mode="json", exclude={"deadline_ms"}))
+            response = response_cache.get(key) if response_cache.enabled else None
+            if response is not None:
+                return response
+            
+            flight_key = request_key(
+                endpoint, {"request": request.model_dump(mode="json"), "budget_ms": deadline and deadline.budget_ms}
+            )
+            return await single_flight.do(flight_key, lambda: compute(key, request, deadline))
+        
+        async def solve(request: BaseModel, deadline: Deadline | None):
+            offset = canonical_shift(request.tonic, request.cf_notes) if transposable else 0
+            if not offset:
+                return await respond(request, deadline)
+            
+            canonical = request.model_copy(update={
+                "tonic": (request.tonic - offset) % 12,
+                "cf_notes": [m - offset for m in request.cf_notes],
+            })
+            try:
+                response = await respond(canonical, deadline)
+            except HTTPException as e:
+                if e.status_code in (429, 503):
+                    raise
+                response = None
+            if response is not None:
+                payload = transpose_midis(response.model_dump(mode="json"), offset)
+                accepted = fits_transposition(request.cf_notes, canonical.cf_notes, payload)
+                transposition_stats.record(accepted)
+                if accepted:
+                    return type(response).model_validate(payload)
+            
+            # Solve the original problem directly, in what is left of the deadline
+            return await respond(request, deadline)
+        
+        @functools.wraps(handler)
+        async def wrapper(request: BaseModel, *, http_request: Request, x_deadline_ms: int | None = None):
+            deadline = _deadline(getattr(request, "deadline_ms", None), x_deadline_ms)
+            token = current_priority.set(_priority(http_request, lane))
+            try:
+                response = await solve(request, deadline)
+                if transposable:
+                    _log_generations(endpoint, request, response)
+                response = _store_solutions(response)
+            finally:
+                current_priority.reset(token)
+            return encode_response(response, wants_compact(http_request))
+        
+        # FastAPI reads the handler's parameters, less the deadline made here, plus the
+        # raw request, for the response format, and the X-Deadline-Ms header
+        signature = inspect.signature(handler)
+        parameters = [p for name, p in signature.parameters.items() if name != "deadline"]
+        parameters.append(inspect.Parameter("http_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+        if takes_deadline:
+            parameters.append(inspect.Parameter(
+                "x_deadline_ms", inspect.Parameter.KEYWORD_ONLY, default=Header(default=None), annotation=int | None
+            ))
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+    return decorate
+
+
+def _store_solutions(response: BaseModel) -> BaseModel:
+    """Give the solutions in a response their content IDs and keep them for retrieval."""
+    if "solution_id" in type(response).model_fields:
+        response.solution_id = solution_store.put(response.model_dump(mode="json"))
+    elif isinstance(response, GenerateBatchResponse):
+        for solution in response.solutions:
+            solution.solution_id = solution_store.put({
+                "cf_notes": response.cf_notes, **solution.model_dump(mode="json")
+            })
+    return response
+
+
+def _log_generations(endpoint: str, request: BaseModel, response: BaseModel) -> None:
+    """Log the two-voice solutions in a response (one, or a batch of them)."""
+    payload = response.model_dump(mode="json")
+    cf = {"voice_index": 0, "voice_range": request.cf_voice_range.value, "notes": payload["cf_notes"]}
+    cp_range = counterpoint_range(request.cf_notes).value
+    for solution in payload.get("solutions", [payload]):
+        cp = {"voice_index": 1, "voice_range": cp_range, "notes": solution["cp_notes"]}
+        try:
+            logger.log_voices([cf, cp], solution["violations"], request.model_dump(), endpoint)
+        except Exception as e:
+            print(f"Logging error: {e}")
+
+
+def _rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after_s)})
+
+
+def _cost_ms(request: BaseModel, deadline: Deadline | None, species: SpeciesType) -> float:
+    """Estimated time to generate one solution to a request, capped by what is left of its deadline."""
+    bucket = Bucket(
+        getattr(request, "species", species).value,
+        getattr(request, "num_voices", 2),
+        len(request.cf_notes),
+        request.mode.value,
+        request.cf_voice_range.value,
+    )
+    cost = cost_model.estimate_ms(bucket)
+    return cost if deadline is None else min(cost, deadline.remaining_ms())
+
+
+async def _admit_step(
+    admitted: AsyncExitStack, request: BaseModel, deadline: Deadline | None, lane: str | None = None
+) -> None:
+    """Admit the next solution of a batch or stream, held until `admitted` is closed.
+
+    Requests for several solutions are admitted one solution at a time, so
+    that they hold no capacity between solutions, or while a stream waits
+    for its client, and other requests can be admitted in between.
+    """
+    lane = lane or current_priority.get().lane
+    await admitted.enter_async_context(admission.admit(_cost_ms(request, deadline, request.species), lane))
+
+
 @router.post("/generate-cantus-firmus", response_model=GenerateCFResponse)
-async def generate_cf_endpoint(request: GenerateCFRequest):
+@_cached("generate-cantus-firmus")
+def generate_cf_endpoint(request: GenerateCFRequest):
     """Generate a cantus firmus."""
     key = Key(tonic=request.tonic, mode=request.mode)
     
@@ -129,7 +463,8 @@ async def generate_cf_endpoint(request: GenerateCFRequest):
 
 
 @router.post("/generate-counterpoint", response_model=GenerateCounterpointResponse)
-async def generate_counterpoint_endpoint(request: GenerateCounterpointRequest):
+@_cached("generate-counterpoint", transposable=True, species=SpeciesType.FIRST)
+async def generate_counterpoint_endpoint(request: GenerateCounterpointRequest, deadline: Deadline | None = None):
     """Generate first species counterpoint."""
     from app.models import Pitch, Note, Duration, VoiceLine
     
@@ -146,7 +481,18 @@ async def generate_counterpoint_endpoint(request: GenerateCounterpointRequest):
         species_per_voice=[SpeciesType.FIRST]
     )
     
-    solution = generate_first_species(problem, seed=request.seed)
+    if request.portfolio:
+        solution = (await solve_portfolio("first", problem, seed=request.seed, deadline=deadline)).solution
+    else:
+        # Unseeded requests for hot problems are served from a warm pool
+        solution = warm_pools.take(
+            "first", problem, {"beam_width": request.beam_width, "optimize": request.optimize}
+        ) if request.seed is None else None
+        if solution is None:
+            solution = await run_generation(lambda: generate_adaptive(
+                generate_first_species, problem, seed=request.seed, beam_width=request.beam_width,
+                optimize=request.optimize, deadline=deadline
+            ))
     
     if not solution:
         raise HTTPException(status_code=500, detail="Failed to generate counterpoint")
@@ -154,11 +500,6 @@ async def generate_counterpoint_endpoint(request: GenerateCounterpointRequest):
     violations = evaluate_first_species(cf, solution.voice_lines[1])
     solution.diagnostics = violations
     
-    try:
-        logger.log_generation(solution, request.model_dump(), "generate-counterpoint")
-    except Exception as e:
-        print(f"Logging error: {e}")
-    
     return GenerateCounterpointResponse(
         cf_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[0].notes],
         cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[1].notes],
@@ -166,12 +507,15 @@ async def generate_counterpoint_endpoint(request: GenerateCounterpointRequest):
             "rule_code": v.rule_code,
             "description": v.description,
             "severity": v.severity.value
-        } for v in violations]
+        } for v in violations],
+        search_stats=solution.search_stats or None,
+        complete=solution.complete
     )
 
 
 @router.post("/evaluate-counterpoint", response_model=EvaluateCounterpointResponse)
-async def evaluate_counterpoint_endpoint(request: EvaluateCounterpointRequest):
+@_cached("evaluate-counterpoint")
+def evaluate_counterpoint_endpoint(request: EvaluateCounterpointRequest):
     """Evaluate a counterpoint against a cantus firmus."""
     from app.models import Pitch, Note, Duration, VoiceLine
     
@@ -194,8 +538,66 @@ async def evaluate_counterpoint_endpoint(request: EvaluateCounterpointRequest):
     )
 
 
+@router.post("/repair-counterpoint", response_model=RepairCounterpointResponse)
+@_cached("repair-counterpoint")
+def repair_counterpoint_endpoint(request: RepairCounterpointRequest):
+    """Repair a counterpoint by min-conflicts local search, keeping its rhythm.
+
+    The counterpoint must fill the CF: in the species rhythm (see
+    anytime.species_rhythm), or for fifth species in its own rhythm of
+    one whole note's worth per CF note.
+    """
+    from app.models import Pitch, Note, VoiceLine
+    
+    if not request.cf_notes or not request.cp_notes:
+        raise HTTPException(status_code=422, detail="cf_notes and cp_notes must not be empty")
+    rhythm = species_rhythm(request.species, len(request.cf_notes))
+    if request.cp_durations is None:
+        if request.species == SpeciesType.FIFTH:
+            raise HTTPException(status_code=422, detail="cp_durations is required for fifth species")
+        durations = rhythm
+    elif len(request.cp_durations) != len(request.cp_notes):
+        raise HTTPException(status_code=422, detail="cp_durations must match cp_notes in length")
+    else:
+        durations = request.cp_durations
+    if request.species == SpeciesType.FIFTH:
+        if sum(d.to_beats() for d in durations) != len(request.cf_notes) * Duration.WHOLE.to_beats():
+            raise HTTPException(status_code=422, detail="cp_durations must last as long as the CF")
+    elif len(request.cp_notes) != len(rhythm):
+        raise HTTPException(
+            status_code=422,
+            detail=f"{request.species.value} species against {len(request.cf_notes)} CF notes needs {len(rhythm)} cp_notes"
+        )
+    elif durations != rhythm:
+        raise HTTPException(status_code=422, detail=f"cp_durations must be the {request.species.value} species rhythm")
+    
+    key = Key(tonic=request.tonic, mode=request.mode)
+    cf_notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in request.cf_notes]
+    cf = VoiceLine(notes=cf_notes, voice_index=0, voice_range=VoiceRange.SOPRANO)
+    cp_notes = [Note(pitch=Pitch.from_midi(m), duration=d) for m, d in zip(request.cp_notes, durations)]
+    
+    cp_range = request.cp_voice_range or counterpoint_range(request.cf_notes)
+    
+    if request.seed is not None:
+        random.seed(request.seed)
+    result = repair_line(cf, cp_notes, key, cp_range, request.species, request.max_iterations)
+    
+    return RepairCounterpointResponse(
+        cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in result.notes],
+        violations=[{
+            "rule_code": v.rule_code,
+            "description": v.description,
+            "severity": v.severity.value
+        } for v in result.violations],
+        is_valid=len(result.violations) == 0,
+        changed_indices=result.changed,
+        iterations=result.iterations
+    )
+
+
 @router.post("/generate-second-species", response_model=GenerateSecondSpeciesResponse)
-async def generate_second_species_endpoint(request: GenerateSecondSpeciesRequest):
+@_cached("generate-second-species", transposable=True, species=SpeciesType.SECOND)
+async def generate_second_species_endpoint(request: GenerateSecondSpeciesRequest, deadline: Deadline | None = None):
     """Generate second species counterpoint (2:1 rhythm)."""
     from app.models import Pitch, Note, Duration, VoiceLine
     from app.services.second_species_generator import generate_second_species
@@ -214,7 +616,15 @@ async def generate_second_species_endpoint(request: GenerateSecondSpeciesRequest
         species_per_voice=[SpeciesType.SECOND]
     )
     
-    solution = generate_second_species(problem, seed=request.seed)
+    if request.portfolio:
+        solution = (await solve_portfolio("second", problem, seed=request.seed, deadline=deadline)).solution
+    else:
+        solution = warm_pools.take("second", problem, {"beam_width": request.beam_width}) if request.seed is None else None
+        if solution is None:
+            solution = await run_generation(lambda: generate_adaptive(
+                generate_second_species, problem, seed=request.seed, beam_width=request.beam_width,
+                deadline=deadline
+            ))
     
     if not solution:
         raise HTTPException(status_code=500, detail="Failed to generate second species counterpoint")
@@ -222,11 +632,6 @@ async def generate_second_species_endpoint(request: GenerateSecondSpeciesRequest
     violations = evaluate_second_species(cf, solution.voice_lines[1])
     solution.diagnostics = violations
     
-    try:
-        logger.log_generation(solution, request.model_dump(), "generate-second-species")
-    except Exception as e:
-        print(f"Logging error: {e}")
-    
     return GenerateSecondSpeciesResponse(
         cf_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[0].notes],
         cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[1].notes],
@@ -234,12 +639,14 @@ async def generate_second_species_endpoint(request: GenerateSecondSpeciesRequest
             "rule_code": v.rule_code,
             "description": v.description,
             "severity": v.severity.value
-        } for v in violations]
+        } for v in violations],
+        complete=solution.complete
     )
 
 
 @router.post("/generate-third-species", response_model=GenerateThirdSpeciesResponse)
-async def generate_third_species_endpoint(request: GenerateThirdSpeciesRequest):
+@_cached("generate-third-species", transposable=True, species=SpeciesType.THIRD)
+async def generate_third_species_endpoint(request: GenerateThirdSpeciesRequest, deadline: Deadline | None = None):
     """Generate third species counterpoint (4:1 rhythm)."""
     from app.models import Pitch, Note, Duration, VoiceLine
     from app.services.third_species_generator import generate_third_species
@@ -258,7 +665,15 @@ async def generate_third_species_endpoint(request: GenerateThirdSpeciesRequest):
         species_per_voice=[SpeciesType.THIRD]
     )
     
-    solution = generate_third_species(problem, seed=request.seed)
+    if request.portfolio:
+        solution = (await solve_portfolio("third", problem, seed=request.seed, deadline=deadline)).solution
+    else:
+        solution = warm_pools.take("third", problem, {"beam_width": request.beam_width}) if request.seed is None else None
+        if solution is None:
+            solution = await run_generation(lambda: generate_adaptive(
+                generate_third_species, problem, seed=request.seed, beam_width=request.beam_width,
+                deadline=deadline
+            ))
     
     if not solution:
         raise HTTPException(status_code=500, detail="Failed to generate third species counterpoint")
@@ -266,11 +681,6 @@ async def generate_third_species_endpoint(request: GenerateThirdSpeciesRequest):
     violations = evaluate_third_species(cf, solution.voice_lines[1])
     solution.diagnostics = violations
     
-    try:
-        logger.log_generation(solution, request.model_dump(), "generate-third-species")
-    except Exception as e:
-        print(f"Logging error: {e}")
-    
     return GenerateThirdSpeciesResponse(
         cf_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[0].notes],
         cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[1].notes],
@@ -278,12 +688,14 @@ async def generate_third_species_endpoint(request: GenerateThirdSpeciesRequest):
             "rule_code": v.rule_code,
             "description": v.description,
             "severity": v.severity.value
-        } for v in violations]
+        } for v in violations],
+        complete=solution.complete
     )
 
 
 @router.post("/generate-fifth-species", response_model=GenerateFifthSpeciesResponse)
-async def generate_fifth_species_endpoint(request: GenerateFifthSpeciesRequest):
+@_cached("generate-fifth-species", transposable=True, species=SpeciesType.FIFTH)
+async def generate_fifth_species_endpoint(request: GenerateFifthSpeciesRequest, deadline: Deadline | None = None):
     """Generate fifth species counterpoint (florid with mixed rhythms)."""
     from app.models import Pitch, Note, Duration, VoiceLine
     from app.services.fifth_species_generator import generate_fifth_species
@@ -302,7 +714,15 @@ async def generate_fifth_species_endpoint(request: GenerateFifthSpeciesRequest):
         species_per_voice=[SpeciesType.FIFTH]
     )
     
-    solution = generate_fifth_species(problem, seed=request.seed)
+    if request.portfolio:
+        solution = (await solve_portfolio("fifth", problem, seed=request.seed, deadline=deadline)).solution
+    else:
+        solution = warm_pools.take("fifth", problem, {"beam_width": request.beam_width}) if request.seed is None else None
+        if solution is None:
+            solution = await run_generation(lambda: generate_adaptive(
+                generate_fifth_species, problem, seed=request.seed, beam_width=request.beam_width,
+                deadline=deadline
+            ))
     
     if not solution:
         raise HTTPException(status_code=500, detail="Failed to generate fifth species counterpoint")
@@ -310,11 +730,6 @@ async def generate_fifth_species_endpoint(request: GenerateFifthSpeciesRequest):
     violations = evaluate_fifth_species(cf, solution.voice_lines[1])
     solution.diagnostics = violations
     
-    try:
-        logger.log_generation(solution, request.model_dump(), "generate-fifth-species")
-    except Exception as e:
-        print(f"Logging error: {e}")
-    
     return GenerateFifthSpeciesResponse(
         cf_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[0].notes],
         cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[1].notes],
@@ -322,12 +737,14 @@ async def generate_fifth_species_endpoint(request: GenerateFifthSpeciesRequest):
             "rule_code": v.rule_code,
             "description": v.description,
             "severity": v.severity.value
-        } for v in violations]
+        } for v in violations],
+        complete=solution.complete
     )
 
 
 @router.post("/generate-multi-voice", response_model=GenerateMultiVoiceResponse)
-async def generate_multi_voice_endpoint(request: GenerateMultiVoiceRequest):
+@_cached("generate-multi-voice", species=SpeciesType.FIRST)
+async def generate_multi_voice_endpoint(request: GenerateMultiVoiceRequest, deadline: Deadline | None = None):
     """Generate 3-4 voice first species counterpoint."""
     from app.models import Pitch, Note, Duration, VoiceLine
     from app.services.multi_voice_rules import evaluate_multi_voice
@@ -345,12 +762,27 @@ async def generate_multi_voice_endpoint(request: GenerateMultiVoiceRequest):
         species_per_voice=[SpeciesType.FIRST] * (request.num_voices - 1)
     )
     
-    solution = generate_multi_voice_first_species(
-        problem,
-        num_voices=request.num_voices,
-        seed=request.seed,
-        use_bass=request.use_bass
-    )
+    if request.portfolio:
+        solution = (await solve_portfolio(
+            "multi_voice",
+            problem,
+            seed=request.seed,
+            options={"num_voices": request.num_voices, "use_bass": request.use_bass},
+            deadline=deadline
+        )).solution
+    else:
+        solution = warm_pools.take(
+            "multi_voice", problem, {"num_voices": request.num_voices, "use_bass": request.use_bass}
+        ) if request.seed is None else None
+        if solution is None:
+            solution = await run_generation(lambda: generate_adaptive(
+                generate_multi_voice_first_species,
+                problem,
+                num_voices=request.num_voices,
+                seed=request.seed,
+                use_bass=request.use_bass,
+                deadline=deadline
+            ))
     
     if not solution:
         raise HTTPException(status_code=500, detail="Failed to generate multi-voice counterpoint")
@@ -375,5 +807,227 @@ async def generate_multi_voice_endpoint(request: GenerateMultiVoiceRequest):
             "rule_code": v.rule_code,
             "description": v.description,
             "severity": v.severity.value
-        } for v in violations]
+        } for v in violations],
+        complete=solution.complete
+    )
+
+
+@router.post("/generate-batch", response_model=GenerateBatchResponse)
+@_cached("generate-batch", transposable=True, species=SpeciesType.FIRST, lane=BULK, stepwise=True)
+async def generate_batch_endpoint(request: GenerateBatchRequest, deadline: Deadline | None = None):
+    """Generate several distinct counterpoints to one CF in one request."""
+    from app.models import Pitch, Note, Duration, VoiceLine
+    
+    if request.species == SpeciesType.FOURTH:
+        raise HTTPException(status_code=422, detail="Batch generation does not support fourth species")
+    
+    key = Key(tonic=request.tonic, mode=request.mode)
+    
+    # Reconstruct CF
+    cf_notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in request.cf_notes]
+    cf = VoiceLine(notes=cf_notes, voice_index=0, voice_range=request.cf_voice_range)
+    
+    problem = CounterpointProblem(
+        key=key,
+        cantus_firmus=cf,
+        num_voices=2,
+        species_per_voice=[request.species]
     )
+    
+    # One admitted generation job per solution
+    batch = iter_batch(request.species.value, problem, request.count, seed=request.seed, deadline=deadline)
+    solutions = []
+    try:
+        while True:
+            async with AsyncExitStack() as admitted:
+                await _admit_step(admitted, request, deadline)
+                solution = await run_generation(next, batch, None)
+            if solution is None:
+                break
+            solutions.append(solution)
+    finally:
+        try:
+            batch.close()
+        except ValueError:
+            # Cancelled while a solution is still being found; nothing resumes it after that
+            pass
+    
+    if not solutions:
+        raise HTTPException(status_code=500, detail="Failed to generate counterpoint")
+    
+    evaluate = SPECIES_EVALUATORS[request.species]
+    results = []
+    for solution in solutions:
+        violations = evaluate(cf, solution.voice_lines[1])
+        solution.diagnostics = violations
+        results.append(BatchSolution(
+            cp_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in solution.voice_lines[1].notes],
+            violations=[{
+                "rule_code": v.rule_code,
+                "description": v.description,
+                "severity": v.severity.value
+            } for v in violations],
+            complete=solution.complete
+        ))
+    
+    return GenerateBatchResponse(
+        cf_notes=[{"midi": n.pitch.midi, "duration": n.duration.value} for n in cf.notes],
+        solutions=results,
+        count=len(results)
+    )
+
+
+@router.post("/generate-stream")
+async def generate_stream_endpoint(
+    request: GenerateStreamRequest,
+    http_request: Request,
+    x_deadline_ms: int | None = Header(default=None)
+):
+    """Stream distinct counterpoints as NDJSON lines or Server-Sent Events.
+
+    Each solution is sent as soon as it is found, as a `solution` event; a
+    final `done` event gives the number sent. Generation runs one solution
+    at a time on the generation thread and only when the client is ready for
+    more, and stops when the client disconnects. Streams queue in the bulk
+    scheduler and admission lane (see `_priority`).
+
+    Each solution is admitted (see admission.py) while it is generated, and
+    the first before the stream starts, so a busy service still answers 429
+    or 503. If a later solution is refused, the stream ends with an `error`
+    event giving the status code, detail and Retry-After seconds.
+    """
+    from app.models import Pitch, Note, Duration, VoiceLine
+    deadline = _deadline(request.deadline_ms, x_deadline_ms)
+    
+    if request.species == SpeciesType.FOURTH:
+        raise HTTPException(status_code=422, detail="Streaming generation does not support fourth species")
+    
+    key = Key(tonic=request.tonic, mode=request.mode)
+    if request.all_keys and any(m % 12 not in key.get_scale_degrees() for m in request.cf_notes):
+        raise HTTPException(status_code=422, detail="Transposing to all keys needs a CF within its key")
+    
+    # Reconstruct CF
+    cf_notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in request.cf_notes]
+    cf = VoiceLine(notes=cf_notes, voice_index=0, voice_range=request.cf_voice_range)
+    
+    problem = CounterpointProblem(
+        key=key,
+        cantus_firmus=cf,
+        num_voices=2,
+        species_per_voice=[request.species]
+    )
+    
+    sse = request.format == "sse" or (
+        request.format is None and SSE_MEDIA_TYPE in http_request.headers.get("accept", "")
+    )
+    stream = stream_solutions(
+        request.species.value, problem, request.count,
+        keys=all_keys() if request.all_keys else None, seed=request.seed, deadline=deadline
+    )
+    
+    priority = _priority(http_request, BULK)
+    
+    first = AsyncExitStack()
+    try:
+        await _admit_step(first, request, deadline, priority.lane)
+    except AdmissionRejected as e:
+        stream.close()
+        raise _rejected(e)
+    
+    async def events():
+        sent = 0
+        admitted = first
+        try:
+            while True:
+                if admitted is None:
+                    admitted = AsyncExitStack()
+                    try:
+                        await _admit_step(admitted, request, deadline, priority.lane)
+                    except AdmissionRejected as e:
+                        yield format_event("error", {
+                            "status_code": e.status_code,
+                            "detail": e.detail,
+                            "retry_after_s": e.retry_after_s
+                        }, sse)
+                        return
+                try:
+                    item = await run_generation(next, stream, None, priority=priority)
+                finally:
+                    # Released before the solution is sent, so a slow client holds no capacity
+                    await admitted.aclose()
+                    admitted = None
+                if item is None:
+                    break
+                if await http_request.is_disconnected():
+                    return
+                item.solution.diagnostics = item.violations
+                try:
+                    logger.log_generation(item.solution, request.model_dump(), "generate-stream")
+                except Exception as e:
+                    print(f"Logging error: {e}")
+                yield format_event("solution", {
+                    "index": sent,
+                    "tonic": item.key.tonic,
+                    "mode": item.key.mode.value,
+                    "cf_notes": [{"midi": n.pitch.midi, "duration": n.duration.value}
+                                 for n in item.problem.cantus_firmus.notes],
+                    "cp_notes": [{"midi": n.pitch.midi, "duration": n.duration.value}
+                                 for n in item.solution.voice_lines[1].notes],
+                    "violations": [{
+                        "rule_code": v.rule_code,
+                        "description": v.description,
+                        "severity": v.severity.value
+                    } for v in item.violations],
+                    "complete": item.solution.complete
+                }, sse)
+                sent += 1
+            yield format_event("done", {"done": True, "count": sent}, sse)
+        finally:
+            # Stops generation and cancels pool tasks if the client went away
+            try:
+                stream.close()
+            except ValueError:
+                # Still finishing one solution in its thread; nothing resumes it after that
+                pass
+            if admitted is not None:
+                await admitted.aclose()
+    
+    # The first admission is also released after the response, in case the client went away before it started
+    return StreamingResponse(
+        events(),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        background=BackgroundTask(first.aclose)
+    )
+
+
+@router.get("/metrics")
+async def metrics():
+    """Response cache, coalescing, transposition, warm pool, admission and scheduler counters."""
+    return {
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "transposition": transposition_stats.stats(),
+        "warm_pools": warm_pools.stats(),
+        "admission": admission.stats(),
+        "scheduler": generation_scheduler.stats(),
+    }
+
+
+@router.get("/solutions/{solution_id}")
+async def get_solution(solution_id: str, http_request: Request, if_none_match: str | None = Header(default=None)):
+    """Fetch a generated solution by its content ID.
+
+    The content behind an ID never changes, so the response carries a
+    strong ETag and may be cached indefinitely; a matching If-None-Match
+    gets 304 even once the solution has left the store.
+    """
+    compact = wants_compact(http_request)
+    etag = f'"{solution_id}-compact"' if compact else f'"{solution_id}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    content = solution_store.get(solution_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired solution")
+    return encode_payload({"solution_id": solution_id, **content}, compact, headers)
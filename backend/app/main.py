@@ -7,11 +7,15 @@ Main application entry point for the counterpoint generation API.
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import time
 import logging
 from dotenv import load_dotenv
 from app.api.routes import router as api_router
+from app.services.attempt_history import history
+from app.services.portfolio import shutdown_pool
+from app.services.warm_pools import warm_pools
 
 # Load environment variables
 load_dotenv()
@@ -26,8 +30,14 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     # Startup
     print("🎵 Species Counterpoint Generator starting up...")
+    refiller = asyncio.create_task(warm_pools.run())
+    saver = asyncio.create_task(history.run())
     yield
     # Shutdown
+    refiller.cancel()
+    saver.cancel()
+    history.save()
+    shutdown_pool()
     print("🎵 Species Counterpoint Generator shutting down...")
 
 
@@ -57,7 +57,15 @@ class CounterpointSolution(BaseModel):
         description="Rule violations and warnings"
     )
     success: bool = Field(default=True, description="Whether generation succeeded")
+    complete: bool = Field(
+        default=True,
+        description="False if a deadline cut the search short and this is the best line found so far"
+    )
     message: str = Field(default="", description="Additional information about the solution")
+    search_stats: dict = Field(
+        default_factory=dict,
+        description="Statistics of the search that produced the solution, if it reports any"
+    )
     
     def has_errors(self) -> bool:
         """Check if solution has any error-level violations."""
@@ -0,0 +1,238 @@
+"""Cost estimates and admission control for generation requests.
+
+Request cost varies by orders of magnitude: an 8-note first species line
+takes milliseconds, a 16-note four-voice or fifth species request can take
+seconds. The cost model estimates a request's milliseconds from its shape,
+the same (species, voices, CF length, mode, CF range) bucket the attempt
+history uses (see attempt_history.py):
+
+- buckets with enough recorded runs use their mean recorded time;
+- other buckets use a prior per species, scaled by CF length and voices.
+
+The admission controller caps the estimated milliseconds of work running
+at once. Cheap requests are always admitted, so they stay fast under load.
+Expensive ones run while they fit in the capacity (and always when nothing
+else expensive runs); otherwise they queue. A full queue is refused at
+once (429), and a request that waits too long is refused as the service
+being busy (503). Both carry a Retry-After.
+
+Requests are admitted in the scheduler's lanes (see scheduler.py), since
+admission is where they wait longest under load:
+
+- bulk work may only use a share of the capacity (half by default), so
+  the rest is kept for interactive requests;
+- each lane queues first come first served, and queued interactive
+  requests are admitted before queued bulk ones.
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from .attempt_history import MIN_SAMPLES, AttemptHistory, Bucket, history
+from .scheduler import BULK, INTERACTIVE
+
+# Prior milliseconds per CF note for two voices, by species, and multipliers
+# for more voices; means measured over random 8- to 16-note CFs
+PRIOR_MS_PER_NOTE = {"first": 0.5, "second": 1.0, "third": 2.0, "fourth": 2.0, "fifth": 6.0}
+PRIOR_VOICE_MULTIPLIERS = {2: 1.0, 3: 150.0, 4: 1300.0}
+
+# Requests estimated at or below this many ms are never held back
+DEFAULT_CHEAP_MS = 50.0
+# Estimated ms of expensive work admitted at once; generation shares one
+# thread (see single_flight.py), so this bounds the expensive work a cheap
+# request can find ahead of it
+DEFAULT_CAPACITY_MS = 1_000.0
+# Share of the capacity bulk work may hold at once
+DEFAULT_BULK_CAPACITY_SHARE = 0.5
+DEFAULT_MAX_QUEUED = 32
+DEFAULT_QUEUE_TIMEOUT_S = 5.0
+
+
+class AdmissionRejected(Exception):
+    """A request refused by admission control."""
+
+    def __init__(self, status_code: int, detail: str, retry_after_s: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after_s = retry_after_s
+
+
+class CostModel:
+    """Estimated milliseconds per request bucket."""
+
+    def __init__(self, history: AttemptHistory = history):
+        self.history = history
+
+    def prior_ms(self, bucket: Bucket) -> float:
+        per_note = PRIOR_MS_PER_NOTE.get(bucket.species, max(PRIOR_MS_PER_NOTE.values()))
+        voices = PRIOR_VOICE_MULTIPLIERS.get(bucket.num_voices, max(PRIOR_VOICE_MULTIPLIERS.values()))
+        return per_note * bucket.length * voices
+
+    def estimate_ms(self, bucket: Bucket) -> float:
+        """Mean recorded time of the bucket, or the prior while it has few runs."""
+        entry = self.history.entry(bucket)
+        if entry["runs"] >= MIN_SAMPLES:
+            return entry["total_ms"] / entry["runs"]
+        return self.prior_ms(bucket)
+
+
+class _Waiter:
+    def __init__(self, cost_ms: float, lane: str):
+        self.cost_ms = cost_ms
+        self.lane = lane
+        self.admitted = False
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+
+class AdmissionController:
+    """Caps the estimated cost of the expensive work running at once.
+
+    State is guarded by a thread lock and waiters are woken on their own
+    event loop, so one controller can serve requests from any loop.
+    """
+
+    def __init__(
+        self,
+        capacity_ms: float = DEFAULT_CAPACITY_MS,
+        cheap_ms: float = DEFAULT_CHEAP_MS,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        queue_timeout_s: float = DEFAULT_QUEUE_TIMEOUT_S,
+        bulk_capacity_share: float = DEFAULT_BULK_CAPACITY_SHARE
+    ):
+        self.capacity_ms = capacity_ms
+        self.cheap_ms = cheap_ms
+        self.max_queued = max_queued
+        self.queue_timeout_s = queue_timeout_s
+        self.bulk_capacity_ms = capacity_ms * bulk_capacity_share
+        self._lock = threading.Lock()
+        self._running_ms = 0.0
+        self._running = 0
+        self._bulk_ms = 0.0
+        # Queues in the order they are served
+        self._queues: dict[str, deque[_Waiter]] = {INTERACTIVE: deque(), BULK: deque()}
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    @asynccontextmanager
+    async def admit(self, cost_ms: float, lane: str = INTERACTIVE):
+        """Hold a share of the capacity while the body runs."""
+        if cost_ms <= self.cheap_ms:
+            with self._lock:
+                self.admitted += 1
+            yield
+            return
+
+        waiter = None
+        with self._lock:
+            # Bulk requests also wait behind queued interactive ones
+            ahead = [self._queues[INTERACTIVE]] if lane == INTERACTIVE else list(self._queues.values())
+            if not any(ahead) and self._fits(cost_ms, lane):
+                self._start(cost_ms, lane)
+            elif self._queued_now() >= self.max_queued:
+                self.rejected_full += 1
+                raise AdmissionRejected(429, "Too many expensive requests queued", self._retry_after_s())
+            else:
+                waiter = _Waiter(cost_ms, lane)
+                self._queues[lane].append(waiter)
+                self.queued += 1
+        if waiter is not None:
+            await self._wait(waiter)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stop(cost_ms, lane)
+                self._wake()
+
+    async def _wait(self, waiter: _Waiter) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter.admitted:
+                    # Admitted just as it gave up: hand the capacity back
+                    self._stop(waiter.cost_ms, waiter.lane)
+                else:
+                    self._queues[waiter.lane].remove(waiter)
+                    waiter.future.cancel()
+                self._wake()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.rejected_timeout += 1
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise AdmissionRejected(503, "Service busy with expensive requests", self._retry_after_s())
+
+    def _fits(self, cost_ms: float, lane: str) -> bool:
+        if self._running == 0:
+            return True
+        if lane == BULK and self._bulk_ms + cost_ms > self.bulk_capacity_ms:
+            return False
+        return self._running_ms + cost_ms <= self.capacity_ms
+
+    def _start(self, cost_ms: float, lane: str = INTERACTIVE) -> None:
+        self._running_ms += cost_ms
+        self._running += 1
+        if lane == BULK:
+            self._bulk_ms += cost_ms
+        self.admitted += 1
+
+    def _stop(self, cost_ms: float, lane: str) -> None:
+        self._running_ms -= cost_ms
+        self._running -= 1
+        if lane == BULK:
+            self._bulk_ms -= cost_ms
+
+    def _wake(self) -> None:
+        """Admit queued requests in order while the head fits, interactive ones first."""
+        for queue in self._queues.values():
+            while queue and self._fits(queue[0].cost_ms, queue[0].lane):
+                waiter = queue.popleft()
+                waiter.admitted = True
+                self._start(waiter.cost_ms, waiter.lane)
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+            if queue:
+                # Nothing queued behind a waiting interactive request goes first
+                return
+
+    def _queued_now(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _retry_after_s(self) -> int:
+        queued_ms = sum(w.cost_ms for queue in self._queues.values() for w in queue)
+        return max(1, round((self._running_ms + queued_ms) / 1000))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "running_ms": round(self._running_ms, 1),
+                "bulk_running_ms": round(self._bulk_ms, 1),
+                "queued_now": self._queued_now(),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+            }
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+cost_model = CostModel()
+
+# Global controller; ADMISSION_CAPACITY_MS=0 lets only one expensive request run at a time
+admission = AdmissionController(
+    capacity_ms=float(os.getenv("ADMISSION_CAPACITY_MS", DEFAULT_CAPACITY_MS)),
+    cheap_ms=float(os.getenv("ADMISSION_CHEAP_MS", DEFAULT_CHEAP_MS)),
+    max_queued=int(os.getenv("ADMISSION_MAX_QUEUED", DEFAULT_MAX_QUEUED)),
+    queue_timeout_s=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", DEFAULT_QUEUE_TIMEOUT_S)),
+    bulk_capacity_share=float(os.getenv("ADMISSION_BULK_SHARE", DEFAULT_BULK_CAPACITY_SHARE)),
+)
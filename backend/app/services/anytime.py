@@ -0,0 +1,165 @@
+"""Wall-clock deadlines and best-effort lines for anytime generation.
+
+Generators take an optional Deadline and check it between search stages,
+between restarts and inside their long stages. Once it expires they stop
+searching and return the best line the search had reached, marked
+`complete=False`, instead of running out their attempt budget, so request
+latency is bounded by the deadline rather than by search luck.
+
+The stages offer what they reach to a BestSoFar: complete lines that
+failed evaluation, with their violation cost, and the partial lines of
+dead ends and of beams cut short. At the deadline:
+
+- the complete line with the lowest violation cost is returned as it is;
+- failing that, the longest partial line is completed note by note with
+  the legal pitch nearest the previous one (see repair.line_domains) and
+  given a short, fixed repair budget;
+- if the search reached nothing, the whole line is built that way.
+
+Its remaining violations are reported with it.
+"""
+
+import time
+from typing import Optional
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointSolution
+from .bitsets import pitches_of
+from .generation_plan import plan_for
+from .repair import line_domains, repair_line, violation_cost
+
+# Longest deadline a request may ask for
+MAX_DEADLINE_MS = 60_000
+# Repair iterations spent on a best-effort line after the deadline
+BEST_EFFORT_ITERATIONS = 25
+# Measure rhythms cycled through by best-effort fifth species lines
+FIFTH_SPECIES_MEASURES = ((Duration.HALF,) * 2, (Duration.QUARTER,) * 4)
+
+
+class BestSoFar:
+    """The best line a search has reached, kept for when its deadline expires.
+
+    Any complete line beats every partial one; complete lines rank by
+    violation cost, partial lines by length.
+    """
+
+    def __init__(self):
+        self.notes: Optional[list[Note]] = None
+        self.complete = False
+        self._rank: Optional[tuple] = None
+
+    def offer(self, notes: Optional[list[Note]], violations: Optional[list] = None) -> None:
+        """Offer a complete line with its violations, or a partial line without."""
+        if not notes:
+            return
+        rank = (0, violation_cost(violations)) if violations is not None else (1, -len(notes))
+        if self._rank is None or rank < self._rank:
+            self.notes, self.complete, self._rank = list(notes), violations is not None, rank
+
+
+class Deadline:
+    """A point in wall-clock time after which generation should stop."""
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    @classmethod
+    def from_ms(cls, budget_ms: Optional[float]) -> Optional["Deadline"]:
+        """A deadline `budget_ms` from now, or None for no deadline."""
+        return None if budget_ms is None else cls(budget_ms)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def remaining_ms(self) -> float:
+        return max(0.0, (self.expires_at - time.monotonic()) * 1000)
+
+
+def expired(deadline: Optional[Deadline]) -> bool:
+    """True once an optional deadline has passed."""
+    return deadline is not None and deadline.expired()
+
+
+def species_rhythm(species: SpeciesType, num_measures: int) -> list[Duration]:
+    """Note values of a line in one species against a CF of `num_measures` notes."""
+    if species == SpeciesType.FIRST:
+        return [Duration.WHOLE] * num_measures
+    if species in (SpeciesType.SECOND, SpeciesType.FOURTH):
+        return [Duration.HALF] * (num_measures * 2)
+    if species == SpeciesType.THIRD:
+        return [Duration.QUARTER] * (num_measures * 4)
+    # Fifth species: whole notes at the ends, alternating halves and quarters between
+    durations = [Duration.WHOLE]
+    for measure in range(1, num_measures - 1):
+        durations.extend(FIFTH_SPECIES_MEASURES[measure % 2])
+    if num_measures > 1:
+        durations.append(Duration.WHOLE)
+    return durations
+
+
+def _remaining_durations(prefix: list[Note], durations: list[Duration]) -> Optional[list[Duration]]:
+    """The species rhythm after a prefix, or None if the prefix ends inside one of its notes."""
+    prefix_beats = sum(note.duration.to_beats() for note in prefix)
+    beats = 0.0
+    for idx, duration in enumerate(durations):
+        if beats >= prefix_beats:
+            return durations[idx:] if beats == prefix_beats else None
+        beats += duration.to_beats()
+    return [] if beats == prefix_beats else None
+
+
+def best_effort_line(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType,
+    prefix: Optional[list[Note]] = None
+) -> list[Note]:
+    """A partial line completed in the species rhythm without search, then briefly repaired.
+
+    A prefix that ends inside a note of the species rhythm is cut back to
+    where it fits, at worst to nothing.
+    """
+    plan = plan_for(cf, key, cp_range)
+    durations = species_rhythm(species, len(cf.notes))
+    prefix = list(prefix or [])
+    while (remaining := _remaining_durations(prefix, durations)) is None:
+        prefix.pop()
+    if prefix and prefix[-1].tie:
+        # Nothing continues the tie of a cut-back line
+        prefix[-1] = prefix[-1].model_copy(update={"tie": False})
+
+    placeholder = Pitch.from_midi(plan.scale_pitches[len(plan.scale_pitches) // 2])
+    notes = prefix + [Note(pitch=placeholder, duration=d) for d in remaining]
+    domains = line_domains(cf, notes, key, cp_range, species)
+
+    prev = prefix[-1].pitch.midi if prefix else None
+    for idx in range(len(prefix), len(notes)):
+        pitches = pitches_of(domains[idx]) or list(plan.scale_pitches)
+        if prev is None:
+            midi = pitches[len(pitches) // 2]
+        else:
+            midi = min(pitches, key=lambda m: (abs(m - prev), m))
+        notes[idx] = Note(pitch=Pitch.from_midi(midi), duration=notes[idx].duration)
+        prev = midi
+
+    return repair_line(cf, notes, key, cp_range, species, BEST_EFFORT_ITERATIONS).notes
+
+
+def best_effort_solution(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType,
+    best: Optional[BestSoFar] = None
+) -> CounterpointSolution:
+    """Two-voice solution returned when a deadline expires: the best line found so far (see BestSoFar)."""
+    if best is not None and best.complete:
+        notes, message = best.notes, "Deadline expired; best line found so far"
+    elif best is not None and best.notes:
+        notes = best_effort_line(cf, key, cp_range, species, best.notes)
+        message = "Deadline expired; best partial line found so far, completed without search"
+    else:
+        notes = best_effort_line(cf, key, cp_range, species)
+        message = "Deadline expired before any line was found; line built without search"
+    cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+    return CounterpointSolution(voice_lines=[cf, cp_voice], complete=False, message=message)
@@ -0,0 +1,200 @@
+"""Attempt budgets and strategy choices learned from past requests.
+
+Generation requests are bucketed by (species, voices, CF length, mode, CF
+range), and each bucket keeps running totals of how its requests were
+solved: which strategy produced the line (see the `strategy` entry of
+CounterpointSolution.search_stats), how many greedy restarts it took, and
+how long it ran. The totals can be persisted as JSON so they survive
+restarts. They are written off the generation thread, every
+SAVE_INTERVAL_S while they change and at shutdown (see main.py), through a
+temporary file renamed over the old one. Processes sharing a file each
+write their own totals; the last to save wins.
+
+For a new unseeded request the bucket's history picks:
+
+- the greedy attempt budget: a margin over the 95th percentile of recent
+  successful attempt counts, once there are enough samples and greedy has
+  not run out of attempts in this bucket; otherwise the generator default;
+- a beam width: when greedy needs many restarts per success in a bucket,
+  the beam search runs first instead (first to third species).
+"""
+
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+from app.models import CounterpointProblem, CounterpointSolution, SpeciesType
+from .beam_search import DEFAULT_BEAM_WIDTH
+
+# Successful greedy runs needed before a bucket's budget is trusted
+MIN_SAMPLES = 20
+# Recent successful attempt counts kept per bucket
+MAX_SAMPLES = 200
+# Learned budgets are this multiple of the 95th percentile, and at least MIN_BUDGET
+BUDGET_MARGIN = 3
+MIN_BUDGET = 50
+# Greedy successes per attempt below which the beam search goes first
+LOW_SUCCESS_RATE = 0.05
+# Seconds between saves of a changed history
+SAVE_INTERVAL_S = 30.0
+
+BEAM_SPECIES = {SpeciesType.FIRST, SpeciesType.SECOND, SpeciesType.THIRD}
+
+
+class Bucket(NamedTuple):
+    """Requests expected to behave alike."""
+    species: str
+    num_voices: int
+    length: int
+    mode: str
+    voice_range: str
+
+    @classmethod
+    def for_problem(cls, problem: CounterpointProblem) -> "Bucket":
+        cf = problem.cantus_firmus
+        return cls(
+            problem.species_per_voice[0].value,
+            problem.num_voices,
+            len(cf.notes),
+            problem.key.mode.value,
+            cf.voice_range.value,
+        )
+
+    def key(self) -> str:
+        return "|".join(str(field) for field in self)
+
+
+class AdaptivePlan(NamedTuple):
+    """Generator settings for one request; None keeps the generator default."""
+    max_attempts: Optional[int] = None
+    beam_width: Optional[int] = None
+
+
+def _new_entry() -> dict:
+    return {
+        "runs": 0,
+        "failures": 0,
+        "incomplete": 0,
+        "total_ms": 0.0,
+        "strategies": {},
+        "greedy_runs": 0,
+        "greedy_successes": 0,
+        "greedy_attempts": 0,
+        "recent_attempts": [],
+    }
+
+
+class AttemptHistory:
+    """Per-bucket outcome totals, persisted to a JSON file if given a path."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self._buckets: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.path and self.path.exists():
+            try:
+                self._buckets = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                # A corrupt history only costs the learned budgets
+                self._buckets = {}
+
+    def entry(self, bucket: Bucket) -> dict:
+        """The totals of a bucket (empty if it has no history)."""
+        return self._buckets.get(bucket.key(), _new_entry())
+
+    def record(self, bucket: Bucket, solution: Optional[CounterpointSolution], elapsed_ms: float) -> None:
+        """Add one request's outcome to its bucket; it is persisted by the next save."""
+        with self._lock:
+            entry = self._buckets.setdefault(bucket.key(), _new_entry())
+            entry["runs"] += 1
+            entry["total_ms"] += elapsed_ms
+            if solution is None:
+                # Every stage ran out, greedy included
+                entry["failures"] += 1
+                entry["greedy_runs"] += 1
+            elif not solution.complete:
+                # Cut short by a deadline; says nothing about the budget
+                entry["incomplete"] += 1
+            else:
+                strategy = solution.search_stats.get("strategy", "unknown")
+                entry["strategies"][strategy] = entry["strategies"].get(strategy, 0) + 1
+                if strategy == "greedy":
+                    attempts = solution.search_stats.get("attempts", 1)
+                    entry["greedy_runs"] += 1
+                    entry["greedy_successes"] += 1
+                    entry["greedy_attempts"] += attempts
+                    entry["recent_attempts"] = (entry["recent_attempts"] + [attempts])[-MAX_SAMPLES:]
+            self._dirty = True
+
+    def plan(self, bucket: Bucket) -> AdaptivePlan:
+        """Attempt budget and beam width for a new request in a bucket."""
+        entry = self.entry(bucket)
+        if entry["greedy_successes"] < MIN_SAMPLES:
+            return AdaptivePlan()
+
+        max_attempts = None
+        if entry["greedy_runs"] == entry["greedy_successes"]:
+            recent = sorted(entry["recent_attempts"])
+            p95 = recent[min(len(recent) - 1, math.ceil(0.95 * len(recent)) - 1)]
+            max_attempts = max(MIN_BUDGET, BUDGET_MARGIN * p95)
+
+        beam_width = None
+        success_rate = entry["greedy_successes"] / max(entry["greedy_attempts"], 1)
+        has_beam = SpeciesType(bucket.species) in BEAM_SPECIES and bucket.num_voices == 2
+        if has_beam and success_rate < LOW_SUCCESS_RATE:
+            beam_width = DEFAULT_BEAM_WIDTH
+        return AdaptivePlan(max_attempts, beam_width)
+
+    def save(self) -> None:
+        """Write the history to its file if it changed since the last save."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._buckets)
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One temporary file per process, so concurrent saves never mix
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(data)
+        tmp.replace(self.path)
+
+    async def run(self) -> None:
+        """Save every SAVE_INTERVAL_S until cancelled; returns at once without a path."""
+        if self.path is None:
+            return
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL_S)
+            try:
+                await asyncio.to_thread(self.save)
+            except OSError as e:
+                print(f"Attempt history save error: {e}")
+
+
+# Global history; kept in memory unless ATTEMPT_HISTORY_PATH names a file to persist it to
+history = AttemptHistory(os.getenv("ATTEMPT_HISTORY_PATH"))
+
+
+def generate_adaptive(generate, problem: CounterpointProblem, **kwargs) -> Optional[CounterpointSolution]:
+    """Run a generator with its bucket's learned settings and record the outcome.
+
+    An explicit `beam_width` in `kwargs` wins over the learned one. Seeded
+    requests keep the generator defaults, so that their output does not
+    depend on earlier traffic; their outcome is still recorded.
+    """
+    bucket = Bucket.for_problem(problem)
+    plan = history.plan(bucket) if kwargs.get("seed") is None else AdaptivePlan()
+    if plan.max_attempts:
+        kwargs["max_attempts"] = plan.max_attempts
+    if plan.beam_width and "beam_width" in kwargs and kwargs["beam_width"] is None:
+        kwargs["beam_width"] = plan.beam_width
+    started = time.perf_counter()
+    solution = generate(problem, **kwargs)
+    history.record(bucket, solution, (time.perf_counter() - started) * 1000)
+    return solution
@@ -0,0 +1,134 @@
+"""Batch generation of several distinct solutions for one CF.
+
+The "regenerate" button and worksheet builders ask for many counterpoints
+to the same CF. A batch runs the species generator under successive seeds
+until it has `count` distinct lines, instead of one request per line. The
+CF's generation plan is compiled once and shared by every run through the
+plan cache (see generation_plan.py); with several portfolio workers
+configured for the species, runs are spread over the portfolio pool (see
+portfolio.py), keeping one task per worker in flight.
+
+Solutions are deduplicated on the pitches and rhythm of their
+counterpoint voices. Each solution costs at most a few runs before the
+batch gives up and returns what it has. `iter_batch` yields each distinct
+solution as soon as it is found, for callers that stream results.
+"""
+
+import math
+import random
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Hashable, Iterator, Optional
+from app.models import CounterpointProblem, CounterpointSolution
+from .anytime import Deadline, expired
+from .monte_carlo import RANK_TEMPERATURE
+from .portfolio import GENERATORS, PORTFOLIOS, PortfolioPool, get_pool, workers_for
+
+MAX_BATCH_COUNT = 32
+# Generator runs allowed per requested solution, covering duplicates and failures
+RUNS_PER_SOLUTION = 4
+# Request classes whose generators sample lines; batches ask them for variety
+SAMPLING_CLASSES = {"first", "second", "third"}
+
+
+def solution_key(solution: CounterpointSolution) -> Hashable:
+    """Identity of a solution: the pitches and note values of its added voices."""
+    return tuple(
+        tuple((note.pitch.midi, note.duration.value) for note in voice.notes)
+        for voice in solution.voice_lines[1:]
+    )
+
+
+def iter_batch(
+    request_class: str,
+    problem: CounterpointProblem,
+    count: int,
+    seed: Optional[int] = None,
+    options: Optional[dict] = None,
+    deadline: Optional[Deadline] = None,
+    workers: Optional[int] = None,
+    pool: Optional[PortfolioPool] = None
+) -> Iterator[CounterpointSolution]:
+    """Yield up to `count` distinct solutions, each as soon as it is found.
+
+    Run `i` uses seed `seed + i` with the request class's default strategy,
+    drawing sampled lines at random rather than best first (see
+    monte_carlo.py) so that seeds differ.
+    Incomplete (deadline) solutions only count once, and are only yielded
+    at the end if nothing complete was found. Closing the iterator early
+    cancels the pool tasks still in flight.
+    """
+    variety = {"rank_temperature": RANK_TEMPERATURE} if request_class in SAMPLING_CLASSES else {}
+    options = {**PORTFOLIOS[request_class][0].options, **variety, **(options or {})}
+    workers = workers or workers_for(request_class)
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    max_runs = count * RUNS_PER_SOLUTION
+
+    found: set[Hashable] = set()
+    fallback: Optional[CounterpointSolution] = None
+
+    def accept(solution: Optional[CounterpointSolution]) -> bool:
+        """Whether the solution is new and complete."""
+        nonlocal fallback
+        if solution is None:
+            return False
+        if not solution.complete:
+            fallback = fallback or solution
+            return False
+        key = solution_key(solution)
+        if key in found:
+            return False
+        found.add(key)
+        return True
+
+    if workers == 1:
+        for run in range(max_runs):
+            # The first run always happens; past the deadline it returns a best-effort line
+            if len(found) >= count or (run and expired(deadline)):
+                break
+            solution = GENERATORS[request_class](problem, seed=seed + run, deadline=deadline, **options)
+            if accept(solution):
+                yield solution
+    else:
+        pool = pool or get_pool()
+        run_id = pool.next_run_id()
+        strategy = PORTFOLIOS[request_class][0]
+        extra = {k: v for k, v in options.items() if k not in strategy.options}
+        budget_ms = deadline.remaining_ms() if deadline is not None else math.inf
+        submitted = 0
+
+        def submit():
+            nonlocal submitted
+            submitted += 1
+            return pool.submit(request_class, problem, strategy, seed + submitted - 1, extra, run_id, budget_ms)
+
+        pending = {submit() for _ in range(min(workers, max_runs))}
+        try:
+            while pending and len(found) < count:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not future.cancelled():
+                        solution = future.result()[0]
+                        if accept(solution) and len(found) <= count:
+                            yield solution
+                    if submitted < max_runs and len(found) < count and not expired(deadline):
+                        pending.add(submit())
+        finally:
+            pool.cancel(run_id, list(pending))
+
+    if not found and fallback is not None:
+        yield fallback
+
+
+def generate_batch(
+    request_class: str,
+    problem: CounterpointProblem,
+    count: int,
+    seed: Optional[int] = None,
+    options: Optional[dict] = None,
+    deadline: Optional[Deadline] = None,
+    workers: Optional[int] = None,
+    pool: Optional[PortfolioPool] = None
+) -> list[CounterpointSolution]:
+    """Up to `count` distinct solutions, in the order they were found (see iter_batch)."""
+    return list(iter_batch(request_class, problem, count, seed, options, deadline, workers, pool))
@@ -0,0 +1,179 @@
+"""Score-guided beam search shared by the species generators.
+
+The greedy generators keep the first legal candidate they draw. Beam search
+instead keeps the best `beam_width` partial lines, expands every one of them
+by all legal candidates at each position and prunes back to `beam_width`, so
+the width trades latency for quality predictably.
+
+Legality still comes from each generator's candidate tiers and reachability
+masks; the score only ranks legal continuations. Lines are scored by rule
+penalties that update in constant time per note (see LineScore): leaps and
+uncompensated large leaps, a shortfall against the stepwise ratio, a
+repeated climax, perfect consonances beyond their share of the strong beats,
+and skipping a preferred candidate tier.
+"""
+
+import random
+from typing import Callable, NamedTuple, Optional, Sequence
+from .bitsets import pitches_of
+from .intervals import is_perfect_consonance
+
+DEFAULT_BEAM_WIDTH = 8
+MAX_BEAM_WIDTH = 64
+
+# Thresholds shared with the melodic rule checks
+LARGE_LEAP = 7  # check_leap_compensation
+MIN_STEPWISE = 0.6  # check_step_preference
+# Most interior strong beats should be 3rds and 6ths
+MAX_PERFECT_SHARE = 0.5
+
+
+class PenaltyWeights(NamedTuple):
+    """Weights of the incremental rule penalties (lower scores are better)."""
+    leap: float = 1.0  # Per melodic interval larger than a step
+    uncompensated_leap: float = 4.0  # Large leap not followed by a step back
+    step_deficit: float = 3.0  # Per interval short of the stepwise ratio
+    repeated_climax: float = 5.0  # Highest pitch reached again after leaving it
+    perfect_excess: float = 2.0  # Per interior strong-beat perfect consonance over the share
+    tier: float = 1.5  # Per candidate tier skipped
+
+
+PENALTY_WEIGHTS = PenaltyWeights()
+
+
+class LineScore(NamedTuple):
+    """Running rule penalties of a partial line."""
+    fixed: float = 0.0  # Penalties that can no longer change
+    last: Optional[int] = None
+    count: int = 0
+    steps: int = 0
+    strong: int = 0  # Interior strong beats
+    perfect: int = 0  # Interior strong beats on perfect consonances
+    high: int = -1
+    high_at: int = -1  # Index of the latest note on the high pitch
+    climax_repeated: bool = False
+    leap: int = 0  # Last interval if it was a large leap awaiting compensation
+
+    def extend(
+        self,
+        midi: int,
+        cf_midi: int,
+        strong: bool,
+        interior: bool = True,
+        tier: int = 0,
+        weights: PenaltyWeights = PENALTY_WEIGHTS
+    ) -> "LineScore":
+        """Score one more note; `interior` is False for the first and last notes."""
+        fixed = self.fixed + tier * weights.tier
+        steps, leap = self.steps, 0
+        if self.last is not None:
+            interval = midi - self.last
+            if abs(interval) <= 2:
+                steps += 1
+            else:
+                fixed += weights.leap
+            if self.leap and (abs(interval) > 2 or interval * self.leap > 0):
+                fixed += weights.uncompensated_leap
+            if abs(interval) >= LARGE_LEAP:
+                leap = interval
+
+        high, high_at, repeated = self.high, self.high_at, self.climax_repeated
+        if midi > high:
+            high, high_at, repeated = midi, self.count, False
+        elif midi == high:
+            repeated = repeated or high_at != self.count - 1
+            high_at = self.count
+
+        counted = strong and interior
+        return LineScore(
+            fixed=fixed,
+            last=midi,
+            count=self.count + 1,
+            steps=steps,
+            strong=self.strong + counted,
+            perfect=self.perfect + (counted and is_perfect_consonance(abs(midi - cf_midi))),
+            high=high,
+            high_at=high_at,
+            climax_repeated=repeated,
+            leap=leap,
+        )
+
+    def total(self, weights: PenaltyWeights = PENALTY_WEIGHTS) -> float:
+        """Fixed penalties plus the ratio and climax terms as of this note."""
+        intervals = max(self.count - 1, 0)
+        return (
+            self.fixed
+            + weights.step_deficit * max(0.0, MIN_STEPWISE * intervals - self.steps)
+            + weights.repeated_climax * self.climax_repeated
+            + weights.perfect_excess * max(0.0, self.perfect - MAX_PERFECT_SHARE * self.strong)
+        )
+
+
+def score_line(
+    midis: Sequence[int],
+    cf_midis: Sequence[int],
+    strong: Sequence[bool],
+    weights: PenaltyWeights = PENALTY_WEIGHTS
+) -> float:
+    """Penalty of a complete line; `cf_midis` and `strong` are given per note."""
+    score = LineScore()
+    for pos, midi in enumerate(midis):
+        interior = 0 < pos < len(midis) - 1
+        score = score.extend(midi, cf_midis[pos], strong[pos], interior, weights=weights)
+    return score.total(weights)
+
+
+class BeamLine(NamedTuple):
+    """A partial line in the beam."""
+    midis: tuple[int, ...]
+    score: LineScore
+
+
+def beam_search(
+    cf_midis: Sequence[int],
+    strong: Sequence[bool],
+    expand: Callable[[tuple[int, ...], int], list[int]],
+    beam_width: int = DEFAULT_BEAM_WIDTH,
+    weights: PenaltyWeights = PENALTY_WEIGHTS,
+    deadline=None,
+    partial: Optional[Callable[[tuple[int, ...]], None]] = None
+) -> Optional[tuple[int, ...]]:
+    """Fill one pitch per position, keeping the best `beam_width` partial lines.
+
+    `cf_midis` and `strong` give the sounding CF pitch and beat strength per
+    position. `expand(midis, pos)` returns the candidate tiers (MIDI bitsets,
+    most preferred first) for the next position of a partial line; each tier
+    after the first costs `weights.tier`. Ties are broken randomly, so a seed
+    picks among equally good lines. Returns the best complete line, or None
+    if every partial line ran out of candidates or the optional
+    anytime.Deadline expired; either way the best partial line is passed to
+    `partial`, if given.
+    """
+    last_pos = len(cf_midis) - 1
+    beam = [BeamLine((), LineScore())]
+
+    def stop() -> None:
+        if partial is not None and beam[0].midis:
+            partial(beam[0].midis)
+
+    for pos, cf_midi in enumerate(cf_midis):
+        if deadline is not None and deadline.expired():
+            stop()
+            return None
+        interior = 0 < pos < last_pos
+        expansions = []
+        for line in beam:
+            seen = 0
+            for tier_idx, tier in enumerate(expand(line.midis, pos)):
+                tier &= ~seen
+                seen |= tier
+                for midi in pitches_of(tier):
+                    score = line.score.extend(midi, cf_midi, strong[pos], interior, tier_idx, weights)
+                    expansions.append((score.total(weights), random.random(), line.midis + (midi,), score))
+        if not expansions:
+            stop()
+            return None
+        expansions.sort(key=lambda e: (e[0], e[1]))
+        beam = [BeamLine(midis, score) for _, _, midis, score in expansions[:beam_width]]
+
+    return beam[0].midis
@@ -0,0 +1,115 @@
+"""Python-int bitsets over MIDI pitches 0-127 for candidate filtering.
+
+Bit `m` of a mask is set when MIDI pitch `m` is in the set. Range, scale,
+consonance, parallel-motion and reachability filters are each a mask, so a
+generator's candidate set for one step is a handful of AND operations, and a
+random candidate is drawn by indexing into the set bits.
+"""
+
+import random
+from functools import lru_cache
+from typing import Iterable, Optional
+from .intervals import is_consonant, is_perfect_consonance
+
+MIDI_MAX = 127
+ALL_PITCHES = (1 << (MIDI_MAX + 1)) - 1
+# Offsets are stored biased by this much so negative intervals can be shifted
+_OFFSET_BIAS = 24
+
+
+def mask_of(pitches: Iterable[int]) -> int:
+    """Build a mask from MIDI pitches; pitches outside 0-127 are ignored."""
+    mask = 0
+    for midi in pitches:
+        if 0 <= midi <= MIDI_MAX:
+            mask |= 1 << midi
+    return mask
+
+
+def masks_of(pitch_sets: Iterable[Iterable[int]]) -> tuple[int, ...]:
+    """Convert a per-position sequence of pitch sets, such as a reachability table."""
+    return tuple(mask_of(pitches) for pitches in pitch_sets)
+
+
+def union(masks: Iterable[int]) -> int:
+    """OR a sequence of masks together."""
+    result = 0
+    for mask in masks:
+        result |= mask
+    return result
+
+
+def pitches_of(mask: int) -> list[int]:
+    """List the pitches in a mask, ascending."""
+    pitches = []
+    while mask:
+        low = mask & -mask
+        pitches.append(low.bit_length() - 1)
+        mask ^= low
+    return pitches
+
+
+def range_mask(min_midi: int, max_midi: int) -> int:
+    """Mask of every pitch from min_midi to max_midi inclusive."""
+    min_midi, max_midi = max(min_midi, 0), min(max_midi, MIDI_MAX)
+    if min_midi > max_midi:
+        return 0
+    return ((1 << (max_midi + 1)) - 1) ^ ((1 << min_midi) - 1)
+
+
+@lru_cache(maxsize=128)
+def consonant_mask(midi: int) -> int:
+    """Mask of pitches consonant with one sounding pitch."""
+    return mask_of(m for m in range(MIDI_MAX + 1) if is_consonant(abs(m - midi)))
+
+
+@lru_cache(maxsize=64)
+def _offset_mask(intervals: tuple[int, ...]) -> int:
+    return mask_of(i + _OFFSET_BIAS for i in intervals)
+
+
+def interval_mask(prev_midi: int, intervals: tuple[int, ...]) -> int:
+    """Mask of the pitches reached from prev_midi by the given melodic intervals."""
+    shift = prev_midi - _OFFSET_BIAS
+    offsets = _offset_mask(intervals)
+    shifted = offsets << shift if shift >= 0 else offsets >> -shift
+    return shifted & ALL_PITCHES
+
+
+def parallel_mask(prev_cf: int, cf: int, prev_cp: int) -> int:
+    """Mask of pitches that would move in parallel perfects with the CF.
+
+    Matches `is_parallel_perfect`: the previous interval is perfect, both
+    voices move the same way, and the interval stays the same size.
+    """
+    prev_vert = abs(prev_cp - prev_cf)
+    cf_motion = cf - prev_cf
+    if cf_motion == 0 or not is_perfect_consonance(prev_vert):
+        return 0
+    return mask_of(
+        cp for cp in (cf + prev_vert, cf - prev_vert)
+        if (cp - prev_cp) * cf_motion > 0
+    )
+
+
+def nth_pitch(mask: int, n: int) -> int:
+    """The n-th lowest pitch in a mask (0-based)."""
+    for _ in range(n):
+        mask &= mask - 1
+    return (mask & -mask).bit_length() - 1
+
+
+def random_pitch(mask: int) -> Optional[int]:
+    """Draw a pitch uniformly from a mask by popcount indexing, or None if empty."""
+    if not mask:
+        return None
+    return nth_pitch(mask, random.randrange(mask.bit_count()))
+
+
+def pick(tiers: Iterable[int], allowed: int = ALL_PITCHES) -> Optional[int]:
+    """Draw from the first preference tier with an allowed pitch, or None."""
+    for tier in tiers:
+        tier &= allowed
+        if tier:
+            return random_pitch(tier)
+    return None
@@ -0,0 +1,158 @@
+"""Depth-first branch-and-bound for minimum-penalty counterpoint.
+
+Searches every legal line for the one with the lowest rule penalty, using
+the same penalties and weights as the beam search (see beam_search.py).
+A partial line is cut off when a lower bound on the penalty of any
+completion reaches the best complete line found so far. The bound adds
+up one admissible lower bound per penalty term:
+
+- leaps and tier fallbacks: the cheapest completion from the current
+  pitch, by a backward pass over (position, previous pitch) that drops
+  the leap-compensation term;
+- stepwise ratio: the shortfall if every remaining interval were a step;
+- perfect consonances: the excess if no remaining strong beat were perfect;
+- climax: only once no remaining position can reach above the high point.
+
+Children are explored cheapest bound first, so good lines are found early
+and most of the tree is pruned. A node budget and an optional deadline cap
+worst-case latency; if either runs out, the best line so far is returned
+and the stats say it is not proven optimal.
+
+The search requires candidates that depend only on the previous pitch, as
+in first species.
+"""
+
+import math
+import time
+from typing import Callable, Optional, Sequence
+from .anytime import Deadline, expired
+from .beam_search import MAX_PERFECT_SHARE, MIN_STEPWISE, PENALTY_WEIGHTS, LineScore, PenaltyWeights
+from .bitsets import ALL_PITCHES, pitches_of
+
+DEFAULT_MAX_NODES = 200_000
+# Nodes expanded between deadline checks
+DEADLINE_CHECK_INTERVAL = 256
+# Scores are sums of float weights; treat near-equal bounds as equal
+EPSILON = 1e-9
+
+
+def _first_tiers(tiers: list[int]) -> list[tuple[int, int]]:
+    """(tier index, pitch) pairs, each pitch at the first tier containing it."""
+    pairs, seen = [], 0
+    for tier_idx, tier in enumerate(tiers):
+        tier &= ~seen
+        seen |= tier
+        pairs.extend((tier_idx, midi) for midi in pitches_of(tier))
+    return pairs
+
+
+def branch_and_bound(
+    cf_midis: Sequence[int],
+    strong: Sequence[bool],
+    expand: Callable[[Optional[int], int], list[int]],
+    max_nodes: int = DEFAULT_MAX_NODES,
+    weights: PenaltyWeights = PENALTY_WEIGHTS,
+    deadline: Optional[Deadline] = None
+) -> tuple[Optional[tuple[int, ...]], dict]:
+    """Find the minimum-penalty line, one pitch per position.
+
+    `cf_midis` and `strong` give the sounding CF pitch and beat strength per
+    position. `expand(prev, pos)` returns the candidate tiers (MIDI bitsets,
+    most preferred first) after pitch `prev` (None at position 0).
+
+    Returns the best line found (None if there is no legal line) and search
+    statistics: nodes expanded, branches pruned, incumbent improvements, the
+    best penalty, whether it is proven optimal, and the elapsed time.
+    """
+    started = time.perf_counter()
+    num_positions = len(cf_midis)
+    last_pos = num_positions - 1
+    strong_total = sum(strong[pos] for pos in range(1, last_pos))
+    stepwise_needed = MIN_STEPWISE * max(num_positions - 1, 0)
+
+    # Transitions per (position, previous pitch), reused by the backward pass and the search
+    transitions: list[dict[Optional[int], list[tuple[int, int]]]] = [{None: _first_tiers(expand(None, 0))}]
+    for pos in range(1, num_positions):
+        previous = {midi for pairs in transitions[pos - 1].values() for _, midi in pairs}
+        transitions.append({prev: _first_tiers(expand(prev, pos)) for prev in previous})
+
+    # future[pos][prev]: cheapest leap and tier penalties from pos on, given the pitch before pos
+    future: list[dict[Optional[int], float]] = [{} for _ in range(num_positions + 1)]
+    for pos in range(last_pos, -1, -1):
+        following = future[pos + 1]
+        for prev, pairs in transitions[pos].items():
+            best = math.inf
+            for tier_idx, midi in pairs:
+                rest = following.get(midi, 0.0) if pos == last_pos else following.get(midi, math.inf)
+                leap = weights.leap if prev is not None and abs(midi - prev) > 2 else 0.0
+                best = min(best, tier_idx * weights.tier + leap + rest)
+            future[pos][prev] = best
+
+    # Pitches any later position can still reach, for the climax bound
+    later = [0] * (num_positions + 1)
+    for pos in range(last_pos, -1, -1):
+        reach = 0
+        for pairs in transitions[pos].values():
+            for _, midi in pairs:
+                reach |= 1 << midi
+        later[pos] = later[pos + 1] | reach
+
+    def bound(score: LineScore, next_pos: int, rest: float) -> float:
+        steps_possible = score.steps + (num_positions - next_pos)
+        climax_fixed = score.climax_repeated and not later[next_pos] & (ALL_PITCHES << (score.high + 1))
+        return (
+            score.fixed
+            + rest
+            + weights.step_deficit * max(0.0, stepwise_needed - steps_possible)
+            + weights.perfect_excess * max(0.0, score.perfect - MAX_PERFECT_SHARE * strong_total)
+            + weights.repeated_climax * climax_fixed
+        )
+
+    stats = {"nodes": 0, "pruned": 0, "improvements": 0}
+    best_line: Optional[tuple[int, ...]] = None
+    best_cost = math.inf
+    exhausted = False
+
+    def search(pos: int, midis: tuple[int, ...], score: LineScore) -> None:
+        nonlocal best_line, best_cost, exhausted
+        if pos == num_positions:
+            total = score.total(weights)
+            if total < best_cost - EPSILON:
+                best_line, best_cost = midis, total
+                stats["improvements"] += 1
+            return
+        if stats["nodes"] >= max_nodes or (
+            stats["nodes"] % DEADLINE_CHECK_INTERVAL == 0 and expired(deadline)
+        ):
+            exhausted = True
+            return
+        stats["nodes"] += 1
+
+        prev = midis[-1] if midis else None
+        interior = 0 < pos < last_pos
+        children = []
+        for tier_idx, midi in transitions[pos].get(prev, ()):
+            rest = 0.0 if pos == last_pos else future[pos + 1].get(midi, math.inf)
+            if rest == math.inf:
+                continue
+            child = score.extend(midi, cf_midis[pos], strong[pos], interior, tier_idx, weights)
+            children.append((bound(child, pos + 1, rest), midi, child))
+        children.sort(key=lambda c: (c[0], c[1]))
+
+        for child_bound, midi, child in children:
+            if child_bound >= best_cost - EPSILON:
+                stats["pruned"] += 1
+                continue
+            search(pos + 1, midis + (midi,), child)
+            if exhausted:
+                return
+
+    if future[0].get(None, math.inf) < math.inf:
+        search(0, (), LineScore())
+
+    stats.update(
+        penalty=round(best_cost, 6) if best_line is not None else None,
+        optimal=not exhausted,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
+    return best_line, stats
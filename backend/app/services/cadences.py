@@ -0,0 +1,211 @@
+"""Modal cadence formulas for cadence-first generation.
+
+A cadence formula is the last few counterpoint notes written as semitone
+offsets from the final tonic. The table is built once per (mode, species,
+placement) from the clausulae that suit the mode. Stepwise approaches come
+first, with the upper voice preferring the cantizans (7-8) and the lower voice
+the tenorizans (2-1) and semitone steps ahead of whole tones; approaches by
+third or fourth follow for species whose last measure must sound a consonance
+just before the final. Generators pin a realized cadence
+against the actual CF before filling the rest of the line toward it.
+"""
+
+import random
+from typing import NamedTuple
+from app.models import Mode, Scale, SpeciesType, VoiceRange
+from .intervals import is_consonant, is_imperfect_consonance, is_perfect_consonance
+from .second_species_dp import is_parallel_perfect
+from .reachability import NOTES_PER_MEASURE, reachability_for
+
+# Cadence length (in counterpoint notes, including the final) per species
+CADENCE_LENGTH = {
+    SpeciesType.FIRST: 2,
+    SpeciesType.SECOND: 3,
+    SpeciesType.THIRD: 3,
+    SpeciesType.FIFTH: 2,
+}
+
+# Widest approach to the final, in scale degrees, each species can take
+MAX_APPROACH = {
+    SpeciesType.FIRST: 2,
+    SpeciesType.SECOND: 3,
+    SpeciesType.THIRD: 2,
+    SpeciesType.FIFTH: 1,
+}
+
+class CadenceFormula(NamedTuple):
+    """Last notes of a counterpoint as scale degrees and semitones from the final."""
+    degrees: tuple[int, ...]
+    semitones: tuple[int, ...]
+
+
+def _degree_to_semitones(degree: int, intervals: list[int]) -> int:
+    octave, index = divmod(degree, 7)
+    return octave * 12 + intervals[index]
+
+
+def _degree_paths(length: int, max_approach: int) -> list[tuple[int, ...]]:
+    """Scale-degree paths moving by step or third and ending on the final."""
+    paths = [
+        (sign * approach, 0)
+        for approach in range(1, max_approach + 1)
+        for sign in (1, -1)
+    ]
+    for _ in range(length - 2):
+        paths = [
+            (path[0] + move,) + path
+            for path in paths
+            for move in (1, -1, 2, -2)
+        ]
+    return paths
+
+
+def _build_cadence_table() -> dict[tuple[Mode, SpeciesType, bool], tuple[CadenceFormula, ...]]:
+    table = {}
+    for mode in Mode:
+        intervals = Scale.from_mode(mode).intervals
+        for species, length in CADENCE_LENGTH.items():
+            formulas = []
+            for degrees in _degree_paths(length, MAX_APPROACH[species]):
+                semitones = tuple(_degree_to_semitones(d, intervals) for d in degrees)
+                moves = [abs(b - a) for a, b in zip(semitones, semitones[1:])]
+                # No melodic tritones
+                if any(m % 12 == 6 for m in moves):
+                    continue
+                formulas.append(CadenceFormula(degrees=degrees, semitones=semitones))
+
+            for above in (True, False):
+                # Steps first; upper voice: cantizans (from below), lower voice: tenorizans
+                # (from above). Semitone approaches make the strongest clausula.
+                def preference(formula: CadenceFormula) -> tuple[int, int, int]:
+                    from_below = formula.semitones[-2] < 0
+                    return (
+                        abs(formula.degrees[-2]),
+                        0 if from_below == above else 1,
+                        abs(formula.semitones[-2])
+                    )
+
+                table[(mode, species, above)] = tuple(sorted(formulas, key=preference))
+    return table
+
+
+CADENCE_TABLE = _build_cadence_table()
+
+
+def cadence_formulas(mode: Mode, species: SpeciesType, above: bool) -> tuple[CadenceFormula, ...]:
+    """Get the cadence formulas for a mode, species and voice placement."""
+    return CADENCE_TABLE.get((mode, species, above), ())
+
+
+def _fits(
+    pitches: tuple[int, ...],
+    cf_midis: list[int],
+    species: SpeciesType,
+    min_midi: int,
+    max_midi: int,
+    scale_degrees: list[int]
+) -> bool:
+    """Check a realized cadence against the CF notes it sounds over."""
+    per_measure = NOTES_PER_MEASURE[species]
+    first_pos = len(cf_midis) * per_measure - len(pitches)
+    if first_pos < 0:
+        return False
+
+    for offset, midi in enumerate(pitches):
+        if not (min_midi <= midi <= max_midi and midi % 12 in scale_degrees):
+            return False
+        pos = first_pos + offset
+        cf_midi = cf_midis[pos // per_measure]
+        vert_interval = abs(midi - cf_midi)
+        if is_consonant(vert_interval):
+            continue
+        # Fifth species pins the notes that end a measure; the lattice checks their treatment
+        if species == SpeciesType.FIFTH and offset < len(pitches) - 1:
+            continue
+        # Only an inner weak-beat note may be dissonant, as a passing tone
+        inner = 0 < offset < len(pitches) - 1
+        weak = (pos % per_measure) % 2 == 1
+        if not (inner and weak):
+            return False
+        before, after = midi - pitches[offset - 1], pitches[offset + 1] - midi
+        if abs(before) > 2 or abs(after) > 2 or before * after < 0:
+            return False
+
+    if not is_perfect_consonance(abs(pitches[-1] - cf_midis[-1])):
+        return False
+
+    # First species penultimate must be a 3rd or 6th
+    if species == SpeciesType.FIRST and not is_imperfect_consonance(abs(pitches[0] - cf_midis[-2])):
+        return False
+
+    # No parallel perfects between consecutive measures inside the cadence
+    for offset in range(1, len(pitches)):
+        pos = first_pos + offset
+        prev_pos = pos - 1
+        prev_cf = cf_midis[prev_pos // per_measure]
+        cf_midi = cf_midis[pos // per_measure]
+        if is_parallel_perfect(prev_cf, cf_midi, pitches[offset - 1], pitches[offset]):
+            return False
+    return True
+
+
+def cadence_options(
+    cf_midis: list[int],
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType
+) -> list[tuple[int, ...]]:
+    """Realize the mode's cadence formulas against a CF, best formulas first.
+
+    Formulas moving in contrary motion to the CF's own approach to the final
+    come first; realizations of equally good formulas are shuffled.
+    """
+    if species not in CADENCE_LENGTH or len(cf_midis) < 2:
+        return []
+
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = key.get_scale_degrees()
+    cf_avg = sum(cf_midis) / len(cf_midis)
+    above = (min_midi + max_midi) / 2 > cf_avg
+    cf_approach = cf_midis[-1] - cf_midis[-2]
+
+    groups: dict[tuple[int, int], list[tuple[int, ...]]] = {}
+    for rank, formula in enumerate(cadence_formulas(key.mode, species, above)):
+        for final in range(key.tonic, max_midi + 1, 12):
+            if final < min_midi:
+                continue
+            if final != cf_midis[-1] and (final > cf_midis[-1]) != above:
+                continue
+            pitches = tuple(final + s for s in formula.semitones)
+            if not _fits(pitches, cf_midis, species, min_midi, max_midi, scale_degrees):
+                continue
+            contrary = (pitches[-1] - pitches[-2]) * cf_approach < 0
+            groups.setdefault((0 if contrary else 1, rank), []).append(pitches)
+
+    options = []
+    for group_key in sorted(groups):
+        group = groups[group_key]
+        random.shuffle(group)
+        options.extend(group)
+    return options
+
+
+def cadence_masks(
+    cf_midis: list[int],
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType
+) -> list[tuple[frozenset[int], ...]]:
+    """Reachability masks that fill toward each realizable cadence.
+
+    Cadences that cannot be reached from a legal opening are dropped. The
+    unpinned mask always comes last, so cycling through the masks across
+    restarts can still find a line when no pinned cadence works out.
+    """
+    masks = []
+    for cadence in cadence_options(cf_midis, key, cp_range, species):
+        mask = reachability_for(cf_midis, key, cp_range, species, cadence)
+        if mask and mask[0]:
+            masks.append(mask)
+    masks.append(reachability_for(cf_midis, key, cp_range, species))
+    return masks
@@ -2,18 +2,51 @@
 
 import random
 from typing import Optional
-from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, CounterpointProblem, CounterpointSolution
-from .intervals import is_consonant, calculate_interval, is_perfect_consonance
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem, CounterpointSolution
+from .bitsets import ALL_PITCHES, interval_mask, masks_of, pick, union
+from .generation_plan import GenerationPlan, plan_for
+from .anytime import BestSoFar, Deadline, best_effort_solution, expired
+from .beam_search import DEFAULT_BEAM_WIDTH
+from .fifth_species_lattice import generate_fifth_species_lattice
+from .cadences import cadence_options, cadence_masks
+from .nogoods import NogoodStore
+from .repair import repair_line
+
+# Melodic intervals for the greedy fallback; quarter-note runs move by step
+MELODIC_INTERVALS = (2, -2, 1, -1, 3, -3, 4, -4, 5, -5)
+PASSING_STEPS = (2, -2, 1, -1)
+STEPS = (2, -2, 1, -1, 0)
+SMALL_LEAPS = (3, -3, 4, -4, 5, -5)
+
+# Rhythms the greedy fallback picks from, one per measure
+PATTERN_DURATIONS = {
+    'whole': (Duration.WHOLE,),
+    'two_halves': (Duration.HALF, Duration.HALF),
+    'four_quarters': (Duration.QUARTER,) * 4,
+}
 
 
 def generate_fifth_species(
     problem: CounterpointProblem,
     seed: Optional[int] = None,
-    max_attempts: int = 5000
+    max_attempts: int = 5000,
+    nogoods: Optional[NogoodStore] = None,
+    beam_width: Optional[int] = None,
+    deadline: Optional[Deadline] = None
 ) -> Optional[CounterpointSolution]:
-    """Generate fifth species counterpoint (florid with mixed rhythms)."""
+    """Generate fifth species counterpoint (florid with mixed rhythms).
+    
+    Dead ends found by failed greedy attempts are remembered in `nogoods` (a
+    fresh store per request unless one is passed in to inspect its counters).
+    `beam_width` sets the width of the rhythm-lattice beam search.
+    Once `deadline` expires the search stops and the best line found so far
+    (by the lattice or the greedy restarts) is returned with `complete=False`
+    (see anytime.py).
+    """
     if seed is not None:
         random.seed(seed)
+    if nogoods is None:
+        nogoods = NogoodStore()
     
     cf = problem.cantus_firmus
     key = problem.key
@@ -21,132 +54,163 @@ def generate_fifth_species(
     cf_avg = sum(n.pitch.midi for n in cf.notes) / len(cf.notes)
     cp_range = VoiceRange.SOPRANO if cf_avg < 60 else VoiceRange.BASS
     
-    for _ in range(max_attempts):
-        notes = _generate_fifth_species_greedy(cf, key, cp_range)
+    cf_midis = [n.pitch.midi for n in cf.notes]
+    best = BestSoFar()
+    
+    # Pin a modal cadence, then beam search the rhythm lattice toward it;
+    # greedy restarts only if every beam dies out
+    for cadence in cadence_options(cf_midis, key, cp_range, SpeciesType.FIFTH)[:3] + [()]:
+        if expired(deadline):
+            break
+        notes = generate_fifth_species_lattice(
+            cf, key, cp_range, beam_width=beam_width or DEFAULT_BEAM_WIDTH, cadence=cadence,
+            deadline=deadline, partial=best.offer
+        )
         if notes:
             cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
-            return CounterpointSolution(voice_lines=[cf, cp_voice])
+            return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "lattice"})
+    
+    masks = [masks_of(m) for m in cadence_masks(cf_midis, key, cp_range, SpeciesType.FIFTH)]
+    plan = plan_for(cf, key, cp_range)
     
+    for attempt in range(max_attempts):
+        if expired(deadline):
+            return best_effort_solution(cf, key, cp_range, SpeciesType.FIFTH, best)
+        mask_idx = attempt % len(masks)
+        notes = _generate_fifth_species_greedy(cf, key, cp_range, masks[mask_idx], nogoods, mask_idx, plan, best)
+        if notes:
+            # Greedy lines can break rules the candidate filters miss; repair them in place
+            repaired = repair_line(cf, notes, key, cp_range, SpeciesType.FIFTH, deadline=deadline)
+            if repaired.violations:
+                # A line the repair could not fix is only a fallback; try the next attempt
+                best.offer(repaired.notes, repaired.violations)
+                continue
+            notes = repaired.notes
+            cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+            return CounterpointSolution(
+                voice_lines=[cf, cp_voice], search_stats={"strategy": "greedy", "attempts": attempt + 1}
+            )
+    
+    if expired(deadline):
+        return best_effort_solution(cf, key, cp_range, SpeciesType.FIFTH, best)
     return None
 
 
-def _generate_fifth_species_greedy(cf: VoiceLine, key, cp_range: VoiceRange) -> Optional[list[Note]]:
-    """Greedy generation for fifth species."""
-    min_midi, max_midi = cp_range.get_range()
-    scale_degrees = key.get_scale_degrees()
+def _generate_fifth_species_greedy(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    reachable: Optional[tuple[int, ...]] = None,
+    nogoods: Optional[NogoodStore] = None,
+    context: int = 0,
+    plan: Optional[GenerationPlan] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Greedy generation for fifth species.
+    
+    Candidates are MIDI bitsets. The optional reachability mask (one bitset
+    per measure) constrains the last note of each measure, the one that has
+    to lead into the next measure.
+    
+    With a nogood store, a measure state is (measure, previous pitch, context)
+    and a slot state adds the rhythm pattern and slot; candidates only look
+    back at the previous note, and `context` identifies the mask. A measure
+    state becomes a nogood once every pattern from it is one. The notes
+    placed before a dead end are offered to `best`.
+    """
+    if plan is None:
+        plan = plan_for(cf, key, cp_range)
     notes = []
+    last_idx = len(cf.notes) - 1
+    
+    def measure_state(cf_idx: int, prev: Optional[int]) -> tuple:
+        return ('measure', cf_idx, prev, context)
+    
+    def slot_state(cf_idx: int, pattern: str, slot: int, prev: int) -> tuple:
+        return ('slot', cf_idx, pattern, slot, prev, context)
+    
+    def choose(tiers: list[int], allowed: int, state: tuple, next_state) -> Optional[int]:
+        if nogoods is not None:
+            allowed = nogoods.prune_mask(allowed & union(tiers), state, next_state)
+        return pick(tiers, allowed)
+    
+    def dead_end() -> None:
+        if best is not None:
+            best.offer(notes)
     
-    for cf_idx, cf_note in enumerate(cf.notes):
+    for cf_idx in range(len(cf.notes)):
         is_first = (cf_idx == 0)
-        is_last = (cf_idx == len(cf.notes) - 1)
+        is_last = (cf_idx == last_idx)
+        prev = notes[-1].pitch.midi if notes else None
+        # Only the last note of a measure is held to the reachability mask
+        leaving = reachable[cf_idx] if reachable is not None else ALL_PITCHES
         
         if is_first:
             # Start with whole note, perfect consonance
-            candidates = _get_start_candidates(cf_note, min_midi, max_midi, scale_degrees)
-            random.shuffle(candidates)
-            if not candidates:
-                return None
-            notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.WHOLE))
+            midi = choose(
+                [plan.start_mask], leaving, measure_state(cf_idx, prev), lambda c: measure_state(cf_idx + 1, c)
+            )
+            if midi is None:
+                return dead_end()
+            notes.append(Note(pitch=Pitch.from_midi(midi), duration=Duration.WHOLE))
         
         elif is_last:
             # End with whole note, tonic
-            candidates = _get_end_candidates(cf_note, notes[-1], min_midi, max_midi, key.tonic)
-            random.shuffle(candidates)
-            if not candidates:
-                return None
-            notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.WHOLE))
+            midi = choose(_get_end_candidates(plan, prev), ALL_PITCHES, measure_state(cf_idx, prev), None)
+            if midi is None:
+                return dead_end()
+            notes.append(Note(pitch=Pitch.from_midi(midi), duration=Duration.WHOLE))
         
         else:
             # Middle: mix of rhythms
-            pattern = random.choice(['whole', 'two_halves', 'four_quarters'])
+            patterns = list(PATTERN_DURATIONS)
+            if nogoods is not None:
+                patterns = [p for p in patterns if slot_state(cf_idx, p, 0, prev) not in nogoods]
+                if not patterns:
+                    nogoods.add(measure_state(cf_idx, prev))
+                    return dead_end()
+            pattern = random.choice(patterns)
+            durations = PATTERN_DURATIONS[pattern]
             
-            if pattern == 'whole':
-                # One whole note
-                candidates = _get_consonant_candidates(cf_note, notes[-1], min_midi, max_midi, scale_degrees)
-                if not candidates:
-                    return None
-                random.shuffle(candidates)
-                notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.WHOLE))
-            
-            elif pattern == 'two_halves':
-                # Two half notes
-                for _ in range(2):
-                    candidates = _get_consonant_candidates(cf_note, notes[-1], min_midi, max_midi, scale_degrees)
-                    if not candidates:
-                        return None
-                    random.shuffle(candidates)
-                    notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.HALF))
-            
-            else:  # four_quarters
-                # Four quarter notes
-                for _ in range(4):
-                    candidates = _get_stepwise_candidates(notes[-1], cf_note, min_midi, max_midi, scale_degrees)
-                    if not candidates:
-                        return None
-                    random.shuffle(candidates)
-                    notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.QUARTER))
+            for slot, duration in enumerate(durations):
+                prev_midi = notes[-1].pitch.midi
+                if pattern == 'four_quarters':
+                    # Quarter-note runs move by step
+                    tiers = _get_stepwise_candidates(plan, cf_idx, prev_midi)
+                else:
+                    tiers = _get_consonant_candidates(plan, cf_idx, prev_midi)
+                
+                if slot == len(durations) - 1:
+                    allowed = leaving
+                    next_state = lambda c: measure_state(cf_idx + 1, c)
+                else:
+                    allowed = ALL_PITCHES
+                    next_state = lambda c: slot_state(cf_idx, pattern, slot + 1, c)
+                
+                midi = choose(tiers, allowed, slot_state(cf_idx, pattern, slot, prev_midi), next_state)
+                if midi is None:
+                    return dead_end()
+                notes.append(Note(pitch=Pitch.from_midi(midi), duration=duration))
     
     return notes
 
 
-def _get_start_candidates(cf_note: Note, min_midi: int, max_midi: int, scale_degrees: list[int]) -> list[int]:
-    """Get candidates for first note (perfect consonance)."""
-    candidates = []
-    for midi in range(min_midi, max_midi + 1):
-        if midi % 12 not in scale_degrees:
-            continue
-        interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-        if is_perfect_consonance(interval):
-            candidates.append(midi)
-    return candidates
-
-
-def _get_end_candidates(cf_note: Note, prev_note: Note, min_midi: int, max_midi: int, tonic: int) -> list[int]:
-    """Get candidates for last note (tonic, perfect consonance)."""
-    candidates = []
-    for octave in range(12):
-        midi = tonic + octave * 12
-        if min_midi <= midi <= max_midi:
-            interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-            if is_perfect_consonance(interval):
-                candidates.append(midi)
-    return candidates
+def _get_end_candidates(plan: GenerationPlan, prev_midi: int) -> list[int]:
+    """Get candidates for last note (tonic, perfect consonance, prefer stepwise)."""
+    step = plan.finals_mask & interval_mask(prev_midi, STEPS)
+    leap = plan.finals_mask & interval_mask(prev_midi, SMALL_LEAPS)
+    return [step, leap]
 
 
-def _get_consonant_candidates(cf_note: Note, prev_note: Note, min_midi: int, max_midi: int, scale_degrees: list[int]) -> list[int]:
-    """Get consonant candidates with stepwise preference."""
-    candidates = []
-    prev_midi = prev_note.pitch.midi
-    
-    # Prefer stepwise
-    for interval in [2, -2, 1, -1, 3, -3, 4, -4, 5, -5]:
-        midi = prev_midi + interval
-        if min_midi <= midi <= max_midi and midi % 12 in scale_degrees:
-            vert_interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-            if is_consonant(vert_interval):
-                candidates.append(midi)
-    
-    return candidates
+def _get_consonant_candidates(plan: GenerationPlan, cf_idx: int, prev_midi: int) -> list[int]:
+    """Get consonant candidates, as bitset tiers."""
+    return [interval_mask(prev_midi, MELODIC_INTERVALS) & plan.consonant_masks[cf_idx]]
 
 
-def _get_stepwise_candidates(prev_note: Note, cf_note: Note, min_midi: int, max_midi: int, scale_degrees: list[int]) -> list[int]:
-    """Get stepwise candidates (for quarter note runs)."""
-    candidates = []
-    prev_midi = prev_note.pitch.midi
-    
-    for interval in [2, -2, 1, -1]:
-        midi = prev_midi + interval
-        if min_midi <= midi <= max_midi and midi % 12 in scale_degrees:
-            vert_interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-            if is_consonant(vert_interval):
-                candidates.append(midi)
+def _get_stepwise_candidates(plan: GenerationPlan, cf_idx: int, prev_midi: int) -> list[int]:
+    """Get stepwise candidates (for quarter note runs), as bitset tiers."""
+    consonant = plan.consonant_masks[cf_idx]
+    stepwise = interval_mask(prev_midi, PASSING_STEPS) & consonant
     
     # If no stepwise consonances, allow any consonance
-    if not candidates:
-        for midi in range(min_midi, max_midi + 1):
-            if midi % 12 in scale_degrees:
-                vert_interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-                if is_consonant(vert_interval):
-                    candidates.append(midi)
-    
-    return candidates
+    return [stepwise] if stepwise else [consonant]
@@ -0,0 +1,335 @@
+"""Rhythm-lattice beam search for fifth species (florid counterpoint).
+
+Each measure is filled by a rhythmic template from a precomputed lattice:
+whole notes, halves, quarters, mixed halves and quarters, eighth-note pairs
+and tied syncopations. Templates are bound to pitch cells, reusing the second
+species measure cells and the third species figure library where the rhythm
+matches, so the search only ever combines measures that are legal inside
+themselves. The search runs measure by measure and keeps the best
+`beam_width` partial lines by score, which bounds latency by the beam width.
+Scores combine the shared rule penalties of beam_search.py with rhythmic
+variety terms.
+"""
+
+import random
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, Key, Mode, SpeciesType
+from .beam_search import DEFAULT_BEAM_WIDTH, LineScore
+from .intervals import is_consonant, is_perfect_consonance
+from .reachability import cadence_slots
+from .second_species_dp import enumerate_measure_cells, is_parallel_perfect
+from .third_species_figures import build_figure_library
+
+# Pitch cells tried per (partial line, template) expansion
+SAMPLES_PER_TEMPLATE = 4
+# Melodic intervals between notes; leaps of a 4th are kept for longer values
+MELODIC_INTERVALS = [2, -2, 1, -1, 3, -3, 4, -4, 5, -5]
+
+
+class RhythmTemplate(NamedTuple):
+    """Rhythm of one measure against one CF note."""
+    name: str
+    durations: tuple[Duration, ...]
+    tied_in: bool = False  # First note continues a tie from the previous measure
+    tied_out: bool = False  # Last note is tied into the next measure
+
+
+RHYTHM_LATTICE: tuple[RhythmTemplate, ...] = (
+    RhythmTemplate("whole", (Duration.WHOLE,)),
+    RhythmTemplate("two_halves", (Duration.HALF, Duration.HALF)),
+    RhythmTemplate("four_quarters", (Duration.QUARTER,) * 4),
+    RhythmTemplate("half_two_quarters", (Duration.HALF, Duration.QUARTER, Duration.QUARTER)),
+    RhythmTemplate("two_quarters_half", (Duration.QUARTER, Duration.QUARTER, Duration.HALF)),
+    RhythmTemplate("half_eighths_quarter", (Duration.HALF, Duration.EIGHTH, Duration.EIGHTH, Duration.QUARTER)),
+    RhythmTemplate("quarter_eighths_half", (Duration.QUARTER, Duration.EIGHTH, Duration.EIGHTH, Duration.HALF)),
+    RhythmTemplate("half_tied", (Duration.HALF, Duration.HALF), tied_out=True),
+    RhythmTemplate("two_quarters_tied", (Duration.QUARTER, Duration.QUARTER, Duration.HALF), tied_out=True),
+    RhythmTemplate("tied_half", (Duration.HALF, Duration.HALF), tied_in=True),
+    RhythmTemplate("tied_two_quarters", (Duration.HALF, Duration.QUARTER, Duration.QUARTER), tied_in=True),
+    RhythmTemplate("tied_half_tied", (Duration.HALF, Duration.HALF), tied_in=True, tied_out=True),
+)
+
+TEMPLATES = {template.name: template for template in RHYTHM_LATTICE}
+
+# Lattice edges: a tie must be continued, and only a tie may be continued
+SUCCESSORS: dict[bool, tuple[RhythmTemplate, ...]] = {
+    tied: tuple(t for t in RHYTHM_LATTICE if t.tied_in == tied)
+    for tied in (False, True)
+}
+
+
+class LineState(NamedTuple):
+    """A partial fifth species line in the beam."""
+    notes: tuple[tuple[int, Duration, bool], ...]  # (midi, duration, tie)
+    score: float  # Rhythmic terms and tie-breaking noise
+    rules: LineScore  # Melodic and harmonic rule penalties
+    template: str
+    downbeat: int  # Pitch on the last downbeat
+    passing: int  # Direction a dissonant last note must keep moving, else 0
+    leapt: bool  # Last note was approached by leap
+
+
+def _onsets(durations: tuple[Duration, ...]) -> list[float]:
+    onsets, beat = [], 0.0
+    for duration in durations:
+        onsets.append(beat)
+        beat += duration.to_beats()
+    return onsets
+
+
+def _in_key(midi: int, min_midi: int, max_midi: int, scale_degrees: list[int]) -> bool:
+    return min_midi <= midi <= max_midi and midi % 12 in scale_degrees
+
+
+@lru_cache(maxsize=2048)
+def pitch_cells(
+    template_name: str,
+    cf_midi: int,
+    tonic: int,
+    mode: Mode,
+    cp_range: VoiceRange
+) -> tuple[tuple[int, ...], ...]:
+    """All pitch sequences legal inside one measure for a rhythmic template."""
+    template = TEMPLATES[template_name]
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = Key(tonic=tonic, mode=mode).get_scale_degrees()
+    consonances = [
+        m for m in range(min_midi, max_midi + 1)
+        if m % 12 in scale_degrees and is_consonant(abs(m - cf_midi))
+    ]
+
+    if template_name == "whole":
+        return tuple((m,) for m in consonances)
+    if template_name == "two_halves":
+        cells = enumerate_measure_cells(cf_midi, consonances, min_midi, max_midi, scale_degrees)
+        return tuple((c.strong, c.weak) for c in cells)
+    if template_name == "four_quarters":
+        library = build_figure_library(cf_midi, tonic, mode, cp_range)
+        return tuple(f.pitches for f in library.figures)
+
+    # Mixed rhythms: enumerate slot by slot
+    onsets = _onsets(template.durations)
+    cells = []
+
+    def extend(prefix: list[int]) -> None:
+        slot = len(prefix)
+        if slot == len(onsets):
+            cells.append(tuple(prefix))
+            return
+        if slot == 0:
+            options = consonances
+        else:
+            options = [prefix[-1] + i for i in MELODIC_INTERVALS[:8]]
+        for midi in options:
+            if not _in_key(midi, min_midi, max_midi, scale_degrees):
+                continue
+            if not _slot_ok(prefix, midi, slot, onsets, template, cf_midi):
+                continue
+            prefix.append(midi)
+            extend(prefix)
+            prefix.pop()
+
+    extend([])
+    return tuple(cells)
+
+
+def _slot_ok(
+    prefix: list[int],
+    midi: int,
+    slot: int,
+    onsets: list[float],
+    template: RhythmTemplate,
+    cf_midi: int
+) -> bool:
+    """Check one note of a mixed-rhythm cell against the notes before it."""
+    consonant = is_consonant(abs(midi - cf_midi))
+    is_eighth = template.durations[slot] == Duration.EIGHTH
+    # Notes on beats 1 and 3 must be consonant; tied notes must be consonant too
+    if onsets[slot] in (0.0, 2.0) and not consonant:
+        return False
+    if template.tied_out and slot == len(onsets) - 1 and not consonant:
+        return False
+    if slot == 0:
+        return True
+
+    interval = midi - prefix[-1]
+    # Eighth notes move by step
+    if (is_eighth or template.durations[slot - 1] == Duration.EIGHTH) and abs(interval) > 2:
+        return False
+    if slot >= 2:
+        before = prefix[-1] - prefix[-2]
+        # No note approached and left by leap
+        if abs(before) > 2 and abs(interval) > 2:
+            return False
+        # A dissonance is left by step, continuing (passing) or returning (neighbour)
+        if not is_consonant(abs(prefix[-1] - cf_midi)):
+            if abs(interval) > 2 or (interval * before < 0 and midi != prefix[-2]):
+                return False
+    if not consonant and abs(interval) > 2:
+        return False
+    return True
+
+
+def _entry_ok(state: LineState, cell: tuple[int, ...], template: RhythmTemplate, prev_cf: int, cf: int) -> bool:
+    """Check how a pitch cell connects to the end of a partial line."""
+    last = state.notes[-1][0]
+    entry = cell[0]
+    if template.tied_in:
+        return entry == last
+
+    interval = entry - last
+    if interval not in MELODIC_INTERVALS:
+        return False
+    if state.passing and (abs(interval) > 2 or interval * state.passing < 0):
+        if not (len(state.notes) > 1 and entry == state.notes[-2][0]):
+            return False
+    if state.leapt and abs(interval) > 2:
+        return False
+    if abs(interval) > 2 and len(cell) > 1 and abs(cell[1] - cell[0]) > 2:
+        return False
+    if is_parallel_perfect(prev_cf, cf, state.downbeat, entry):
+        return False
+    if is_parallel_perfect(prev_cf, cf, last, entry):
+        return False
+    return True
+
+
+def _extend_state(
+    state: LineState,
+    cell: tuple[int, ...],
+    template: RhythmTemplate,
+    cf_midi: int,
+    interior: bool = True
+) -> LineState:
+    """Append a measure to a line and score it incrementally (lower is better)."""
+    notes = list(state.notes)
+    score = state.score
+    rules = state.rules
+    for slot, onset in enumerate(_onsets(template.durations)):
+        midi = cell[slot]
+        if not (template.tied_in and slot == 0):
+            rules = rules.extend(midi, cf_midi, onset in (0.0, 2.0), interior)
+        notes.append((midi, template.durations[slot], False))
+
+    # Reward rhythmic variety across measures and florid motion
+    if template.name == state.template:
+        score += 1.5
+    if template.name == "whole":
+        score += 1.0
+    score += random.random()
+
+    last = cell[-1]
+    before = notes[-2][0] if len(notes) > 1 else last
+    passing = 0
+    if not is_consonant(abs(last - cf_midi)):
+        passing = 1 if last > before else -1
+    if template.tied_out:
+        notes[-1] = (last, notes[-1][1], True)
+
+    return LineState(
+        notes=tuple(notes),
+        score=score,
+        rules=rules,
+        template=template.name,
+        downbeat=cell[0],
+        passing=passing,
+        leapt=abs(last - before) > 2,
+    )
+
+
+def generate_fifth_species_lattice(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    beam_width: int = DEFAULT_BEAM_WIDTH,
+    cadence: tuple[int, ...] = (),
+    deadline=None,
+    partial: Optional[Callable[[list[Note]], None]] = None
+) -> Optional[list[Note]]:
+    """Generate a florid line by beam search over the rhythm lattice.
+
+    A non-empty `cadence` pins the last note of each closing measure.
+    Returns the best-scoring complete line, or None if every beam died out
+    or the optional anytime.Deadline expired; either way the best partial
+    line is passed to `partial`, if given.
+    """
+    cf_midis = [n.pitch.midi for n in cf.notes]
+    pinned = {
+        cf_idx: midi
+        for cf_idx, _, midi in cadence_slots(cadence, len(cf_midis), SpeciesType.FIFTH)
+    }
+    min_midi, max_midi = cp_range.get_range()
+    last_idx = len(cf_midis) - 1
+    finals = [
+        m for m in range(key.tonic, max_midi + 1, 12)
+        if m >= min_midi and is_perfect_consonance(abs(m - cf_midis[last_idx]))
+    ]
+    if last_idx in pinned:
+        finals = [m for m in finals if m == pinned[last_idx]]
+    beam = [LineState(notes=(), score=0.0, rules=LineScore(), template="", downbeat=0, passing=0, leapt=False)]
+
+    def stop() -> None:
+        if partial is not None and beam[0].notes:
+            partial(_to_notes(beam[0]))
+
+    for cf_idx, cf_midi in enumerate(cf_midis):
+        if deadline is not None and deadline.expired():
+            stop()
+            return None
+        expansions = []
+        for state in beam:
+            tied = bool(state.notes) and state.notes[-1][2]
+            if cf_idx == last_idx:
+                # Cadence: whole-note tonic final in perfect consonance
+                templates = [TEMPLATES["whole"]]
+            else:
+                # Nothing may be tied into the final
+                templates = [
+                    t for t in SUCCESSORS[tied]
+                    if not (t.tied_out and cf_idx == last_idx - 1)
+                ]
+
+            for template in templates:
+                cells = pitch_cells(template.name, cf_midi, key.tonic, key.mode, cp_range)
+                if cf_idx == 0:
+                    cells = [c for c in cells if is_perfect_consonance(abs(c[0] - cf_midi))]
+                elif cf_idx == last_idx:
+                    cells = [c for c in cells if c[0] in finals]
+                if cf_idx in pinned:
+                    cells = [c for c in cells if c[-1] == pinned[cf_idx]]
+                if template.tied_out:
+                    next_cf = cf_midis[cf_idx + 1]
+                    cells = [c for c in cells if is_consonant(abs(c[-1] - next_cf))]
+                if state.notes:
+                    cells = [
+                        c for c in cells
+                        if _entry_ok(state, c, template, cf_midis[cf_idx - 1], cf_midi)
+                    ]
+                if cf_idx == last_idx - 1:
+                    # Penultimate measure must approach a final by step
+                    cells = [c for c in cells if any(0 < abs(f - c[-1]) <= 2 for f in finals)]
+
+                for cell in random.sample(cells, min(len(cells), SAMPLES_PER_TEMPLATE)):
+                    expanded = _extend_state(state, cell, template, cf_midi, 0 < cf_idx < last_idx)
+                    if cf_idx == last_idx - 1 and not any(
+                        _entry_ok(expanded, (final,), TEMPLATES["whole"], cf_midi, cf_midis[last_idx])
+                        for final in finals
+                    ):
+                        continue
+                    expansions.append(expanded)
+
+        if not expansions:
+            stop()
+            return None
+        expansions.sort(key=lambda s: s.score + s.rules.total())
+        beam = expansions[:beam_width]
+
+    return _to_notes(beam[0])
+
+
+def _to_notes(state: LineState) -> list[Note]:
+    return [
+        Note(pitch=Pitch.from_midi(midi), duration=duration, tie=tie)
+        for midi, duration, tie in state.notes
+    ]
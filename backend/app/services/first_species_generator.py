@@ -2,19 +2,58 @@
 
 import random
 from typing import Optional
-from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, CounterpointProblem, CounterpointSolution
-from .intervals import is_consonant, calculate_interval, is_perfect_consonance
-from .motion import motion_type, MotionType
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem, CounterpointSolution
+from .anytime import BestSoFar, Deadline, best_effort_solution, expired
+from .beam_search import beam_search
+from .branch_and_bound import DEFAULT_MAX_NODES, branch_and_bound
+from .bitsets import ALL_PITCHES, interval_mask, masks_of, parallel_mask, pick, union
+from .cadences import cadence_masks
+from .generation_plan import GenerationPlan, plan_for
+from .monte_carlo import sample_lines, species_spec
+from .nogoods import NogoodStore
+from .repair import repair_line
+from .species_rules import evaluate_first_species
+
+# Melodic intervals: steps, then small leaps, 4ths and 5ths
+MELODIC_INTERVALS = (2, -2, 1, -1, 3, -3, 4, -4, 5, -5, 7, -7)
+# Moves into the final: steps are preferred over small leaps, up to a 4th
+STEPS = (2, -2, 1, -1, 0)
+SMALL_LEAPS = (3, -3, 4, -4, 5, -5)
+FINAL_APPROACH = STEPS + SMALL_LEAPS
 
 
 def generate_first_species(
     problem: CounterpointProblem,
     seed: Optional[int] = None,
-    max_attempts: int = 5000
+    max_attempts: int = 5000,
+    nogoods: Optional[NogoodStore] = None,
+    beam_width: Optional[int] = None,
+    optimize: bool = False,
+    max_nodes: int = DEFAULT_MAX_NODES,
+    deadline: Optional[Deadline] = None,
+    rank_temperature: float = 0.0
 ) -> Optional[CounterpointSolution]:
-    """Generate first species counterpoint above or below CF."""
+    """Generate first species counterpoint above or below CF.
+    
+    Dead ends found by failed attempts are remembered in `nogoods` (a fresh
+    store per request unless one is passed in to inspect its counters).
+    With `beam_width`, a score-guided beam search runs before the greedy
+    restarts (see beam_search.py). Greedy usually succeeds within a few
+    attempts, faster than sampling a batch; vectorized random walks (see
+    monte_carlo.py) only run if it runs out of attempts; `rank_temperature`
+    draws among the sampled lines for variety instead of taking the best.
+    
+    With `optimize`, branch-and-bound returns the minimum-penalty line over
+    every legal line, with the search statistics in `search_stats`; past
+    `max_nodes` it returns the best line found so far, not proven optimal.
+    
+    Once `deadline` expires the search stops and the best line found so far
+    (by any of the stages) is returned with `complete=False` (see anytime.py).
+    """
     if seed is not None:
         random.seed(seed)
+    if nogoods is None:
+        nogoods = NogoodStore()
     
     cf = problem.cantus_firmus
     key = problem.key
@@ -23,119 +62,216 @@ def generate_first_species(
     cf_avg = sum(n.pitch.midi for n in cf.notes) / len(cf.notes)
     cp_range = VoiceRange.SOPRANO if cf_avg < 60 else VoiceRange.BASS
     
-    for _ in range(max_attempts):
-        notes = _generate_greedy(cf, key, cp_range)
+    # Pin a modal cadence first, then fill the line toward it
+    masks = [masks_of(m) for m in cadence_masks([n.pitch.midi for n in cf.notes], key, cp_range, SpeciesType.FIRST)]
+    plan = plan_for(cf, key, cp_range)
+    best = BestSoFar()
+    
+    if optimize:
+        # The unpinned mask comes last and admits every pinned cadence as well
+        notes, stats = _generate_optimal(plan, masks[-1], max_nodes, deadline)
+        stats["strategy"] = "optimal"
+        if notes:
+            cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+            return CounterpointSolution(
+                voice_lines=[cf, cp_voice], search_stats=stats, complete=not expired(deadline)
+            )
+        if stats["optimal"]:
+            return None
+    
+    if beam_width:
+        for reachable in masks:
+            if expired(deadline):
+                break
+            notes = _generate_beam(plan, reachable, beam_width, deadline, best)
+            if notes:
+                cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+                return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "beam"})
+    
+    for attempt in range(max_attempts):
+        if expired(deadline):
+            return best_effort_solution(cf, key, cp_range, SpeciesType.FIRST, best)
+        mask_idx = attempt % len(masks)
+        notes = _generate_greedy(cf, key, cp_range, masks[mask_idx], nogoods, mask_idx, plan, best)
         if notes and len(notes) == len(cf.notes):
+            # Greedy lines can break rules the candidate filters miss; repair them in place
+            repaired = repair_line(cf, notes, key, cp_range, SpeciesType.FIRST, deadline=deadline)
+            if repaired.violations:
+                # A line the repair could not fix is only a fallback; try the next attempt
+                best.offer(repaired.notes, repaired.violations)
+                continue
+            notes = repaired.notes
             cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
-            return CounterpointSolution(voice_lines=[cf, cp_voice])
+            return CounterpointSolution(
+                voice_lines=[cf, cp_voice], search_stats={"strategy": "greedy", "attempts": attempt + 1}
+            )
     
+    for reachable in masks:
+        if expired(deadline):
+            break
+        notes = _generate_monte_carlo(cf, plan, reachable, cp_range, rank_temperature, deadline, best)
+        if notes:
+            cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+            return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "monte-carlo"})
+    
+    if expired(deadline):
+        return best_effort_solution(cf, key, cp_range, SpeciesType.FIRST, best)
     return None
 
 
-def _generate_greedy(cf: VoiceLine, key, cp_range: VoiceRange) -> Optional[list[Note]]:
-    """Greedy generation with randomization."""
-    min_midi, max_midi = cp_range.get_range()
-    scale_degrees = key.get_scale_degrees()
+def _generate_greedy(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    reachable: Optional[tuple[int, ...]] = None,
+    nogoods: Optional[NogoodStore] = None,
+    context: int = 0,
+    plan: Optional[GenerationPlan] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Greedy generation with randomization, pruned by an optional reachability mask.
+    
+    Candidates are MIDI bitsets; `reachable` holds one bitset per index.
+    With a nogood store, states are (index, previous pitch, context): the
+    candidates at an index depend only on the previous note, and `context`
+    identifies the reachability mask. The notes placed before a dead end
+    are offered to `best`.
+    """
+    if plan is None:
+        plan = plan_for(cf, key, cp_range)
     notes = []
+    prev_midi = None
     
-    for idx, cf_note in enumerate(cf.notes):
+    for idx in range(len(cf.notes)):
+        is_final = idx == len(cf.notes) - 1
         if idx == 0:
-            candidates = _get_start_candidates(cf_note, min_midi, max_midi, scale_degrees)
-            random.shuffle(candidates)
-        elif idx == len(cf.notes) - 1:
-            candidates = _get_end_candidates(cf_note, notes[-1], min_midi, max_midi, key.tonic)
-            random.shuffle(candidates)
+            tiers = [plan.start_mask]
+        elif is_final:
+            tiers = _get_end_candidates(plan, prev_midi)
         else:
-            candidates = _get_candidates(notes[-1], cf_note, cf.notes, idx, min_midi, max_midi, scale_degrees, notes)
-            # Candidates already shuffled within preference groups
+            tiers = _get_candidates(plan, idx, prev_midi)
         
-        if not candidates:
+        allowed = reachable[idx] if reachable is not None else ALL_PITCHES
+        if nogoods is not None:
+            allowed = nogoods.prune_mask(
+                allowed & union(tiers),
+                (idx, prev_midi, context),
+                None if is_final else lambda c: (idx + 1, c, context)
+            )
+        
+        prev_midi = pick(tiers, allowed)
+        if prev_midi is None:
+            if best is not None:
+                best.offer(notes)
             return None
         
-        notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.WHOLE))
+        notes.append(Note(pitch=Pitch.from_midi(prev_midi), duration=Duration.WHOLE))
     
     return notes
 
 
-def _get_start_candidates(cf_note: Note, min_midi: int, max_midi: int, scale_degrees: list[int]) -> list[int]:
-    """Get candidates for first note (perfect consonance)."""
-    candidates = []
-    for midi in range(min_midi, max_midi + 1):
-        if midi % 12 not in scale_degrees:
-            continue
-        interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-        if is_perfect_consonance(interval):
-            candidates.append(midi)
-    return candidates
+def _generate_monte_carlo(
+    cf: VoiceLine,
+    plan: GenerationPlan,
+    reachable: tuple[int, ...],
+    cp_range: VoiceRange,
+    rank_temperature: float = 0.0,
+    deadline: Optional[Deadline] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Batched random walks (see monte_carlo.py); the best-ranked line that passes evaluation.
+    
+    Lines that fail are offered to `best` with their violations.
+    """
+    spec = species_spec(plan, reachable, 1, MELODIC_INTERVALS, FINAL_APPROACH)
+    for midis in sample_lines(spec, temperature=rank_temperature):
+        if expired(deadline):
+            return None
+        notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in midis]
+        violations = evaluate_first_species(cf, VoiceLine(notes=notes, voice_index=1, voice_range=cp_range))
+        if not violations:
+            return notes
+        if best is not None:
+            best.offer(notes, violations)
+    return None
 
 
-def _get_end_candidates(cf_note: Note, prev_note: Note, min_midi: int, max_midi: int, tonic: int) -> list[int]:
-    """Get candidates for last note (tonic, perfect consonance, prefer stepwise)."""
-    preferred = []
-    candidates = []
-    for octave in range(12):
-        midi = tonic + octave * 12
-        if min_midi <= midi <= max_midi:
-            interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-            if is_perfect_consonance(interval):
-                step_dist = abs(midi - prev_note.pitch.midi)
-                if step_dist <= 2:
-                    preferred.append(midi)
-                elif step_dist <= 5:  # Allow small leaps if needed
-                    candidates.append(midi)
-    return preferred + candidates
-
-
-def _get_candidates(
-    prev_note: Note,
-    cf_note: Note,
-    cf_notes: list[Note],
-    idx: int,
-    min_midi: int,
-    max_midi: int,
-    scale_degrees: list[int],
-    notes: list[Note]
-) -> list[int]:
-    """Get valid candidates for next note."""
-    candidates = []
-    preferred = []
-    prev_midi = prev_note.pitch.midi
-    is_penultimate = (idx == len(cf_notes) - 2)
-    
-    # Prefer stepwise, then small leaps
-    for interval in [2, -2, 1, -1, 3, -3, 4, -4, 5, -5, 7, -7]:
-        midi = prev_midi + interval
-        if not (min_midi <= midi <= max_midi and midi % 12 in scale_degrees):
-            continue
-        
-        # Check consonance
-        vert_interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-        if not is_consonant(vert_interval):
-            continue
-        
-        # Check no parallel perfects
-        if len(notes) >= 1:
-            prev_vert = calculate_interval(cf_notes[idx - 1].pitch, notes[-1].pitch)
-            if is_perfect_consonance(prev_vert) and is_perfect_consonance(vert_interval):
-                motion = motion_type(
-                    cf_notes[idx - 1].pitch, cf_note.pitch,
-                    notes[-1].pitch, Pitch.from_midi(midi)
-                )
-                if motion == MotionType.PARALLEL:
-                    continue
-        
-        # Prefer 3rd or 6th for penultimate
-        if is_penultimate:
-            penult_mod = vert_interval % 12
-            if penult_mod in [3, 4, 8, 9]:
-                preferred.append(midi)
-            else:
-                candidates.append(midi)
+def _generate_beam(
+    plan: GenerationPlan,
+    reachable: tuple[int, ...],
+    beam_width: int,
+    deadline: Optional[Deadline] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Beam search over the greedy candidate tiers, pruned by a reachability mask.
+    
+    If it stops short, its best partial line is offered to `best`.
+    """
+    def whole_notes(midis) -> list[Note]:
+        return [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in midis]
+    
+    last_idx = len(plan.cf_midis) - 1
+    
+    def expand(midis: tuple[int, ...], idx: int) -> list[int]:
+        if idx == 0:
+            tiers = [plan.start_mask]
+        elif idx == last_idx:
+            tiers = _get_end_candidates(plan, midis[-1])
+        else:
+            tiers = _get_candidates(plan, idx, midis[-1])
+        return [tier & reachable[idx] for tier in tiers]
+    
+    midis = beam_search(
+        plan.cf_midis, [True] * len(plan.cf_midis), expand, beam_width, deadline=deadline,
+        partial=None if best is None else lambda midis: best.offer(whole_notes(midis))
+    )
+    if midis is None:
+        return None
+    return whole_notes(midis)
+
+
+def _generate_optimal(
+    plan: GenerationPlan,
+    reachable: tuple[int, ...],
+    max_nodes: int,
+    deadline: Optional[Deadline] = None
+) -> tuple[Optional[list[Note]], dict]:
+    """Branch-and-bound over the greedy candidate tiers, pruned by a reachability mask."""
+    last_idx = len(plan.cf_midis) - 1
+    
+    def expand(prev_midi: Optional[int], idx: int) -> list[int]:
+        if idx == 0:
+            tiers = [plan.start_mask]
+        elif idx == last_idx:
+            tiers = _get_end_candidates(plan, prev_midi)
         else:
-            candidates.append(midi)
+            tiers = _get_candidates(plan, idx, prev_midi)
+        return [tier & reachable[idx] for tier in tiers]
+    
+    midis, stats = branch_and_bound(
+        plan.cf_midis, [True] * len(plan.cf_midis), expand, max_nodes, deadline=deadline
+    )
+    if midis is None:
+        return None, stats
+    return [Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in midis], stats
+
+
+def _get_end_candidates(plan: GenerationPlan, prev_midi: int) -> list[int]:
+    """Get candidates for last note (tonic, perfect consonance, prefer stepwise)."""
+    step = plan.finals_mask & interval_mask(prev_midi, STEPS)
+    leap = plan.finals_mask & interval_mask(prev_midi, SMALL_LEAPS)
+    return [step, leap]
+
+
+def _get_candidates(plan: GenerationPlan, idx: int, prev_midi: int) -> list[int]:
+    """Get valid candidates for next note, as bitset tiers in preference order."""
+    candidates = (
+        interval_mask(prev_midi, MELODIC_INTERVALS)
+        & plan.consonant_masks[idx]
+        & ~parallel_mask(plan.cf_midis[idx - 1], plan.cf_midis[idx], prev_midi)
+    )
     
-    # Shuffle each group separately, then combine
-    if preferred:
-        random.shuffle(preferred)
-    random.shuffle(candidates)
-    return preferred + candidates if preferred else candidates
+    # Prefer 3rd or 6th for penultimate
+    if idx == len(plan.cf_midis) - 2:
+        return [candidates & plan.penultimate_mask, candidates]
+    return [candidates]
@@ -23,11 +23,8 @@ class GenerationLogger:
         endpoint: str
     ) -> None:
         """Log a generated counterpoint solution."""
-        entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "endpoint": endpoint,
-            "params": params,
-            "voices": [
+        self.log_voices(
+            [
                 {
                     "voice_index": voice.voice_index,
                     "voice_range": voice.voice_range.value,
@@ -35,14 +32,32 @@ class GenerationLogger:
                 }
                 for voice in solution.voice_lines
             ],
-            "violations": [
+            [
                 {
                     "rule_code": v.rule_code,
                     "description": v.description,
                     "severity": v.severity.value
                 }
                 for v in solution.diagnostics
-            ]
+            ],
+            params,
+            endpoint
+        )
+    
+    def log_voices(
+        self,
+        voices: list[dict[str, Any]],
+        violations: list[dict[str, Any]],
+        params: dict[str, Any],
+        endpoint: str
+    ) -> None:
+        """Log a generated counterpoint given as voice and violation dicts, as in API responses."""
+        entry = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "endpoint": endpoint,
+            "params": params,
+            "voices": voices,
+            "violations": violations
         }
         
         with open(self.log_file, "a") as f:
@@ -0,0 +1,81 @@
+"""Per-problem generation plan shared by every attempt of a request.
+
+For a fixed CF, key and counterpoint range, the pitch sets the greedy
+generators test against never change: which pitches are in range and in the
+key, which are consonant against each CF note, which can start the line,
+which make a 3rd or 6th before the cadence, and which tonics can end it. The plan
+compiles them once, as MIDI bitsets (see bitsets.py), so the inner loops
+filter candidates with masks instead of rebuilding Pitch objects and
+classifying intervals on every attempt. Plans are cached across requests
+on the CF pitches, key and range.
+"""
+
+from functools import lru_cache
+from typing import NamedTuple
+from app.models import Key, Mode, VoiceLine, VoiceRange
+from .bitsets import mask_of
+from .intervals import is_consonant, is_perfect_consonance
+
+# Vertical intervals (mod 12) preferred before the final: 3rds and 6ths
+PENULTIMATE_INTERVALS = (3, 4, 8, 9)
+
+
+class GenerationPlan(NamedTuple):
+    """Pitch sets compiled once per (CF, key, range), as MIDI bitsets."""
+    cf_midis: tuple[int, ...]
+    tonic: int
+    scale_pitches: tuple[int, ...]  # In range and in key, ascending
+    scale_mask: int
+    consonant_masks: tuple[int, ...]  # Per CF index
+    penultimate_mask: int  # 3rds/6ths over the penultimate CF note
+    start_mask: int  # Perfect consonances over the first CF note
+    finals_mask: int  # Tonics in perfect consonance with the last CF note
+
+
+@lru_cache(maxsize=256)
+def build_generation_plan(
+    cf_midis: tuple[int, ...],
+    tonic: int,
+    mode: Mode,
+    cp_range: VoiceRange
+) -> GenerationPlan:
+    """Compile the pitch sets for one CF, key and counterpoint range."""
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = Key(tonic=tonic, mode=mode).get_scale_degrees()
+    scale_pitches = tuple(m for m in range(min_midi, max_midi + 1) if m % 12 in scale_degrees)
+
+    consonant_masks = tuple(
+        mask_of(m for m in scale_pitches if is_consonant(abs(m - cf_midi)))
+        for cf_midi in cf_midis
+    )
+
+    penultimate = ()
+    if len(cf_midis) >= 2:
+        penultimate = (
+            m for m in range(min_midi, max_midi + 1)
+            if abs(m - cf_midis[-2]) % 12 in PENULTIMATE_INTERVALS
+        )
+
+    start, finals = (), ()
+    if cf_midis:
+        start = (m for m in scale_pitches if is_perfect_consonance(abs(m - cf_midis[0])))
+        finals = (
+            m for m in range(tonic, max_midi + 1, 12)
+            if m >= min_midi and is_perfect_consonance(abs(m - cf_midis[-1]))
+        )
+
+    return GenerationPlan(
+        cf_midis=cf_midis,
+        tonic=tonic,
+        scale_pitches=scale_pitches,
+        scale_mask=mask_of(scale_pitches),
+        consonant_masks=consonant_masks,
+        penultimate_mask=mask_of(penultimate),
+        start_mask=mask_of(start),
+        finals_mask=mask_of(finals),
+    )
+
+
+def plan_for(cf: VoiceLine, key, cp_range: VoiceRange) -> GenerationPlan:
+    """Convenience wrapper taking the CF voice line and a key object."""
+    return build_generation_plan(tuple(n.pitch.midi for n in cf.notes), key.tonic, key.mode, cp_range)
@@ -0,0 +1,223 @@
+"""Vectorized Monte Carlo sampling of many candidate lines at once.
+
+The greedy generators draw one random line per attempt in pure Python. This
+engine advances thousands of random walks together with NumPy: each walk is
+a row of a (walks x positions) array of pitch indices, and one batched step
+fills a whole column. At each position a row samples from its candidate
+row, the position's legal pitches masked by the same rules the greedy
+candidate functions apply:
+
+- melodic moves from the previous note (the final has its own approach);
+- notes dissonant with the CF only by step, and left by step;
+- optionally, notes approached by leap left by step (third species);
+- no parallel perfects between consecutive downbeats.
+
+Steps and the preferred penultimate pitches are drawn more often, like the
+preference tiers of the greedy loop. A row left without candidates is
+respawned as a copy of a random surviving row, so the batch stays full.
+
+Finished rows are ranked by the leap and stepwise penalties of the beam
+search (see beam_search.py) and the distinct top-k are returned for the
+caller to evaluate. Callers that want variety across seeds, such as
+batches, pass a ranking temperature to draw lines at random with a bias to
+low penalties instead.
+"""
+
+import random
+from typing import NamedTuple, Optional, Sequence
+import numpy as np
+from .beam_search import MIN_STEPWISE, PENALTY_WEIGHTS
+from .bitsets import pitches_of, union
+from .generation_plan import GenerationPlan
+from .intervals import is_consonant, is_perfect_consonance
+
+# Walks and returned lines scale with the line's length, within these bounds
+DEFAULT_WALKS = 512
+MIN_WALKS = 64
+WALKS_PER_POSITION = 16
+DEFAULT_TOP_K = 16
+MIN_TOP_K = 4
+# Relative draw weights of steps and of preferred (penultimate) pitches
+STEP_WEIGHT = 4.0
+PREFERRED_WEIGHT = 8.0
+LARGEST_STEP = 2
+# Ranking temperature for variety: lines are drawn in proportion to
+# exp(-penalty / T), so different seeds return different good lines
+RANK_TEMPERATURE = PENALTY_WEIGHTS.leap
+
+# Vertical intervals by size in semitones
+_CONSONANT = np.array([is_consonant(i) for i in range(128)])
+_PERFECT = np.array([is_perfect_consonance(i) for i in range(128)])
+
+
+class LineSpec(NamedTuple):
+    """Per-position candidate rules of one species line."""
+    cf_midis: tuple[int, ...]  # Sounding CF pitch per position
+    domains: tuple[int, ...]  # Legal pitches per position, as MIDI bitsets
+    preferred: tuple[int, ...]  # Pitches drawn more often per position
+    parallel_from: tuple[int, ...]  # Earlier downbeat to check parallels against, or -1
+    intervals: tuple[int, ...]  # Melodic moves between notes
+    final_intervals: tuple[int, ...]  # Moves into the final
+    resolve_leaps: bool  # Leave notes approached by leap by step
+
+
+def species_spec(
+    plan: GenerationPlan,
+    reachable: Sequence[int],
+    notes_per_measure: int,
+    intervals: tuple[int, ...],
+    final_intervals: tuple[int, ...],
+    resolve_leaps: bool = False
+) -> LineSpec:
+    """Rules of a first, second or third species line over a generation plan.
+
+    Even beats are strong and must be consonant; the last strong beat of the
+    penultimate measure prefers the penultimate pitches, as in the greedy
+    candidate functions. `reachable` holds one bitset per position.
+    """
+    num_measures = len(plan.cf_midis)
+    last_pos = num_measures * notes_per_measure - 1
+    penultimate_pos = (num_measures - 2) * notes_per_measure + max(notes_per_measure - 2, 0)
+    cf_midis, domains, preferred, parallel_from = [], [], [], []
+    for pos in range(last_pos + 1):
+        cf_idx, beat = divmod(pos, notes_per_measure)
+        cf_midis.append(plan.cf_midis[cf_idx])
+        if pos == 0:
+            domain = plan.start_mask
+        elif pos == last_pos:
+            domain = plan.finals_mask
+        elif beat % 2 == 0:
+            domain = plan.consonant_masks[cf_idx]
+        else:
+            domain = plan.scale_mask
+        domains.append(domain & reachable[pos])
+        preferred.append(plan.penultimate_mask if pos == penultimate_pos else 0)
+        parallel_from.append(pos - notes_per_measure if beat == 0 and cf_idx > 0 else -1)
+    return LineSpec(
+        tuple(cf_midis), tuple(domains), tuple(preferred), tuple(parallel_from),
+        intervals, final_intervals, resolve_leaps
+    )
+
+
+def _move_table(pitches: np.ndarray, intervals: tuple[int, ...]) -> np.ndarray:
+    """(prev, next) pitch index pairs joined by one of the intervals."""
+    return np.isin(pitches[None, :] - pitches[:, None], intervals)
+
+
+def sample_lines(
+    spec: LineSpec,
+    num_walks: Optional[int] = None,
+    top_k: Optional[int] = None,
+    temperature: float = 0.0
+) -> list[tuple[int, ...]]:
+    """Run `num_walks` random walks through a line spec; the best distinct lines first.
+
+    With a `temperature` the lines are drawn favouring the best rather than
+    strictly ranked (see _ranked). By default short lines get fewer walks
+    and return fewer lines. Returns
+    an empty list if every walk dies. The walks are seeded from the global
+    `random` state, so seeded generators stay reproducible.
+    """
+    pitch_list = pitches_of(union(spec.domains))
+    num_positions = len(spec.domains)
+    if num_walks is None:
+        num_walks = min(max(WALKS_PER_POSITION * num_positions, MIN_WALKS), DEFAULT_WALKS)
+    if top_k is None:
+        top_k = min(max(num_positions, MIN_TOP_K), DEFAULT_TOP_K)
+    if not pitch_list or any(not domain for domain in spec.domains):
+        return []
+    rng = np.random.default_rng(random.getrandbits(64))
+    pitches = np.array(pitch_list)
+    cf = np.array(spec.cf_midis)
+
+    domains = np.array([[domain >> p & 1 for p in pitch_list] for domain in spec.domains], dtype=bool)
+    preferred = np.array([[pref >> p & 1 for p in pitch_list] for pref in spec.preferred], dtype=bool)
+    consonant = _CONSONANT[np.abs(pitches[None, :] - cf[:, None])]
+    moves = _move_table(pitches, spec.intervals)
+    final_moves = _move_table(pitches, spec.final_intervals)
+    steps = np.abs(pitches[None, :] - pitches[:, None]) <= LARGEST_STEP
+    draw_weights = np.where(steps, STEP_WEIGHT, 1.0)
+    position_weights = np.where(preferred, PREFERRED_WEIGHT, 1.0)
+
+    # Pairwise backward pass: pitches from which the final can still be reached
+    alive = domains.copy()
+    for pos in range(num_positions - 2, -1, -1):
+        following = final_moves if pos == num_positions - 2 else moves
+        alive[pos] &= (following & alive[pos + 1][None, :]).any(axis=1)
+    if not alive[0].any():
+        return []
+
+    walks = np.zeros((num_walks, num_positions), dtype=np.intp)
+    weights = np.broadcast_to(alive[0] * 1.0, (num_walks, len(pitch_list)))
+    walks[:, 0] = _draw(rng, weights)
+    rows = np.arange(num_walks)
+
+    for pos in range(1, num_positions):
+        prev = walks[:, pos - 1]
+        allowed = alive[pos][None, :] & (final_moves if pos == num_positions - 1 else moves)[prev]
+        # Dissonances are approached and left by step
+        allowed &= consonant[pos][None, :] | steps[prev]
+        allowed[~consonant[pos - 1][prev]] &= steps[prev[~consonant[pos - 1][prev]]]
+        if spec.resolve_leaps and pos >= 2:
+            leapt = ~steps[walks[:, pos - 2], prev]
+            allowed[leapt] &= steps[prev[leapt]]
+        earlier = spec.parallel_from[pos]
+        if earlier >= 0:
+            allowed &= ~_parallels(pitches, pitches[walks[:, earlier]], cf[earlier], cf[pos])
+
+        weights = allowed * draw_weights[prev] * position_weights[pos][None, :]
+        dead = ~allowed.any(axis=1)
+        if dead.all():
+            return []
+        if dead.any():
+            # Respawn dead rows as copies of surviving rows, history included
+            sources = rng.choice(rows[~dead], size=int(dead.sum()))
+            walks[dead, :pos] = walks[sources, :pos]
+            weights[dead] = weights[sources]
+        walks[:, pos] = _draw(rng, weights)
+
+    return _ranked(rng, pitches[walks], top_k, temperature)
+
+
+def _draw(rng: np.random.Generator, weights: np.ndarray) -> np.ndarray:
+    """One column index per row, drawn in proportion to the row's weights."""
+    cumulative = np.cumsum(weights, axis=1)
+    thresholds = rng.random(len(weights)) * cumulative[:, -1]
+    return np.minimum((cumulative <= thresholds[:, None]).sum(axis=1), weights.shape[1] - 1)
+
+
+def _parallels(pitches: np.ndarray, earlier: np.ndarray, earlier_cf: int, cf: int) -> np.ndarray:
+    """Per row and pitch, whether moving there from `earlier` makes parallel perfects.
+
+    Matches bitsets.parallel_mask row by row.
+    """
+    cf_motion = cf - earlier_cf
+    if cf_motion == 0:
+        return np.zeros((len(earlier), len(pitches)), dtype=bool)
+    vertical = np.abs(earlier - earlier_cf)
+    return (
+        _PERFECT[vertical][:, None]
+        & (np.abs(pitches[None, :] - cf) == vertical[:, None])
+        & ((pitches[None, :] - earlier[:, None]) * cf_motion > 0)
+    )
+
+
+def _ranked(rng: np.random.Generator, lines: np.ndarray, top_k: int, temperature: float) -> list[tuple[int, ...]]:
+    """Distinct lines, fewest leaps and least stepwise shortfall first, ties in random order.
+
+    With a `temperature`, penalties are perturbed by Gumbel noise before
+    sorting, which draws each next line without replacement with
+    probability proportional to exp(-penalty / temperature).
+    """
+    lines = rng.permutation(np.unique(lines, axis=0))
+    intervals = np.abs(np.diff(lines, axis=1))
+    steps = (intervals <= LARGEST_STEP).sum(axis=1)
+    shortfall = np.maximum(0.0, MIN_STEPWISE * intervals.shape[1] - steps)
+    penalty = (
+        PENALTY_WEIGHTS.leap * (intervals.shape[1] - steps)
+        + PENALTY_WEIGHTS.step_deficit * shortfall
+    )
+    if temperature:
+        penalty = penalty - temperature * rng.gumbel(size=len(penalty))
+    order = np.argsort(penalty, kind="stable")[:top_k]
+    return [tuple(int(m) for m in lines[i]) for i in order]
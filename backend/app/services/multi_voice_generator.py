@@ -1,10 +1,26 @@
 """Multi-voice first species counterpoint generator (3-4 voices)."""
 
 import random
-from typing import Optional
-from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, CounterpointProblem, CounterpointSolution
-from .intervals import is_consonant, calculate_interval, is_perfect_consonance
-from .motion import motion_type, MotionType
+from typing import Callable, Optional
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem, CounterpointSolution
+from .anytime import Deadline, best_effort_line, expired
+from .bitsets import (
+    ALL_PITCHES,
+    MIDI_MAX,
+    consonant_mask,
+    interval_mask,
+    mask_of,
+    parallel_mask,
+    random_pitch,
+    range_mask,
+)
+from .harmonic_rules import check_parallel_perfects
+from .melodic_rules import check_step_preference
+from .repair import min_conflicts
+
+# Melodic intervals for inner notes, and steps or small leaps into the final
+MELODIC_INTERVALS = (2, -2, 1, -1, 3, -3, 4, -4, 5, -5)
+FINAL_APPROACH = (2, -2, 1, -1, 3, -3, 4, -4, 5, -5)
 
 
 def generate_multi_voice_first_species(
@@ -12,7 +28,8 @@ def generate_multi_voice_first_species(
     num_voices: int = 3,
     seed: Optional[int] = None,
     max_attempts: int = 10000,
-    use_bass: bool = False
+    use_bass: bool = False,
+    deadline: Optional[Deadline] = None
 ) -> Optional[CounterpointSolution]:
     """Generate 3-4 voice first species counterpoint.
     
@@ -22,6 +39,9 @@ def generate_multi_voice_first_species(
         seed: Random seed for reproducibility
         max_attempts: Maximum generation attempts
         use_bass: For 3 voices, use SAB instead of SAT (default False)
+        deadline: Stop searching once this expires and return the most
+            voices found so far, the rest built without search, marked
+            incomplete
     
     Returns:
         CounterpointSolution with all voices or None if generation fails
@@ -69,22 +89,55 @@ def generate_multi_voice_first_species(
         else:  # SOPRANO
             ranges = [VoiceRange.ALTO, VoiceRange.TENOR, VoiceRange.BASS]
     
-    for _ in range(max_attempts):
-        voices = _generate_all_voices(cf, key, ranges)
+    # Most voices any attempt got through, for when the deadline expires
+    found = [cf]
+    
+    def keep(voices: list[VoiceLine]) -> None:
+        if len(voices) > len(found):
+            found[:] = voices
+    
+    for attempt in range(max_attempts):
+        if expired(deadline):
+            return _best_effort_voices(cf, key, ranges, found)
+        voices = _generate_all_voices(cf, key, ranges, keep)
         if voices and len(voices) == num_voices:
-            return CounterpointSolution(voice_lines=voices)
+            return CounterpointSolution(
+                voice_lines=voices, search_stats={"strategy": "greedy", "attempts": attempt + 1}
+            )
     
+    if expired(deadline):
+        return _best_effort_voices(cf, key, ranges, found)
     return None
 
 
+def _best_effort_voices(
+    cf: VoiceLine,
+    key,
+    ranges: list[VoiceRange],
+    found: list[VoiceLine]
+) -> CounterpointSolution:
+    """The voices found so far, the rest as best-effort first species lines against the CF alone."""
+    voices = list(found) + [
+        VoiceLine(notes=best_effort_line(cf, key, voice_range, SpeciesType.FIRST), voice_index=idx, voice_range=voice_range)
+        for idx, voice_range in enumerate(ranges[len(found) - 1:], start=len(found))
+    ]
+    if len(found) > 1:
+        message = "Deadline expired; best voices found so far, the rest built without search"
+    else:
+        message = "Deadline expired before any voice was found; voices built without search"
+    return CounterpointSolution(voice_lines=voices, complete=False, message=message)
+
+
 def _generate_all_voices(
     cf: VoiceLine,
     key,
-    ranges: list[VoiceRange]
+    ranges: list[VoiceRange],
+    partial: Optional[Callable[[list[VoiceLine]], None]] = None
 ) -> Optional[list[VoiceLine]]:
-    """Generate all counterpoint voices sequentially with retry."""
-    from .melodic_rules import check_step_preference
+    """Generate all counterpoint voices sequentially with retry.
     
+    If a voice fails, the voices before it are passed to `partial`.
+    """
     voices = [cf]
     scale_degrees = key.get_scale_degrees()
     
@@ -96,11 +149,15 @@ def _generate_all_voices(
             notes = _generate_voice(voices, key, voice_range, voice_idx, scale_degrees)
             if notes and len(notes) == len(cf.notes):
                 voice_line = VoiceLine(notes=notes, voice_index=voice_idx, voice_range=voice_range)
-                # Validate melodic rules (must have ≥60% stepwise motion)
-                if not check_step_preference(voice_line):
+                # Validate melodic rules (must have ≥60% stepwise motion), repairing near misses
+                if check_step_preference(voice_line):
+                    voice_line = _repair_voice(voices, voice_line, scale_degrees)
+                if voice_line is not None:
                     voices.append(voice_line)
                     break
         else:
+            if partial is not None:
+                partial(voices)
             return None
     
     return voices
@@ -117,68 +174,86 @@ def _generate_voice(
     min_midi, max_midi = voice_range.get_range()
     cf = existing_voices[0]
     notes = []
+    # In-range, in-key pitches as a MIDI bitset
+    scale = mask_of(m for m in range(min_midi, max_midi + 1) if m % 12 in scale_degrees)
     
-    for idx, cf_note in enumerate(cf.notes):
+    for idx in range(len(cf.notes)):
         if idx == 0:
-            candidates = _get_multi_start_candidates(
-                existing_voices, idx, min_midi, max_midi, scale_degrees
-            )
+            candidates = _get_multi_start_candidates(existing_voices, idx, scale)
         elif idx == len(cf.notes) - 1:
             candidates = _get_multi_end_candidates(
                 existing_voices, notes[-1], idx, min_midi, max_midi, key.tonic
             )
         else:
-            candidates = _get_multi_candidates(
-                existing_voices, notes, idx, min_midi, max_midi, scale_degrees
-            )
+            candidates = _get_multi_candidates(existing_voices, notes, idx, scale)
         
-        if not candidates:
+        midi = random_pitch(candidates)
+        if midi is None:
             return None
         
-        random.shuffle(candidates)
-        notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.WHOLE))
+        notes.append(Note(pitch=Pitch.from_midi(midi), duration=Duration.WHOLE))
     
     return notes
 
 
-def _get_multi_start_candidates(
+def _repair_voice(
     existing_voices: list[VoiceLine],
-    idx: int,
-    min_midi: int,
-    max_midi: int,
+    voice_line: VoiceLine,
     scale_degrees: list[int]
-) -> list[int]:
-    """Get candidates for first note (consonant with all voices)."""
-    candidates = []
-    cf = existing_voices[0]
+) -> Optional[VoiceLine]:
+    """Min-conflicts repair of a voice's inner notes for the stepwise-motion check.
     
-    for midi in range(min_midi, max_midi + 1):
-        if midi % 12 not in scale_degrees:
-            continue
-        
-        # Check consonance with all existing voices and avoid exact unisons
-        valid = True
-        for voice in existing_voices:
-            # Avoid starting on exact same note (unison)
-            if voice.notes[idx].pitch.midi == midi:
-                valid = False
-                break
-            interval = calculate_interval(voice.notes[idx].pitch, Pitch.from_midi(midi))
-            if not is_consonant(interval):
-                valid = False
-                break
-        
-        # Check no voice crossing
+    Inner notes stay consonant with every existing voice and may not form
+    parallel perfects with them. Returns the repaired voice, or None if it
+    still breaks a rule.
+    """
+    min_midi, max_midi = voice_line.voice_range.get_range()
+    scale = mask_of(m for m in range(min_midi, max_midi + 1) if m % 12 in scale_degrees)
+    last_idx = len(voice_line.notes) - 1
+    domains = [
+        1 << note.pitch.midi if idx in (0, last_idx) else scale & _consonant_with_all(existing_voices, idx)
+        for idx, note in enumerate(voice_line.notes)
+    ]
+    
+    def evaluate(notes: list[Note]) -> list:
+        line = voice_line.model_copy(update={"notes": notes})
+        violations = check_step_preference(line)
         for voice in existing_voices:
-            if voice.voice_index < len(existing_voices):  # Lower voice
-                if midi < voice.notes[idx].pitch.midi:
-                    valid = False
-                    break
-        
-        if valid:
-            candidates.append(midi)
+            violations += check_parallel_perfects(voice, line)
+        return violations
     
-    return candidates
+    result = min_conflicts(voice_line.notes, domains, evaluate)
+    if result.violations:
+        return None
+    return voice_line.model_copy(update={"notes": result.notes})
+
+
+def _consonant_with_all(existing_voices: list[VoiceLine], idx: int) -> int:
+    """Bitset of pitches consonant with every existing voice at one index."""
+    mask = ALL_PITCHES
+    for voice in existing_voices:
+        mask &= consonant_mask(voice.notes[idx].pitch.midi)
+    return mask
+
+
+def _not_parallel(existing_voices: list[VoiceLine], prev_midi: int, idx: int) -> int:
+    """Bitset of pitches making no parallel perfects with any existing voice."""
+    mask = ALL_PITCHES
+    for voice in existing_voices:
+        mask &= ~parallel_mask(voice.notes[idx - 1].pitch.midi, voice.notes[idx].pitch.midi, prev_midi)
+    return mask
+
+
+def _get_multi_start_candidates(existing_voices: list[VoiceLine], idx: int, scale: int) -> int:
+    """Get candidates for first note (consonant with all voices), as a bitset."""
+    sounding = [voice.notes[idx].pitch.midi for voice in existing_voices]
+    # Avoid starting on exact same note (unison) and crossing below an existing voice
+    return (
+        scale
+        & _consonant_with_all(existing_voices, idx)
+        & ~mask_of(sounding)
+        & range_mask(max(sounding), MIDI_MAX)
+    )
 
 
 def _get_multi_end_candidates(
@@ -188,132 +263,30 @@ def _get_multi_end_candidates(
     min_midi: int,
     max_midi: int,
     tonic: int
-) -> list[int]:
-    """Get candidates for last note (tonic, consonant, stepwise, no repeat)."""
-    preferred = []
-    fallback = []
-    cf = existing_voices[0]
+) -> int:
+    """Get candidates for last note (tonic, consonant, stepwise or a small leap, no repeat)."""
     prev_midi = prev_note.pitch.midi
-    
-    for octave in range(12):
-        midi = tonic + octave * 12
-        if not (min_midi <= midi <= max_midi):
-            continue
-        
-        # Avoid repeated notes
-        if midi == prev_midi:
-            continue
-        
-        # Check consonance with all voices
-        valid = True
-        for voice in existing_voices:
-            interval = calculate_interval(voice.notes[idx].pitch, Pitch.from_midi(midi))
-            if not is_consonant(interval):
-                valid = False
-                break
-        
-        if not valid:
-            continue
-        
-        # Check parallel perfects (strict for octaves/unisons, relaxed for fifths)
-        for voice in existing_voices:
-            prev_vert = calculate_interval(voice.notes[idx - 1].pitch, prev_note.pitch)
-            curr_vert = calculate_interval(voice.notes[idx].pitch, Pitch.from_midi(midi))
-            
-            if is_perfect_consonance(prev_vert) and is_perfect_consonance(curr_vert):
-                motion = motion_type(
-                    voice.notes[idx - 1].pitch, voice.notes[idx].pitch,
-                    prev_note.pitch, Pitch.from_midi(midi)
-                )
-                if motion == MotionType.PARALLEL:
-                    prev_type = prev_vert % 12
-                    curr_type = curr_vert % 12
-                    # NEVER allow parallel octaves/unisons (same perfect type)
-                    if prev_type == 0 and curr_type == 0:
-                        valid = False
-                        break
-                    # NEVER allow parallel fifths of same type
-                    if prev_type == 7 and curr_type == 7:
-                        valid = False
-                        break
-        
-        if not valid:
-            continue
-        
-        # Categorize by quality (prefer stepwise, allow small leaps)
-        step_dist = abs(midi - prev_midi)
-        if step_dist <= 2:
-            preferred.append(midi)  # Best: stepwise
-        elif step_dist <= 5:
-            fallback.append(midi)  # OK: small leap (3rd/4th)
-        # Reject large leaps at cadence (>5 semitones)
-    
-    return preferred + fallback
+    tonics = mask_of(range(tonic, max_midi + 1, 12)) & range_mask(min_midi, max_midi)
+    # Reject repeated notes and large leaps at cadence (>5 semitones)
+    return (
+        tonics
+        & interval_mask(prev_midi, FINAL_APPROACH)
+        & _consonant_with_all(existing_voices, idx)
+        & _not_parallel(existing_voices, prev_midi, idx)
+    )
 
 
 def _get_multi_candidates(
     existing_voices: list[VoiceLine],
     notes: list[Note],
     idx: int,
-    min_midi: int,
-    max_midi: int,
-    scale_degrees: list[int]
-) -> list[int]:
-    """Get valid candidates for next note."""
-    candidates = []
-    preferred = []
+    scale: int
+) -> int:
+    """Get valid candidates for next note, as a bitset."""
     prev_midi = notes[-1].pitch.midi
-    cf = existing_voices[0]
-    is_penultimate = (idx == len(cf.notes) - 2)
-    
-    # Prefer stepwise, then small leaps
-    for interval in [2, -2, 1, -1, 3, -3, 4, -4, 5, -5]:
-        midi = prev_midi + interval
-        if not (min_midi <= midi <= max_midi and midi % 12 in scale_degrees):
-            continue
-        
-        # Check consonance with all existing voices
-        valid = True
-        for voice in existing_voices:
-            vert_interval = calculate_interval(voice.notes[idx].pitch, Pitch.from_midi(midi))
-            if not is_consonant(vert_interval):
-                valid = False
-                break
-        
-        if not valid:
-            continue
-        
-        # Check no parallel perfects with any voice
-        for voice in existing_voices:
-            if len(notes) >= 1:
-                prev_vert = calculate_interval(voice.notes[idx - 1].pitch, notes[-1].pitch)
-                curr_vert = calculate_interval(voice.notes[idx].pitch, Pitch.from_midi(midi))
-                
-                if is_perfect_consonance(prev_vert) and is_perfect_consonance(curr_vert):
-                    motion = motion_type(
-                        voice.notes[idx - 1].pitch, voice.notes[idx].pitch,
-                        notes[-1].pitch, Pitch.from_midi(midi)
-                    )
-                    if motion == MotionType.PARALLEL:
-                        valid = False
-                        break
-        
-        if not valid:
-            continue
-        
-        # Penultimate: prefer 3rd or 6th with CF
-        if is_penultimate:
-            cf_interval = calculate_interval(cf.notes[idx].pitch, Pitch.from_midi(midi))
-            penult_mod = cf_interval % 12
-            if penult_mod in [3, 4, 8, 9]:
-                preferred.append(midi)
-            else:
-                candidates.append(midi)
-        else:
-            candidates.append(midi)
-    
-    # Shuffle each group
-    if preferred:
-        random.shuffle(preferred)
-    random.shuffle(candidates)
-    return preferred + candidates if preferred else candidates
+    return (
+        scale
+        & interval_mask(prev_midi, MELODIC_INTERVALS)
+        & _consonant_with_all(existing_voices, idx)
+        & _not_parallel(existing_voices, prev_midi, idx)
+    )
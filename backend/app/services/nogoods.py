@@ -0,0 +1,92 @@
+"""Nogood store shared by the restarts of one generation request.
+
+A nogood is a search state, such as (position, previous pitch, context), that
+is known to leave no legal continuation. The greedy generators record the
+state at which an attempt dies and skip candidates that would lead back into
+a recorded state, so later restarts stop repeating the same dead ends. When
+every candidate from a state is skipped, that state becomes a nogood itself,
+which propagates failures backwards across attempts.
+
+States are only sound as nogoods if the candidate sets from them do not
+depend on anything outside the state, so each generator keys its states on
+exactly the notes its candidate filters look back at, plus the reachability
+mask in use.
+"""
+
+from typing import Callable, Hashable, Optional
+
+# Upper bound on stored states; the oldest are evicted first
+DEFAULT_MAX_ENTRIES = 50_000
+
+
+class NogoodStore:
+    """Bounded, hash-based set of failing search states with hit counters."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._states: dict[Hashable, None] = {}
+        self.hits = 0
+        self.evictions = 0
+
+    @property
+    def entries(self) -> int:
+        """Number of states currently stored."""
+        return len(self._states)
+
+    def __contains__(self, state: Hashable) -> bool:
+        if state in self._states:
+            self.hits += 1
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def add(self, state: Hashable) -> None:
+        """Record a state as leading to failure."""
+        if state in self._states:
+            return
+        if len(self._states) >= self.max_entries:
+            # Dicts keep insertion order, so the first key is the oldest
+            del self._states[next(iter(self._states))]
+            self.evictions += 1
+        self._states[state] = None
+
+    def prune(
+        self,
+        candidates: list[int],
+        state: Hashable,
+        next_state: Optional[Callable[[int], Hashable]]
+    ) -> list[int]:
+        """Drop candidates that lead into a known nogood.
+
+        If no candidate survives, `state` itself is recorded as a nogood.
+        Pass `next_state=None` where no state follows (the final note).
+        """
+        if next_state is not None:
+            candidates = [c for c in candidates if next_state(c) not in self]
+        if not candidates:
+            self.add(state)
+        return candidates
+
+    def prune_mask(
+        self,
+        mask: int,
+        state: Hashable,
+        next_state: Optional[Callable[[int], Hashable]]
+    ) -> int:
+        """Bitset version of `prune` for candidate masks over MIDI pitches."""
+        if next_state is not None:
+            remaining = mask
+            while remaining:
+                low = remaining & -remaining
+                remaining ^= low
+                if next_state(low.bit_length() - 1) in self:
+                    mask ^= low
+        if not mask:
+            self.add(state)
+        return mask
+
+    def stats(self) -> dict[str, int]:
+        """Counters for logging and tests."""
+        return {"entries": self.entries, "hits": self.hits, "evictions": self.evictions}
@@ -0,0 +1,302 @@
+"""Parallel portfolio solving across worker processes.
+
+No single strategy wins everywhere: the DP and figure searches, beam
+searches of different widths and greedy restarts each solve different CFs
+fastest, and the time to success of one strategy varies widely with the
+seed. A portfolio runs several (strategy, seed) pairs for the same problem
+in a process pool, takes the first valid result and cancels the rest.
+
+Cancellation is cooperative. Every worker runs under a RunDeadline, which
+also expires once its run has been decided, so a losing generator stops at
+its next deadline check (see anytime.py) instead of running out its
+attempt budget. Pending tasks that have not started are dropped.
+
+The parent awaits its tasks on the event loop rather than on the
+generation thread (see scheduler.py), so other requests are scheduled
+while the workers search.
+
+How many workers a request class gets is configured per class in
+PORTFOLIO_WORKERS, overridable with PORTFOLIO_WORKERS_<CLASS> environment
+variables, and capped at the number of CPUs. With one worker the first
+strategy runs in-process, as a generation job, and no pool is started.
+"""
+
+import asyncio
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, NamedTuple, Optional
+from app.models import CounterpointProblem, CounterpointSolution, RuleViolation, Severity
+from .anytime import Deadline
+from .beam_search import DEFAULT_BEAM_WIDTH
+from .first_species_generator import generate_first_species
+from .second_species_generator import generate_second_species
+from .third_species_generator import generate_third_species
+from .fifth_species_generator import generate_fifth_species
+from .multi_voice_generator import generate_multi_voice_first_species
+from .multi_voice_rules import evaluate_multi_voice
+from .repair import violation_cost
+from .scheduler import run_generation
+from .species_rules import evaluate_first_species
+from .second_species_rules import evaluate_second_species
+from .third_species_rules import evaluate_third_species
+from .fifth_species_rules import evaluate_fifth_species
+
+# Cancellation slots shared with the workers; a run is cancelled once its slot holds its id
+CANCEL_SLOTS = 256
+
+
+class Strategy(NamedTuple):
+    """One way to run a generator: a name and its keyword arguments."""
+    name: str
+    options: dict
+
+
+PORTFOLIOS: dict[str, tuple[Strategy, ...]] = {
+    "first": (
+        Strategy("greedy", {}),
+        Strategy("beam", {"beam_width": DEFAULT_BEAM_WIDTH}),
+        Strategy("optimal", {"optimize": True}),
+    ),
+    "second": (
+        Strategy("dp", {}),
+        Strategy("beam", {"beam_width": DEFAULT_BEAM_WIDTH}),
+        Strategy("wide-beam", {"beam_width": 4 * DEFAULT_BEAM_WIDTH}),
+    ),
+    "third": (
+        Strategy("figures", {}),
+        Strategy("beam", {"beam_width": DEFAULT_BEAM_WIDTH}),
+        Strategy("wide-beam", {"beam_width": 4 * DEFAULT_BEAM_WIDTH}),
+    ),
+    "fifth": (
+        Strategy("lattice", {}),
+        Strategy("wide-lattice", {"beam_width": 4 * DEFAULT_BEAM_WIDTH}),
+        Strategy("narrow-lattice", {"beam_width": DEFAULT_BEAM_WIDTH // 2}),
+    ),
+    # Multi-voice generation has one strategy; its workers differ only in seed
+    "multi_voice": (Strategy("restarts", {}),),
+}
+
+# Workers per request class; the hard classes get the most
+PORTFOLIO_WORKERS = {"first": 1, "second": 2, "third": 2, "fifth": 4, "multi_voice": 4}
+
+GENERATORS: dict[str, Callable[..., Optional[CounterpointSolution]]] = {
+    "first": generate_first_species,
+    "second": generate_second_species,
+    "third": generate_third_species,
+    "fifth": generate_fifth_species,
+    "multi_voice": generate_multi_voice_first_species,
+}
+
+EVALUATORS = {
+    "first": evaluate_first_species,
+    "second": evaluate_second_species,
+    "third": evaluate_third_species,
+    "fifth": evaluate_fifth_species,
+}
+
+
+class PortfolioResult(NamedTuple):
+    """Outcome of a portfolio run."""
+    solution: Optional[CounterpointSolution]
+    strategy: Optional[str]  # Name of the strategy that produced the solution
+    seed: Optional[int]
+    valid: bool  # No error-level violations and not cut short by a deadline
+    launched: int  # Tasks submitted
+    finished: int  # Tasks that returned before the run was decided
+    elapsed_ms: float
+
+
+def workers_for(request_class: str) -> int:
+    """Configured workers for a request class, capped at the CPU count."""
+    configured = os.getenv(f"PORTFOLIO_WORKERS_{request_class.upper()}")
+    workers = int(configured) if configured else PORTFOLIO_WORKERS.get(request_class, 1)
+    return max(1, min(workers, os.cpu_count() or 1))
+
+
+def solution_violations(request_class: str, solution: CounterpointSolution) -> list[RuleViolation]:
+    """Evaluate a solution with the rules of its request class."""
+    if request_class == "multi_voice":
+        return evaluate_multi_voice(solution)
+    return EVALUATORS[request_class](solution.voice_lines[0], solution.voice_lines[1])
+
+
+# Worker side
+
+_cancelled = None
+
+
+def _init_worker(cancelled) -> None:
+    global _cancelled
+    _cancelled = cancelled
+
+
+class RunDeadline(Deadline):
+    """A deadline that also expires once its portfolio run is decided."""
+
+    def __init__(self, budget_ms: float, run_id: int):
+        super().__init__(budget_ms)
+        self.run_id = run_id
+
+    def expired(self) -> bool:
+        if _cancelled is not None and _cancelled[self.run_id % CANCEL_SLOTS] == self.run_id:
+            return True
+        return super().expired()
+
+
+def _solve(
+    request_class: str,
+    problem: CounterpointProblem,
+    strategy: Strategy,
+    seed: int,
+    options: dict,
+    run_id: int,
+    budget_ms: float
+) -> tuple[Optional[CounterpointSolution], list[RuleViolation]]:
+    """Run one strategy in a worker and evaluate what it returns."""
+    deadline = RunDeadline(budget_ms, run_id)
+    solution = GENERATORS[request_class](problem, seed=seed, deadline=deadline, **options, **strategy.options)
+    if solution is None:
+        return None, []
+    return solution, solution_violations(request_class, solution)
+
+
+def _is_valid(solution: Optional[CounterpointSolution], violations: list[RuleViolation]) -> bool:
+    return (
+        solution is not None
+        and solution.complete
+        and not any(v.severity == Severity.ERROR for v in violations)
+    )
+
+
+# Parent side
+
+class PortfolioPool:
+    """A process pool plus the shared cancellation slots of its runs."""
+
+    def __init__(self, workers: int):
+        context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self._cancelled = context.Array("q", [-1] * CANCEL_SLOTS, lock=False)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(self._cancelled,)
+        )
+        self._run_ids = itertools.count()
+
+    def next_run_id(self) -> int:
+        return next(self._run_ids)
+
+    def submit(self, *args) -> Future:
+        return self._executor.submit(_solve, *args)
+
+    def cancel(self, run_id: int, futures: list[Future]) -> None:
+        """Drop a run's pending tasks and tell its running workers to stop."""
+        self._cancelled[run_id % CANCEL_SLOTS] = run_id
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[PortfolioPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers: Optional[int] = None) -> PortfolioPool:
+    """The shared portfolio pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PortfolioPool(workers or max(1, min(max(PORTFOLIO_WORKERS.values()), os.cpu_count() or 1)))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the shared pool, if one was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+async def solve_portfolio(
+    request_class: str,
+    problem: CounterpointProblem,
+    seed: Optional[int] = None,
+    options: Optional[dict] = None,
+    deadline: Optional[Deadline] = None,
+    workers: Optional[int] = None,
+    pool: Optional[PortfolioPool] = None
+) -> PortfolioResult:
+    """Race the request class's strategies and return the first valid solution.
+
+    Worker `i` runs strategy `i` (cycling through PORTFOLIOS) with seed
+    `seed + i`, so a given seed always launches the same tasks, though which
+    one wins depends on timing. `options` are extra generator keyword
+    arguments (such as num_voices for multi-voice). If no task returns a
+    valid solution, the complete one with the fewest weighted violations is
+    returned.
+    """
+    started = time.perf_counter()
+    options = options or {}
+    strategies = PORTFOLIOS[request_class]
+    workers = workers or workers_for(request_class)
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    budget_ms = deadline.remaining_ms() if deadline is not None else math.inf
+
+    def result(solution, strategy, task_seed, valid, launched, finished) -> PortfolioResult:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        return PortfolioResult(solution, strategy, task_seed, valid, launched, finished, elapsed_ms)
+
+    if workers == 1:
+        strategy = strategies[0]
+        solution = await run_generation(lambda: GENERATORS[request_class](
+            problem, seed=seed, deadline=deadline, **options, **strategy.options
+        ))
+        valid = solution is not None and _is_valid(solution, solution_violations(request_class, solution))
+        return result(solution, strategy.name if solution else None, seed, valid, 1, 1)
+
+    pool = pool or get_pool()
+    run_id = pool.next_run_id()
+    tasks = {}
+    for i in range(workers):
+        strategy = strategies[i % len(strategies)]
+        future = pool.submit(request_class, problem, strategy, seed + i, options, run_id, budget_ms)
+        tasks[asyncio.wrap_future(future)] = (future, strategy.name, seed + i)
+
+    best = None  # (rank, solution, strategy, seed)
+    pending, finished = set(tasks), 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for waited in done:
+                if waited.cancelled():
+                    continue
+                finished += 1
+                solution, violations = waited.result()
+                if solution is None:
+                    continue
+                _, name, task_seed = tasks[waited]
+                if _is_valid(solution, violations):
+                    return result(solution, name, task_seed, True, len(tasks), finished)
+                rank = (not solution.complete, violation_cost(violations))
+                if best is None or rank < best[0]:
+                    best = (rank, solution, name, task_seed)
+    finally:
+        pool.cancel(run_id, [tasks[waited][0] for waited in pending])
+        for waited in pending:
+            # A task that fails after the run was decided is not logged as lost
+            waited.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    if best is None:
+        return result(None, None, None, False, len(tasks), finished)
+    _, solution, name, task_seed = best
+    return result(solution, name, task_seed, False, len(tasks), finished)
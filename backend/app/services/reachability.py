@@ -0,0 +1,130 @@
+"""Backward reachability masks for the greedy generators.
+
+The greedy generators walk forward without lookahead and often reach the last
+CF note with no tonic close enough to end on. A reachability table lists, for
+every position of the counterpoint, the pitches from which a legal cadence can
+still be reached. Intersecting candidates with it prunes those dead ends
+before they are taken.
+
+The table ignores parallel motion, so it over-approximates what is reachable:
+a pitch outside the mask can never lead to a cadence, but a pitch inside it
+is not guaranteed to. A table can also be built toward a pinned cadence, in
+which case the last positions hold exactly the cadence pitches.
+"""
+
+from functools import lru_cache
+from app.models import Key, Mode, VoiceRange, SpeciesType
+from .intervals import is_consonant, is_perfect_consonance
+
+# Melodic intervals each greedy generator may take between consecutive notes
+SPECIES_INTERVALS = {
+    SpeciesType.FIRST: (2, -2, 1, -1, 3, -3, 4, -4, 5, -5, 7, -7),
+    SpeciesType.SECOND: (2, -2, 1, -1, 3, -3, 4, -4),
+    SpeciesType.THIRD: (2, -2, 1, -1, 3, -3, 4, -4),
+    SpeciesType.FIFTH: (2, -2, 1, -1, 3, -3, 4, -4, 5, -5),
+}
+
+# Positions per CF note; fifth species masks only the last note of each measure
+NOTES_PER_MEASURE = {
+    SpeciesType.FIRST: 1,
+    SpeciesType.SECOND: 2,
+    SpeciesType.THIRD: 4,
+    SpeciesType.FIFTH: 1,
+}
+
+# Largest approach to the final accepted by _get_end_candidates
+MAX_FINAL_APPROACH = 5
+
+
+@lru_cache(maxsize=256)
+def build_reachability(
+    cf_midis: tuple[int, ...],
+    tonic: int,
+    mode: Mode,
+    cp_range: VoiceRange,
+    species: SpeciesType,
+    cadence: tuple[int, ...] = ()
+) -> tuple[frozenset[int], ...]:
+    """Build the per-position set of pitches from which a cadence is reachable."""
+    if species not in SPECIES_INTERVALS:
+        raise ValueError(f"No reachability table for {species.value} species")
+
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = Key(tonic=tonic, mode=mode).get_scale_degrees()
+    scale_pitches = [m for m in range(min_midi, max_midi + 1) if m % 12 in scale_degrees]
+    intervals = SPECIES_INTERVALS[species]
+    per_measure = NOTES_PER_MEASURE[species]
+    positions = len(cf_midis) * per_measure
+    if positions == 0:
+        return ()
+
+    reach: list[frozenset[int]] = [frozenset()] * positions
+    reach[-1] = frozenset(
+        m for m in range(tonic, max_midi + 1, 12)
+        if m >= min_midi and is_perfect_consonance(abs(m - cf_midis[-1]))
+    )
+    pinned = min(len(cadence), positions)
+    for offset in range(pinned):
+        pos = positions - pinned + offset
+        midi = cadence[len(cadence) - pinned + offset]
+        # A pinned pitch on a strong position still has to be consonant
+        is_strong = (pos % per_measure) % 2 == 0
+        if is_strong and not is_consonant(abs(midi - cf_midis[pos // per_measure])):
+            return tuple(frozenset() for _ in range(positions))
+        reach[pos] = frozenset([midi])
+
+    for pos in range(positions - 1 - max(pinned, 1), -1, -1):
+        cf_midi = cf_midis[pos // per_measure]
+        next_cf = cf_midis[(pos + 1) // per_measure]
+        is_strong = (pos % per_measure) % 2 == 0
+        next_is_final = pos + 1 == positions - 1
+        allowed = []
+
+        for midi in scale_pitches:
+            vert_interval = abs(midi - cf_midi)
+            if pos == 0 and not is_perfect_consonance(vert_interval):
+                continue
+            if is_strong and not is_consonant(vert_interval):
+                continue
+
+            for nxt in reach[pos + 1]:
+                leap = nxt - midi
+                if next_is_final:
+                    if abs(leap) <= MAX_FINAL_APPROACH:
+                        break
+                # Weak-beat dissonances can only be approached by step
+                elif leap in intervals and (abs(leap) <= 2 or is_consonant(abs(nxt - next_cf))):
+                    break
+            else:
+                continue
+            allowed.append(midi)
+
+        reach[pos] = frozenset(allowed)
+
+    return tuple(reach)
+
+
+def reachability_for(
+    cf_midis: list[int],
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType,
+    cadence: tuple[int, ...] = ()
+) -> tuple[frozenset[int], ...]:
+    """Convenience wrapper taking a key object and a list of CF pitches."""
+    return build_reachability(tuple(cf_midis), key.tonic, key.mode, cp_range, species, tuple(cadence))
+
+
+def cadence_slots(cadence: tuple[int, ...], num_measures: int, species: SpeciesType) -> list[tuple[int, int, int]]:
+    """Map a pinned cadence onto (measure index, slot in measure, pitch) triples.
+
+    Fifth species cadences pin the last note of each measure (slot -1).
+    """
+    per_measure = NOTES_PER_MEASURE[species]
+    first_pos = num_measures * per_measure - len(cadence)
+    slots = []
+    for offset, midi in enumerate(cadence):
+        pos = first_pos + offset
+        slot = -1 if species == SpeciesType.FIFTH else pos % per_measure
+        slots.append((pos // per_measure, slot, midi))
+    return slots
@@ -0,0 +1,194 @@
+"""Min-conflicts local repair for near-valid counterpoint lines.
+
+A finished line that fails evaluation usually breaks only a few rules at a
+few notes. Instead of discarding it, repair re-evaluates the line, picks the
+note involved in the most violations (ties broken randomly) and re-picks its
+pitch from that note's legal candidates, taking the pitch that leaves the
+fewest weighted violations, and among those the one closest to its
+neighbours. Rhythm is never changed. It stops at zero
+violations, after an iteration budget or once an optional deadline expires,
+and returns the best line it saw.
+
+Violations without note indices (such as too little stepwise motion) count
+against every note. A note that fails to improve is tabu for a few
+iterations so the search moves on instead of cycling, and the search gives
+up early once it stops finding better lines.
+"""
+
+import random
+from typing import Callable, NamedTuple, Sequence
+from app.models import Pitch, Note, VoiceLine, VoiceRange, RuleViolation, Severity, SpeciesType
+from .bitsets import pitches_of
+from .generation_plan import plan_for
+from .melodic_rules import check_leap_size, check_no_melodic_tritones
+from .species_rules import evaluate_first_species
+from .second_species_rules import evaluate_second_species
+from .third_species_rules import evaluate_third_species
+from .fourth_species_rules import evaluate_fourth_species
+from .fifth_species_rules import evaluate_fifth_species
+
+DEFAULT_MAX_ITERATIONS = 200
+# Iterations a note is left alone after a move that did not help
+TABU_TENURE = 3
+# Give up after this many iterations without a new best line
+STALL_LIMIT = 20
+
+SEVERITY_WEIGHTS = {Severity.ERROR: 4, Severity.WARNING: 2, Severity.INFO: 1}
+
+SPECIES_EVALUATORS: dict[SpeciesType, Callable[[VoiceLine, VoiceLine], list[RuleViolation]]] = {
+    SpeciesType.FIRST: evaluate_first_species,
+    SpeciesType.SECOND: evaluate_second_species,
+    SpeciesType.THIRD: evaluate_third_species,
+    SpeciesType.FOURTH: evaluate_fourth_species,
+    SpeciesType.FIFTH: evaluate_fifth_species,
+}
+
+
+class RepairResult(NamedTuple):
+    """Outcome of a repair run."""
+    notes: list[Note]
+    violations: list[RuleViolation]  # Remaining violations of the returned notes
+    iterations: int
+    changed: list[int]  # Indices whose pitch differs from the input
+
+
+def violation_cost(violations: list[RuleViolation]) -> int:
+    """Severity-weighted violation count."""
+    return sum(SEVERITY_WEIGHTS[v.severity] for v in violations)
+
+
+def min_conflicts(
+    notes: list[Note],
+    domains: Sequence[int],
+    evaluate: Callable[[list[Note]], list[RuleViolation]],
+    max_iterations: int = DEFAULT_MAX_ITERATIONS,
+    deadline=None
+) -> RepairResult:
+    """Repair a line by re-picking the pitch of its most conflicted note.
+
+    `domains` holds one MIDI bitset of legal pitches per note; a note whose
+    domain offers no other pitch is never picked. `evaluate` returns the
+    violations of a candidate list of notes. `deadline` is an optional
+    anytime.Deadline.
+    """
+    current = list(notes)
+    violations = evaluate(current)
+    cost = violation_cost(violations)
+    best = (cost, current, violations)
+    tabu_until = [0] * len(current)
+    iteration = last_improvement = 0
+
+    while violations and iteration < max_iterations and iteration - last_improvement < STALL_LIMIT:
+        if deadline is not None and deadline.expired():
+            break
+        iteration += 1
+        conflicts = [0] * len(current)
+        for violation in violations:
+            weight = SEVERITY_WEIGHTS[violation.severity]
+            for idx in violation.note_indices or range(len(current)):
+                if idx < len(current):
+                    conflicts[idx] += weight
+
+        movable = [
+            idx for idx, count in enumerate(conflicts)
+            if count and tabu_until[idx] < iteration
+            and domains[idx] & ~(1 << current[idx].pitch.midi)
+        ]
+        if not movable:
+            break
+        most = max(conflicts[idx] for idx in movable)
+        idx = random.choice([i for i in movable if conflicts[i] == most])
+
+        neighbours = [current[i].pitch.midi for i in (idx - 1, idx + 1) if 0 <= i < len(current)]
+        options = []
+        for midi in pitches_of(domains[idx] & ~(1 << current[idx].pitch.midi)):
+            trial = list(current)
+            trial[idx] = _with_pitch(current[idx], midi)
+            trial_violations = evaluate(trial)
+            motion = sum(abs(midi - n) for n in neighbours)
+            options.append((violation_cost(trial_violations), motion, random.random(), trial, trial_violations))
+        trial_cost, _, _, trial, trial_violations = min(options, key=lambda o: o[:3])
+
+        if trial_cost >= cost:
+            tabu_until[idx] = iteration + TABU_TENURE
+        if trial_cost <= cost:
+            current, violations, cost = trial, trial_violations, trial_cost
+            if cost < best[0]:
+                best = (cost, current, violations)
+                last_improvement = iteration
+
+    _, repaired, remaining = best
+    changed = [i for i, (a, b) in enumerate(zip(notes, repaired)) if a.pitch.midi != b.pitch.midi]
+    return RepairResult(notes=repaired, violations=remaining, iterations=iteration, changed=changed)
+
+
+def _with_pitch(note: Note, midi: int) -> Note:
+    """Copy of a note at another pitch; the fields are already validated."""
+    return Note.model_construct(
+        pitch=Pitch.from_midi(midi), duration=note.duration, accent=note.accent, tie=note.tie
+    )
+
+
+def line_domains(
+    cf: VoiceLine,
+    notes: list[Note],
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType
+) -> list[int]:
+    """Legal pitches per note: the generators' start, final and beat rules.
+
+    Notes on strong beats (every note in first and fourth species) must be
+    consonant with the CF; other notes need only be in range and in the key.
+    Tied notes keep their pitch.
+    """
+    plan = plan_for(cf, key, cp_range)
+    every_note_strong = species in (SpeciesType.FIRST, SpeciesType.FOURTH)
+    domains = []
+    beat = 0.0
+    for idx, note in enumerate(notes):
+        cf_idx = min(int(beat // 4), len(plan.cf_midis) - 1)
+        tied = note.tie or (idx > 0 and notes[idx - 1].tie)
+        if species == SpeciesType.FOURTH:
+            # Judged against the CF note of its half-measure pair, as in the evaluator
+            cf_idx = min(idx // 2, len(plan.cf_midis) - 1)
+        if tied:
+            domains.append(1 << note.pitch.midi)
+        elif idx == 0:
+            domains.append(plan.start_mask)
+        elif idx == len(notes) - 1:
+            domains.append(plan.finals_mask)
+        elif every_note_strong or beat % 4 in (0.0, 2.0):
+            domains.append(plan.consonant_masks[cf_idx])
+        else:
+            domains.append(plan.scale_mask)
+        beat += note.duration.to_beats()
+    return domains
+
+
+def repair_line(
+    cf: VoiceLine,
+    notes: list[Note],
+    key,
+    cp_range: VoiceRange,
+    species: SpeciesType,
+    max_iterations: int = DEFAULT_MAX_ITERATIONS,
+    deadline=None
+) -> RepairResult:
+    """Repair a two-voice species line against its species evaluation.
+
+    Leaps beyond an octave and melodic tritones also count as violations,
+    so a repair never trades a harmonic error for an unsingable line.
+    """
+    evaluate_species = SPECIES_EVALUATORS[species]
+
+    def evaluate(candidate: list[Note]) -> list[RuleViolation]:
+        line = VoiceLine.model_construct(notes=candidate, voice_index=1, voice_range=cp_range)
+        return (
+            evaluate_species(cf, line)
+            + check_leap_size(line)
+            + check_no_melodic_tritones(line)
+        )
+
+    domains = line_domains(cf, notes, key, cp_range, species)
+    return min_conflicts(notes, domains, evaluate, max_iterations, deadline)
@@ -0,0 +1,130 @@
+"""In-process LRU + TTL cache of seeded responses.
+
+A seeded request is a deterministic function of its body: the same
+endpoint, key, CF, range, seed and options always produce the same
+response. Classroom traffic repeats the same seeded examples constantly,
+so the API keeps recent responses keyed on a canonical hash of the
+request (see `request_key`) and serves repeats without generating again.
+
+The cache is bounded both by entry count and by the total size of the
+cached responses, measured as their JSON encoding; the least recently used
+entries are evicted first. Entries also expire after a time to live, so
+a cached result does not outlive a change to the generators for long.
+Hits, misses, evictions and expirations are counted for /api/metrics.
+
+Which requests are cacheable is decided by the API (see routes.py):
+unseeded generation requests bypass the cache.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 3600.0
+
+
+class _Entry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+
+
+def request_key(endpoint: str, payload: dict) -> str:
+    """Canonical hash of a request: its endpoint and its body with sorted keys."""
+    canonical = json.dumps([endpoint, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """A thread-safe LRU cache with a time to live and hit/miss counters."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """The cached value, or None on a miss; a hit becomes most recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: str, value: Any, size: int) -> None:
+        """Cache a value of `size` bytes, evicting least recently used entries to fit.
+
+        Values larger than the whole cache are not stored.
+        """
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, time.monotonic() + self.ttl_seconds)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _remove(self, key: str) -> None:
+        self._bytes -= self._entries.pop(key).size
+
+
+# Global cache; RESPONSE_CACHE_MAX_ENTRIES=0 disables it
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+)
@@ -0,0 +1,184 @@
+"""Priority lanes and fair queuing in front of the generation thread.
+
+In-process generation runs on one thread (see single_flight.py for why),
+so whichever job is queued first used to run first: a grading job that
+submits a batch per student left the student UI waiting behind all of
+them. Jobs now wait in lanes and the thread picks the next one when it
+is free:
+
+- two lanes, interactive and bulk. While both have jobs waiting, the
+  interactive lane gets LANE_WEIGHTS[INTERACTIVE] picks for every bulk
+  pick, so bulk work is slowed down but never starved;
+- within a lane, each client has its own queue and clients take turns,
+  one job each, so one client's backlog does not hold up the others.
+
+A job is one blocking call: a whole request for most endpoints, one
+solution for batches and streams, so a long bulk request gives way to
+interactive ones between its solutions. Jobs cancelled while queued are
+dropped without running.
+
+The lane and client of a call are those of the current context (see
+`current_priority`), set by the API for each request.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, NamedTuple, Optional
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Picks each lane gets, relative to the others, while several have jobs waiting
+LANE_WEIGHTS = {INTERACTIVE: 4, BULK: 1}
+# Recent queue waits kept per lane for the wait time metrics
+RECENT_WAITS = 256
+
+
+class Priority(NamedTuple):
+    """Where a generation job queues."""
+    lane: str = INTERACTIVE
+    client: str = "anonymous"
+
+
+current_priority: ContextVar[Priority] = ContextVar("current_priority", default=Priority())
+
+
+class _Job:
+    def __init__(self, fn: Callable, args: tuple, client: str):
+        self.fn = fn
+        self.args = args
+        self.client = client
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class _Lane:
+    """Per-client queues served round robin."""
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.credit = 0
+        self.queues: dict[str, deque[_Job]] = {}
+        # Clients with queued jobs, in the order they are served
+        self.turns: deque[str] = deque()
+        self.depth = 0
+        self.started = 0
+        self.max_wait_ms = 0.0
+        self.waits: deque[float] = deque(maxlen=RECENT_WAITS)
+
+    def push(self, job: _Job) -> None:
+        queue = self.queues.get(job.client)
+        if queue is None:
+            queue = self.queues[job.client] = deque()
+            self.turns.append(job.client)
+        queue.append(job)
+        self.depth += 1
+
+    def pop(self) -> _Job:
+        client = self.turns.popleft()
+        queue = self.queues[client]
+        job = queue.popleft()
+        self.depth -= 1
+        if queue:
+            self.turns.append(client)
+        else:
+            del self.queues[client]
+        return job
+
+    def record_wait(self, wait_ms: float) -> None:
+        self.started += 1
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.waits.append(wait_ms)
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "queued": self.depth,
+            "clients": len(self.queues),
+            "started": self.started,
+            "mean_wait_ms": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_ms": round(waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+class GenerationScheduler:
+    """Runs blocking calls one at a time on a thread, in lane and client order."""
+
+    def __init__(self, weights: dict[str, int] = LANE_WEIGHTS):
+        self._lanes = {lane: _Lane(weight) for lane, weight in weights.items()}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+        self._lock = threading.Lock()
+        self._busy = False
+
+    @property
+    def lanes(self) -> list[str]:
+        return list(self._lanes)
+
+    def submit(self, fn: Callable, args: tuple, priority: Priority) -> Future:
+        """Queue `fn(*args)`; the future can be cancelled until the call starts."""
+        lane = self._lanes[priority.lane]
+        job = _Job(fn, args, priority.client)
+        with self._lock:
+            lane.push(job)
+            if not self._busy:
+                self._dispatch()
+        return job.future
+
+    def _dispatch(self) -> None:
+        """Start the next live job, if any; called with the lock held."""
+        while True:
+            picked = self._next()
+            if picked is None:
+                self._busy = False
+                return
+            lane, job = picked
+            if job.future.set_running_or_notify_cancel():
+                lane.record_wait((time.monotonic() - job.enqueued) * 1000)
+                self._busy = True
+                self._executor.submit(self._run, job)
+                return
+
+    def _next(self) -> Optional[tuple[_Lane, _Job]]:
+        waiting = [lane for lane in self._lanes.values() if lane.depth]
+        if not waiting:
+            return None
+        # Smooth weighted round robin between the lanes with jobs waiting
+        for lane in waiting:
+            lane.credit += lane.weight
+        lane = max(waiting, key=lambda l: l.credit)
+        lane.credit -= sum(l.weight for l in waiting)
+        job = lane.pop()
+        if not lane.depth:
+            lane.credit = 0
+        return lane, job
+
+    def _run(self, job: _Job) -> None:
+        try:
+            result = job.fn(*job.args)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            with self._lock:
+                self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {lane: queue.stats() for lane, queue in self._lanes.items()}
+
+
+generation_scheduler = GenerationScheduler()
+
+
+async def run_generation(fn: Callable, *args, priority: Optional[Priority] = None) -> Any:
+    """Run a blocking generation call on the generation thread.
+
+    It queues in `priority`'s lane, by default the current context's.
+    """
+    future = generation_scheduler.submit(fn, args, priority or current_priority.get())
+    return await asyncio.wrap_future(future)
@@ -0,0 +1,188 @@
+"""Measure-cell dynamic programming engine for second species (2:1 rhythm).
+
+Instead of choosing one half note at a time, the engine works a whole measure
+at a time. For every CF note it enumerates the legal (strong, weak) cells, prunes
+cells that cannot reach a legal cadence with a backward pass, then samples a
+line forward through the surviving cells. Every line it returns satisfies
+`evaluate_second_species`, so no retries are needed.
+"""
+
+import random
+from typing import NamedTuple, Optional
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType
+from .intervals import is_consonant, is_perfect_consonance
+from .reachability import cadence_slots
+
+# Melodic intervals allowed between consecutive half notes (same set as the greedy generator)
+MELODIC_INTERVALS = [2, -2, 1, -1, 3, -3, 4, -4]
+
+
+class MeasureCell(NamedTuple):
+    """Two half notes sounding against one CF note."""
+    strong: int
+    weak: int
+    passing: int  # 0 if the weak beat is consonant, else direction (+1/-1) it must keep moving
+
+
+def is_parallel_perfect(prev_cf: int, cf: int, prev_cp: int, cp: int) -> bool:
+    """Check for parallel perfect consonances between two MIDI pitch pairs."""
+    prev_vert = abs(prev_cp - prev_cf)
+    curr_vert = abs(cp - cf)
+    if not (is_perfect_consonance(prev_vert) and is_perfect_consonance(curr_vert)):
+        return False
+    cf_motion = cf - prev_cf
+    cp_motion = cp - prev_cp
+    # Same direction, same interval (matches motion_type's PARALLEL)
+    return cf_motion * cp_motion > 0 and prev_vert == curr_vert
+
+
+def enumerate_measure_cells(
+    cf_midi: int,
+    strong_pitches: list[int],
+    min_midi: int,
+    max_midi: int,
+    scale_degrees: list[int]
+) -> list[MeasureCell]:
+    """Enumerate all legal (strong, weak) cells over one CF note.
+
+    Strong beats are taken from `strong_pitches` (callers pass consonances).
+    Weak beats may be consonant, or dissonant passing tones approached by step.
+    """
+    cells = []
+    for strong in strong_pitches:
+        for interval in MELODIC_INTERVALS:
+            weak = strong + interval
+            if not (min_midi <= weak <= max_midi and weak % 12 in scale_degrees):
+                continue
+            if is_consonant(abs(weak - cf_midi)):
+                cells.append(MeasureCell(strong, weak, 0))
+            elif abs(interval) <= 2:
+                cells.append(MeasureCell(strong, weak, 1 if interval > 0 else -1))
+    return cells
+
+
+def _can_follow(prev: MeasureCell, next_strong: int, prev_cf: int, cf: int) -> bool:
+    """Check the cross-measure constraints between a cell and the next strong beat."""
+    leap = next_strong - prev.weak
+    if leap not in MELODIC_INTERVALS:
+        return False
+    # A dissonant weak beat must continue by step in the same direction
+    if prev.passing and (abs(leap) > 2 or leap * prev.passing < 0):
+        return False
+    # No parallel perfects strong-to-strong or weak-to-strong
+    if is_parallel_perfect(prev_cf, cf, prev.strong, next_strong):
+        return False
+    if is_parallel_perfect(prev_cf, cf, prev.weak, next_strong):
+        return False
+    return True
+
+
+def build_measure_cells(cf_midis: list[int], key, cp_range: VoiceRange) -> list[list[MeasureCell]]:
+    """Enumerate candidate cells for every measure, including start and cadence cells."""
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = key.get_scale_degrees()
+    last = len(cf_midis) - 1
+    measures = []
+
+    for cf_idx, cf_midi in enumerate(cf_midis):
+        scale_pitches = [m for m in range(min_midi, max_midi + 1) if m % 12 in scale_degrees]
+        if cf_idx == 0:
+            strong_pitches = [m for m in scale_pitches if is_perfect_consonance(abs(m - cf_midi))]
+        else:
+            strong_pitches = [m for m in scale_pitches if is_consonant(abs(m - cf_midi))]
+
+        if cf_idx == last:
+            # Final measure: consonant strong beat resolving to the tonic final
+            finals = [
+                m for m in range(key.tonic, max_midi + 1, 12)
+                if m >= min_midi and is_perfect_consonance(abs(m - cf_midi))
+            ]
+            cells = [
+                MeasureCell(strong, final, 0)
+                for strong in strong_pitches
+                for final in finals
+                if abs(final - strong) <= 5
+            ]
+        else:
+            cells = enumerate_measure_cells(cf_midi, strong_pitches, min_midi, max_midi, scale_degrees)
+        measures.append(cells)
+
+    return measures
+
+
+def prune_dead_cells(
+    measures: list[list[MeasureCell]],
+    cf_midis: list[int],
+    deadline=None
+) -> Optional[list[list[MeasureCell]]]:
+    """Backward pass: keep only cells from which the final cadence is reachable.
+
+    Returns None if the optional anytime.Deadline expires first.
+    """
+    alive = [[] for _ in measures]
+    if not measures:
+        return alive
+    alive[-1] = list(measures[-1])
+
+    for cf_idx in range(len(measures) - 2, -1, -1):
+        if deadline is not None and deadline.expired():
+            return None
+        next_strongs = {cell.strong for cell in alive[cf_idx + 1]}
+        prev_cf, cf = cf_midis[cf_idx], cf_midis[cf_idx + 1]
+        alive[cf_idx] = [
+            cell for cell in measures[cf_idx]
+            if any(
+                cell.weak + interval in next_strongs
+                and _can_follow(cell, cell.weak + interval, prev_cf, cf)
+                for interval in MELODIC_INTERVALS
+            )
+        ]
+
+    return alive
+
+
+def generate_second_species_dp(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    cadence: tuple[int, ...] = (),
+    deadline=None
+) -> Optional[list[Note]]:
+    """Generate a second species line in a single pass over measure cells.
+
+    A non-empty `cadence` pins the last notes of the line to those pitches.
+    Returns None only if no legal line exists for this CF, key and range, or
+    if the optional anytime.Deadline expires during the backward pass.
+    """
+    cf_midis = [n.pitch.midi for n in cf.notes]
+    measures = build_measure_cells(cf_midis, key, cp_range)
+    for cf_idx, slot, midi in cadence_slots(cadence, len(cf_midis), SpeciesType.SECOND):
+        measures[cf_idx] = [cell for cell in measures[cf_idx] if cell[slot] == midi]
+    alive = prune_dead_cells(measures, cf_midis, deadline)
+    if not alive or not alive[0]:
+        return None
+
+    choices = list(alive[0])
+    random.shuffle(choices)
+    line = [choices[0]]
+
+    for cf_idx in range(1, len(cf_midis)):
+        prev = line[-1]
+        successors = [
+            cell for cell in alive[cf_idx]
+            if _can_follow(prev, cell.strong, cf_midis[cf_idx - 1], cf_midis[cf_idx])
+        ]
+        random.shuffle(successors)
+
+        # Prefer 3rd or 6th on the penultimate strong beat
+        if cf_idx == len(cf_midis) - 2:
+            preferred = [c for c in successors if abs(c.strong - cf_midis[cf_idx]) % 12 in [3, 4, 8, 9]]
+            successors = preferred or successors
+
+        line.append(successors[0])
+
+    notes = []
+    for cell in line:
+        notes.append(Note(pitch=Pitch.from_midi(cell.strong), duration=Duration.HALF))
+        notes.append(Note(pitch=Pitch.from_midi(cell.weak), duration=Duration.HALF))
+    return notes
@@ -0,0 +1,60 @@
+"""Single-flight coalescing of identical in-flight requests.
+
+During a class dozens of students press "generate" with the same seed and
+CF within milliseconds. The response cache (see response_cache.py) only
+helps once the first of them has finished; until then each would run the
+same search. Identical deterministic requests that are in flight at the
+same time instead share one computation: the first becomes the leader and
+the others await its future, getting its result or its error.
+
+Coalescing needs the event loop to stay free while the leader computes,
+so in-process generation runs on a dedicated generation thread (see
+scheduler.py). It is a single thread: the generators seed and draw from
+the global `random` state, which concurrent threads would interleave and
+make seeded results irreproducible. Throughput is what it was when
+generation ran on the loop; heavy parallel work goes to the portfolio
+processes.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Share one computation between identical concurrent calls."""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `compute()`, or the result of an identical call already in flight.
+
+        The computation runs as a task owned by the flight rather than by the
+        request that started it, so a caller that is cancelled (its client
+        went away) leaves the others, the first caller included, waiting on
+        the same result.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            with self._lock:
+                self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(compute())
+            # Retrieve the exception so that an error nobody waited for is not logged as lost
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            task.add_done_callback(lambda t: self._calls.pop(key, None))
+            self._calls[key] = task
+            with self._lock:
+                self.leaders += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+single_flight = SingleFlight()
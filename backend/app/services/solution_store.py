@@ -0,0 +1,75 @@
+"""Content-addressed store of generated solutions.
+
+Every generated solution gets an ID that is a hash of its content: the
+notes of its voices, its violations and whether it is complete, but not
+timing-dependent search statistics. The same solution always gets the
+same ID, however it was found, and an ID always names the same content.
+
+Recent solutions are kept in a bounded LRU store so that a client can
+re-fetch or share one by ID (GET /api/solutions/{id}) without generating
+it again. Since the content behind an ID never changes, the ID doubles as
+a strong ETag and responses can be cached by browsers and proxies for as
+long as they like.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_MAX_SOLUTIONS = 4096
+# Hex digits of the SHA-256 digest kept in an ID (128 bits)
+ID_LENGTH = 32
+
+# Response fields that are not part of a solution's content
+VOLATILE_FIELDS = {"solution_id", "search_stats"}
+
+
+def solution_content(payload: dict) -> dict:
+    """The part of a solution payload its ID is computed from."""
+    return {k: v for k, v in payload.items() if k not in VOLATILE_FIELDS}
+
+
+def solution_id(content: dict) -> str:
+    """Stable hash of a solution's content."""
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:ID_LENGTH]
+
+
+class SolutionStore:
+    """A thread-safe, bounded LRU map from solution IDs to their content."""
+
+    def __init__(self, max_solutions: int = DEFAULT_MAX_SOLUTIONS):
+        self.max_solutions = max_solutions
+        self._solutions: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, payload: dict) -> str:
+        """Store a solution payload and return its ID."""
+        content = solution_content(payload)
+        key = solution_id(content)
+        if self.max_solutions <= 0:
+            return key
+        with self._lock:
+            self._solutions[key] = content
+            self._solutions.move_to_end(key)
+            while len(self._solutions) > self.max_solutions:
+                self._solutions.popitem(last=False)
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        """The content of a stored solution, or None if unknown or evicted."""
+        with self._lock:
+            content = self._solutions.get(key)
+            if content is not None:
+                self._solutions.move_to_end(key)
+            return content
+
+    def __len__(self) -> int:
+        return len(self._solutions)
+
+
+# Global store; SOLUTION_STORE_MAX_ENTRIES=0 disables retrieval (IDs are still assigned)
+solution_store = SolutionStore(int(os.getenv("SOLUTION_STORE_MAX_ENTRIES", DEFAULT_MAX_SOLUTIONS)))
@@ -0,0 +1,111 @@
+"""Streaming generation: solutions are sent as soon as each one is found.
+
+A batch response (see batch.py) arrives only once its last solution is
+ready, so its latency grows with the batch. A stream yields each distinct
+solution the moment it is found, so the first result costs one solution's
+latency whatever the size of the request. The stream is a plain iterator;
+the API wraps it in an async generator that pulls one item at a time, so
+no work is done ahead of a slow client and a disconnect stops generation
+(see routes.py).
+
+A stream covers one CF, or the CF's shape in every key: each note is read
+as a scale degree and octave of the request's key and realized on the same
+degree of each of the 12 tonics x 7 modes, near the original register.
+
+Events are encoded as NDJSON lines or as Server-Sent Events.
+"""
+
+import json
+from typing import Iterator, NamedTuple, Optional, Sequence
+from app.models import CounterpointProblem, CounterpointSolution, Key, Mode, Pitch, RuleViolation, Scale
+from .anytime import Deadline, expired
+from .batch import iter_batch
+from .portfolio import PortfolioPool, solution_violations
+
+# Distinct solutions per key a stream may ask for
+MAX_STREAM_COUNT = 256
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+class StreamItem(NamedTuple):
+    """One streamed solution and the problem it solves."""
+    key: Key
+    problem: CounterpointProblem
+    solution: CounterpointSolution
+    violations: list[RuleViolation]
+
+
+def all_keys() -> list[Key]:
+    """Every tonic in every mode: 84 keys, mode by mode."""
+    return [Key(tonic=tonic, mode=mode) for mode in Mode for tonic in range(12)]
+
+
+def transpose_shape(cf_midis: Sequence[int], source: Key, target: Key) -> list[int]:
+    """Realize a line's scale-degree shape in another key.
+
+    Degrees are counted from the source tonic at or below the lowest note,
+    and realized from the target tonic nearest to it. Raises ValueError if a
+    note is not in the source key.
+    """
+    source_intervals = Scale.from_mode(source.mode).intervals
+    target_intervals = Scale.from_mode(target.mode).intervals
+    lowest = min(cf_midis)
+    source_root = lowest - (lowest - source.tonic) % 12
+    # Nearest target tonic, within a tritone of the source tonic
+    target_root = source_root + (target.tonic - source.tonic + 6) % 12 - 6
+
+    realized = []
+    for midi in cf_midis:
+        octave, offset = divmod(midi - source_root, 12)
+        if offset not in source_intervals:
+            raise ValueError(f"MIDI {midi} is not in {source}")
+        realized.append(target_root + 12 * octave + target_intervals[source_intervals.index(offset)])
+    return realized
+
+
+def _in_key(problem: CounterpointProblem, key: Key) -> CounterpointProblem:
+    """The problem with its CF shape realized in another key."""
+    if key == problem.key:
+        return problem
+    cf = problem.cantus_firmus
+    midis = transpose_shape([note.pitch.midi for note in cf.notes], problem.key, key)
+    notes = [
+        note.model_copy(update={"pitch": Pitch.from_midi(midi)})
+        for note, midi in zip(cf.notes, midis)
+    ]
+    return problem.model_copy(update={"key": key, "cantus_firmus": cf.model_copy(update={"notes": notes})})
+
+
+def stream_solutions(
+    request_class: str,
+    problem: CounterpointProblem,
+    count: int,
+    keys: Optional[Sequence[Key]] = None,
+    seed: Optional[int] = None,
+    options: Optional[dict] = None,
+    deadline: Optional[Deadline] = None,
+    workers: Optional[int] = None,
+    pool: Optional[PortfolioPool] = None
+) -> Iterator[StreamItem]:
+    """Yield up to `count` distinct solutions per key, each as soon as it is found.
+
+    `keys` defaults to the problem's own key. Every key shares the deadline;
+    once it expires no further key is started. Closing the iterator stops
+    generation and cancels pool tasks in flight.
+    """
+    for i, key in enumerate(keys or [problem.key]):
+        if i and expired(deadline):
+            return
+        keyed = _in_key(problem, key)
+        for solution in iter_batch(request_class, keyed, count, seed, options, deadline, workers, pool):
+            yield StreamItem(key, keyed, solution, solution_violations(request_class, solution))
+
+
+def format_event(event: str, payload: dict, sse: bool) -> str:
+    """Encode one event as an NDJSON line or a Server-Sent Event."""
+    data = json.dumps(payload, separators=(",", ":"))
+    if sse:
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
@@ -0,0 +1,245 @@
+"""Third species figure library and measure-level search (4:1 rhythm).
+
+A figure is the four quarter notes sounding against one CF note. The library
+holds every legal figure for a (CF pitch, key, range): consonant beats 1 and 3,
+and weak-beat dissonances treated as passing tones, neighbour tones, cambiata
+or double neighbours. Figures carry the set of exit pitches (next
+downbeats) they may move to, and the search looks up the next measure's
+figures by entry pitch, so a line is built by searching over whole measures
+rather than single notes.
+"""
+
+import random
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, Key, Mode, SpeciesType
+from .intervals import is_consonant, is_perfect_consonance
+from .reachability import cadence_slots
+from .second_species_dp import is_parallel_perfect
+
+# Melodic intervals allowed between consecutive quarter notes (same set as the greedy generator)
+MELODIC_INTERVALS = [2, -2, 1, -1, 3, -3, 4, -4]
+
+
+class Figure(NamedTuple):
+    """Four quarter notes over one CF note."""
+    pitches: tuple[int, int, int, int]
+    name: str
+    exits: frozenset[int]  # Legal downbeats for the following measure
+    step_entry: bool  # Figure leaves its first note by leap, so it must be entered by step
+
+
+class FigureLibrary(NamedTuple):
+    """All legal figures over one CF pitch."""
+    figures: tuple[Figure, ...]
+
+
+def _is_step(interval: int) -> bool:
+    return 0 < abs(interval) <= 2
+
+
+def _classify_beat_two(i1: int, i2: int, i3: int, returns: bool) -> Optional[str]:
+    """Name the figure that licenses a dissonance on the second quarter, or None."""
+    if _is_step(i1) and _is_step(i2):
+        return "passing" if i1 * i2 > 0 else "neighbour"
+    # Cambiata: step down into the dissonance, leap a third down, step back up
+    if i1 < 0 and _is_step(i1) and i2 in (-3, -4) and i3 > 0 and _is_step(i3):
+        return "cambiata"
+    # Double neighbour: step to one neighbour, leap a third to the other, step home
+    if _is_step(i1) and abs(i2) in (3, 4) and i1 * i2 < 0 and _is_step(i3) and returns:
+        return "double_neighbour"
+    return None
+
+
+def _in_key(midi: int, min_midi: int, max_midi: int, scale_degrees: list[int]) -> bool:
+    return min_midi <= midi <= max_midi and midi % 12 in scale_degrees
+
+
+@lru_cache(maxsize=512)
+def build_figure_library(cf_midi: int, tonic: int, mode: Mode, cp_range: VoiceRange) -> FigureLibrary:
+    """Compile every legal four-note figure over one CF pitch."""
+    min_midi, max_midi = cp_range.get_range()
+    scale_degrees = Key(tonic=tonic, mode=mode).get_scale_degrees()
+    figures = []
+
+    for p0 in range(min_midi, max_midi + 1):
+        if not _in_key(p0, min_midi, max_midi, scale_degrees) or not is_consonant(abs(p0 - cf_midi)):
+            continue
+        for i1 in MELODIC_INTERVALS:
+            p1 = p0 + i1
+            if not _in_key(p1, min_midi, max_midi, scale_degrees):
+                continue
+            for i2 in MELODIC_INTERVALS:
+                p2 = p1 + i2
+                # Beat 3 is strong and must be consonant; no note leapt into and out of
+                if not _in_key(p2, min_midi, max_midi, scale_degrees) or not is_consonant(abs(p2 - cf_midi)):
+                    continue
+                if abs(i1) > 2 and abs(i2) > 2:
+                    continue
+                for i3 in MELODIC_INTERVALS:
+                    p3 = p2 + i3
+                    if not _in_key(p3, min_midi, max_midi, scale_degrees):
+                        continue
+                    if abs(i2) > 2 and abs(i3) > 2:
+                        continue
+                    figure = _make_figure(
+                        (p0, p1, p2, p3), (i1, i2, i3), cf_midi, min_midi, max_midi, scale_degrees
+                    )
+                    if figure:
+                        figures.append(figure)
+
+    return FigureLibrary(figures=tuple(figures))
+
+
+def _make_figure(
+    pitches: tuple[int, int, int, int],
+    intervals: tuple[int, int, int],
+    cf_midi: int,
+    min_midi: int,
+    max_midi: int,
+    scale_degrees: list[int]
+) -> Optional[Figure]:
+    """Validate weak-beat treatment and work out the figure's exit pitches."""
+    p0, p1, p2, p3 = pitches
+    i1, i2, i3 = intervals
+    name = "consonant"
+
+    if not is_consonant(abs(p1 - cf_midi)):
+        name = _classify_beat_two(i1, i2, i3, returns=(p3 == p0))
+        if name is None:
+            return None
+
+    if is_consonant(abs(p3 - cf_midi)):
+        # Leapt-into final quarter must be left by step
+        allowed = [i for i in MELODIC_INTERVALS if abs(i3) <= 2 or _is_step(i)]
+        exits = [p3 + i for i in allowed]
+    else:
+        if not _is_step(i3):
+            return None
+        # Passing tone continues in the same direction; neighbour returns
+        direction = 1 if i3 > 0 else -1
+        exits = [p3 + direction, p3 + 2 * direction, p2]
+        if name == "consonant":
+            name = "passing"
+
+    exits = frozenset(e for e in exits if _in_key(e, min_midi, max_midi, scale_degrees))
+    if not exits:
+        return None
+    return Figure(pitches=pitches, name=name, exits=exits, step_entry=abs(i1) > 2)
+
+
+def _can_follow(prev: Figure, nxt: Figure, prev_cf: int, cf: int) -> bool:
+    """Check the constraints between consecutive figures."""
+    entry = nxt.pitches[0]
+    if entry not in prev.exits:
+        return False
+    if nxt.step_entry and not _is_step(entry - prev.pitches[3]):
+        return False
+    # No parallel perfects downbeat-to-downbeat or across the barline
+    if is_parallel_perfect(prev_cf, cf, prev.pitches[0], entry):
+        return False
+    if is_parallel_perfect(prev_cf, cf, prev.pitches[3], entry):
+        return False
+    return True
+
+
+def _measure_figures(cf_midis: list[int], key, cp_range: VoiceRange) -> list[list[Figure]]:
+    """Pick the library figures usable in each measure, including start and cadence."""
+    last = len(cf_midis) - 1
+    measures = []
+
+    for cf_idx, cf_midi in enumerate(cf_midis):
+        library = build_figure_library(cf_midi, key.tonic, key.mode, cp_range)
+        figures = list(library.figures)
+        if cf_idx == 0:
+            figures = [f for f in figures if is_perfect_consonance(abs(f.pitches[0] - cf_midi))]
+        if cf_idx == last:
+            figures = [
+                f for f in figures
+                if f.pitches[3] % 12 == key.tonic and is_perfect_consonance(abs(f.pitches[3] - cf_midi))
+            ]
+        measures.append(figures)
+
+    return measures
+
+
+def prune_dead_figures(
+    measures: list[list[Figure]],
+    cf_midis: list[int],
+    deadline=None
+) -> Optional[list[list[Figure]]]:
+    """Backward pass: keep only figures from which the final cadence is reachable.
+
+    Returns None if the optional anytime.Deadline expires first.
+    """
+    alive = [[] for _ in measures]
+    if not measures:
+        return alive
+    alive[-1] = list(measures[-1])
+
+    for cf_idx in range(len(measures) - 2, -1, -1):
+        if deadline is not None and deadline.expired():
+            return None
+        by_entry: dict[int, list[Figure]] = {}
+        for figure in alive[cf_idx + 1]:
+            by_entry.setdefault(figure.pitches[0], []).append(figure)
+
+        prev_cf, cf = cf_midis[cf_idx], cf_midis[cf_idx + 1]
+        alive[cf_idx] = [
+            figure for figure in measures[cf_idx]
+            if any(
+                _can_follow(figure, nxt, prev_cf, cf)
+                for entry in figure.exits
+                for nxt in by_entry.get(entry, ())
+            )
+        ]
+
+    return alive
+
+
+def generate_third_species_figures(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    cadence: tuple[int, ...] = (),
+    deadline=None
+) -> Optional[list[Note]]:
+    """Generate a third species line by searching over whole-measure figures.
+
+    A non-empty `cadence` pins the last notes of the line to those pitches.
+    Returns None only if no legal line exists for this CF, key and range, or
+    if the optional anytime.Deadline expires during the backward pass.
+    """
+    cf_midis = [n.pitch.midi for n in cf.notes]
+    measures = _measure_figures(cf_midis, key, cp_range)
+    for cf_idx, slot, midi in cadence_slots(cadence, len(cf_midis), SpeciesType.THIRD):
+        measures[cf_idx] = [f for f in measures[cf_idx] if f.pitches[slot] == midi]
+    alive = prune_dead_figures(measures, cf_midis, deadline)
+    if not alive or not alive[0]:
+        return None
+
+    choices = list(alive[0])
+    random.shuffle(choices)
+    line = [choices[0]]
+
+    for cf_idx in range(1, len(cf_midis)):
+        prev = line[-1]
+        successors = [
+            figure for figure in alive[cf_idx]
+            if _can_follow(prev, figure, cf_midis[cf_idx - 1], cf_midis[cf_idx])
+        ]
+        random.shuffle(successors)
+
+        # Prefer 3rd or 6th on the penultimate beat 3
+        if cf_idx == len(cf_midis) - 2:
+            preferred = [f for f in successors if abs(f.pitches[2] - cf_midis[cf_idx]) % 12 in [3, 4, 8, 9]]
+            successors = preferred or successors
+
+        line.append(successors[0])
+
+    return [
+        Note(pitch=Pitch.from_midi(midi), duration=Duration.QUARTER)
+        for figure in line
+        for midi in figure.pitches
+    ]
+
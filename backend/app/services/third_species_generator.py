@@ -1,20 +1,53 @@
 """Third species counterpoint generator (4:1 rhythm)."""
 
 import random
-from typing import Optional
-from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, CounterpointProblem, CounterpointSolution
-from .intervals import is_consonant, calculate_interval, is_perfect_consonance
-from .motion import motion_type, MotionType
+from typing import Optional, Sequence
+from app.models import Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem, CounterpointSolution
+from .anytime import BestSoFar, Deadline, best_effort_solution, expired
+from .beam_search import beam_search
+from .bitsets import ALL_PITCHES, interval_mask, masks_of, parallel_mask, pick, union
+from .generation_plan import GenerationPlan, plan_for
+from .monte_carlo import sample_lines, species_spec
+from .third_species_figures import generate_third_species_figures
+from .cadences import cadence_options, cadence_masks
+from .nogoods import NogoodStore
+from .repair import repair_line
+from .third_species_rules import evaluate_third_species
+
+# Melodic intervals, stepwise first; weak-beat dissonances only by step
+MELODIC_INTERVALS = (2, -2, 1, -1, 3, -3, 4, -4)
+PASSING_STEPS = (2, -2, 1, -1)
+# Moves into the final: steps are preferred over small leaps, up to a 4th
+STEPS = (2, -2, 1, -1, 0)
+SMALL_LEAPS = (3, -3, 4, -4, 5, -5)
+FINAL_APPROACH = STEPS + SMALL_LEAPS
 
 
 def generate_third_species(
     problem: CounterpointProblem,
     seed: Optional[int] = None,
-    max_attempts: int = 5000
+    max_attempts: int = 5000,
+    nogoods: Optional[NogoodStore] = None,
+    beam_width: Optional[int] = None,
+    deadline: Optional[Deadline] = None,
+    rank_temperature: float = 0.0
 ) -> Optional[CounterpointSolution]:
-    """Generate third species counterpoint (4:1 rhythm)."""
+    """Generate third species counterpoint (4:1 rhythm).
+    
+    Dead ends found by failed greedy attempts are remembered in `nogoods` (a
+    fresh store per request unless one is passed in to inspect its counters).
+    With `beam_width`, a score-guided beam search (see beam_search.py) runs
+    before the figure search, which samples lines without ranking them.
+    If the figure search fails, vectorized random walks (see monte_carlo.py)
+    run before the greedy restarts; `rank_temperature` draws among the
+    sampled lines for variety instead of taking the best.
+    Once `deadline` expires the search stops and the best line found so far
+    (by any of the stages) is returned with `complete=False` (see anytime.py).
+    """
     if seed is not None:
         random.seed(seed)
+    if nogoods is None:
+        nogoods = NogoodStore()
     
     cf = problem.cantus_firmus
     key = problem.key
@@ -23,22 +56,90 @@ def generate_third_species(
     cf_avg = sum(n.pitch.midi for n in cf.notes) / len(cf.notes)
     cp_range = VoiceRange.SOPRANO if cf_avg < 60 else VoiceRange.BASS
     
-    for _ in range(max_attempts):
-        notes = _generate_third_species_greedy(cf, key, cp_range)
+    cf_midis = [n.pitch.midi for n in cf.notes]
+    masks = [masks_of(m) for m in cadence_masks(cf_midis, key, cp_range, SpeciesType.THIRD)]
+    plan = plan_for(cf, key, cp_range)
+    best = BestSoFar()
+    
+    if beam_width:
+        for reachable in masks:
+            if expired(deadline):
+                break
+            notes = _generate_third_species_beam(plan, reachable, beam_width, deadline, best)
+            if notes:
+                cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+                return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "beam"})
+    
+    # Pin a modal cadence, then let the figure search fill toward it in one pass
+    for cadence in cadence_options(cf_midis, key, cp_range, SpeciesType.THIRD) + [()]:
+        if expired(deadline):
+            break
+        notes = generate_third_species_figures(cf, key, cp_range, cadence, deadline)
+        if notes:
+            cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+            return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "figures"})
+    
+    for reachable in masks:
+        if expired(deadline):
+            break
+        notes = _generate_monte_carlo(cf, plan, reachable, cp_range, rank_temperature, deadline, best)
+        if notes:
+            cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
+            return CounterpointSolution(voice_lines=[cf, cp_voice], search_stats={"strategy": "monte-carlo"})
+    
+    for attempt in range(max_attempts):
+        if expired(deadline):
+            return best_effort_solution(cf, key, cp_range, SpeciesType.THIRD, best)
+        mask_idx = attempt % len(masks)
+        notes = _generate_third_species_greedy(cf, key, cp_range, masks[mask_idx], nogoods, mask_idx, plan, best)
         if notes and len(notes) == len(cf.notes) * 4:
+            # Greedy lines can break rules the candidate filters miss; repair them in place
+            repaired = repair_line(cf, notes, key, cp_range, SpeciesType.THIRD, deadline=deadline)
+            if repaired.violations:
+                # A line the repair could not fix is only a fallback; try the next attempt
+                best.offer(repaired.notes, repaired.violations)
+                continue
+            notes = repaired.notes
             cp_voice = VoiceLine(notes=notes, voice_index=1, voice_range=cp_range)
-            return CounterpointSolution(voice_lines=[cf, cp_voice])
+            return CounterpointSolution(
+                voice_lines=[cf, cp_voice], search_stats={"strategy": "greedy", "attempts": attempt + 1}
+            )
     
+    if expired(deadline):
+        return best_effort_solution(cf, key, cp_range, SpeciesType.THIRD, best)
     return None
 
 
-def _generate_third_species_greedy(cf: VoiceLine, key, cp_range: VoiceRange) -> Optional[list[Note]]:
-    """Greedy generation for third species."""
-    min_midi, max_midi = cp_range.get_range()
-    scale_degrees = key.get_scale_degrees()
+def _generate_third_species_greedy(
+    cf: VoiceLine,
+    key,
+    cp_range: VoiceRange,
+    reachable: Optional[tuple[int, ...]] = None,
+    nogoods: Optional[NogoodStore] = None,
+    context: int = 0,
+    plan: Optional[GenerationPlan] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Greedy generation for third species, pruned by an optional reachability mask.
+    
+    Candidates are MIDI bitsets; `reachable` holds one bitset per quarter note.
+    With a nogood store, states are (position, previous pitch, last downbeat,
+    context): later candidates look back at the previous note and, for the
+    parallel check, at the most recent downbeat; `context` identifies the mask.
+    The notes placed before a dead end are offered to `best`.
+    """
+    if plan is None:
+        plan = plan_for(cf, key, cp_range)
     notes = []
+    midis = []
+    last_pos = len(cf.notes) * 4 - 1
+    
+    def state(pos: int) -> tuple:
+        if pos == 0:
+            return (0, None, None, context)
+        return (pos, midis[pos - 1], midis[(pos - 1) // 4 * 4], context)
     
-    for cf_idx, cf_note in enumerate(cf.notes):
+    for cf_idx in range(len(cf.notes)):
         # Generate four notes per CF note
         for beat in range(4):  # 0, 1, 2, 3
             is_strong = (beat == 0 or beat == 2)
@@ -46,117 +147,138 @@ def _generate_third_species_greedy(cf: VoiceLine, key, cp_range: VoiceRange) ->
             is_last = (cf_idx == len(cf.notes) - 1 and beat == 3)
             
             if is_first:
-                candidates = _get_start_candidates(cf_note, min_midi, max_midi, scale_degrees)
-                random.shuffle(candidates)
+                tiers = [plan.start_mask]
             elif is_last:
-                candidates = _get_end_candidates(cf_note, notes[-1], min_midi, max_midi, key.tonic)
-                random.shuffle(candidates)
+                tiers = _get_end_candidates(plan, midis[-1])
             else:
-                candidates = _get_third_species_candidates(
-                    notes[-1], cf_note, is_strong, min_midi, max_midi, scale_degrees, notes, cf, cf_idx, beat
+                tiers = _get_third_species_candidates(plan, is_strong, midis, cf_idx, beat)
+            
+            pos = cf_idx * 4 + beat
+            allowed = reachable[pos] if reachable is not None else ALL_PITCHES
+            
+            if nogoods is not None:
+                # On a downbeat the candidate becomes the downbeat the next position looks back at
+                downbeat = midis[pos - beat] if beat else None
+                allowed = nogoods.prune_mask(
+                    allowed & union(tiers),
+                    state(pos),
+                    None if pos == last_pos else lambda c: (pos + 1, c, c if downbeat is None else downbeat, context)
                 )
             
-            if not candidates:
+            midi = pick(tiers, allowed)
+            if midi is None:
+                if best is not None:
+                    best.offer(notes)
                 return None
             
-            notes.append(Note(pitch=Pitch.from_midi(candidates[0]), duration=Duration.QUARTER))
+            midis.append(midi)
+            notes.append(Note(pitch=Pitch.from_midi(midi), duration=Duration.QUARTER))
     
     return notes
 
 
-def _get_start_candidates(cf_note: Note, min_midi: int, max_midi: int, scale_degrees: list[int]) -> list[int]:
-    """Get candidates for first note (perfect consonance)."""
-    candidates = []
-    for midi in range(min_midi, max_midi + 1):
-        if midi % 12 not in scale_degrees:
-            continue
-        interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-        if is_perfect_consonance(interval):
-            candidates.append(midi)
-    return candidates
+def _generate_monte_carlo(
+    cf: VoiceLine,
+    plan: GenerationPlan,
+    reachable: tuple[int, ...],
+    cp_range: VoiceRange,
+    rank_temperature: float = 0.0,
+    deadline: Optional[Deadline] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Batched random walks (see monte_carlo.py); the best-ranked line that passes evaluation.
+    
+    Lines that fail are offered to `best` with their violations.
+    """
+    spec = species_spec(plan, reachable, 4, MELODIC_INTERVALS, FINAL_APPROACH, resolve_leaps=True)
+    for midis in sample_lines(spec, temperature=rank_temperature):
+        if expired(deadline):
+            return None
+        notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.QUARTER) for m in midis]
+        violations = evaluate_third_species(cf, VoiceLine(notes=notes, voice_index=1, voice_range=cp_range))
+        if not violations:
+            return notes
+        if best is not None:
+            best.offer(notes, violations)
+    return None
+
+
+def _generate_third_species_beam(
+    plan: GenerationPlan,
+    reachable: tuple[int, ...],
+    beam_width: int,
+    deadline: Optional[Deadline] = None,
+    best: Optional[BestSoFar] = None
+) -> Optional[list[Note]]:
+    """Beam search over the greedy candidate tiers, pruned by a reachability mask.
+    
+    Unlike the greedy loop, a dissonant weak beat must also be left by step,
+    and so must any note approached by leap. If it stops short, its best
+    partial line is offered to `best`.
+    """
+    def quarter_notes(midis) -> list[Note]:
+        return [Note(pitch=Pitch.from_midi(m), duration=Duration.QUARTER) for m in midis]
+    
+    last_pos = len(plan.cf_midis) * 4 - 1
+    
+    def expand(midis: tuple[int, ...], pos: int) -> list[int]:
+        cf_idx, beat = divmod(pos, 4)
+        if pos == 0:
+            tiers = [plan.start_mask]
+        elif pos == last_pos:
+            tiers = _get_end_candidates(plan, midis[-1])
+        else:
+            tiers = _get_third_species_candidates(plan, beat in (0, 2), midis, cf_idx, beat)
+        allowed = reachable[pos]
+        leapt = pos >= 2 and abs(midis[-1] - midis[-2]) > 2
+        if leapt or (pos and not plan.consonant_masks[(pos - 1) // 4] >> midis[-1] & 1):
+            allowed &= interval_mask(midis[-1], PASSING_STEPS)
+        return [tier & allowed for tier in tiers]
+    
+    cf_midis = [cf_midi for cf_midi in plan.cf_midis for _ in range(4)]
+    midis = beam_search(
+        cf_midis, [pos % 2 == 0 for pos in range(len(cf_midis))], expand, beam_width, deadline=deadline,
+        partial=None if best is None else lambda midis: best.offer(quarter_notes(midis))
+    )
+    if midis is None:
+        return None
+    return quarter_notes(midis)
 
 
-def _get_end_candidates(cf_note: Note, prev_note: Note, min_midi: int, max_midi: int, tonic: int) -> list[int]:
+def _get_end_candidates(plan: GenerationPlan, prev_midi: int) -> list[int]:
     """Get candidates for last note (tonic, perfect consonance, prefer stepwise)."""
-    preferred = []
-    candidates = []
-    for octave in range(12):
-        midi = tonic + octave * 12
-        if min_midi <= midi <= max_midi:
-            interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-            if is_perfect_consonance(interval):
-                step_dist = abs(midi - prev_note.pitch.midi)
-                if step_dist <= 2:
-                    preferred.append(midi)
-                elif step_dist <= 5:
-                    candidates.append(midi)
-    return preferred + candidates
+    step = plan.finals_mask & interval_mask(prev_midi, STEPS)
+    leap = plan.finals_mask & interval_mask(prev_midi, SMALL_LEAPS)
+    return [step, leap]
 
 
 def _get_third_species_candidates(
-    prev_note: Note,
-    cf_note: Note,
+    plan: GenerationPlan,
     is_strong: bool,
-    min_midi: int,
-    max_midi: int,
-    scale_degrees: list[int],
-    notes: list[Note],
-    cf: VoiceLine,
+    midis: Sequence[int],
     cf_idx: int,
     beat: int
 ) -> list[int]:
-    """Get valid candidates for next note in third species."""
-    candidates = []
-    preferred = []
-    prev_midi = prev_note.pitch.midi
-    is_penultimate = (cf_idx == len(cf.notes) - 2 and beat == 2)
-    
-    # Prefer stepwise motion
-    for interval in [2, -2, 1, -1, 3, -3, 4, -4]:
-        midi = prev_midi + interval
-        if not (min_midi <= midi <= max_midi and midi % 12 in scale_degrees):
-            continue
-        
-        # Check consonance with CF
-        vert_interval = calculate_interval(cf_note.pitch, Pitch.from_midi(midi))
-        
-        if is_strong:
-            # Strong beats (1 and 3) must be consonant
-            if not is_consonant(vert_interval):
-                continue
-        else:
-            # Weak beats can be dissonant if passing
-            if not is_consonant(vert_interval):
-                if abs(interval) > 2:
-                    continue
-        
-        # Check no parallel perfects on strong beats
-        if is_strong and len(notes) >= 4:
-            prev_strong_idx = len(notes) - 4 if beat == 0 else len(notes) - 2
-            if prev_strong_idx >= 0:
-                prev_cf_idx = prev_strong_idx // 4
-                if prev_cf_idx < len(cf.notes):
-                    prev_vert = calculate_interval(cf.notes[prev_cf_idx].pitch, notes[prev_strong_idx].pitch)
-                    if is_perfect_consonance(prev_vert) and is_perfect_consonance(vert_interval):
-                        motion = motion_type(
-                            cf.notes[prev_cf_idx].pitch, cf_note.pitch,
-                            notes[prev_strong_idx].pitch, Pitch.from_midi(midi)
-                        )
-                        if motion == MotionType.PARALLEL:
-                            continue
-        
-        # Prefer 3rd or 6th for penultimate strong beat
-        if is_penultimate:
-            penult_mod = vert_interval % 12
-            if penult_mod in [3, 4, 8, 9]:
-                preferred.append(midi)
-            else:
-                candidates.append(midi)
-        else:
-            candidates.append(midi)
+    """Get valid candidates for next note in third species, as bitset tiers."""
+    prev_midi = midis[-1]
+    moves = interval_mask(prev_midi, MELODIC_INTERVALS)
+    consonant = plan.consonant_masks[cf_idx]
+    
+    if not is_strong:
+        # Weak beats can be dissonant if passing, i.e. approached by step
+        return [(moves & consonant) | (interval_mask(prev_midi, PASSING_STEPS) & plan.scale_mask)]
+    
+    # Strong beats (1 and 3) must be consonant
+    candidates = moves & consonant
+    
+    # Check no parallel perfects on strong beats
+    if len(midis) >= 4:
+        prev_strong_idx = len(midis) - 4 if beat == 0 else len(midis) - 2
+        candidates &= ~parallel_mask(
+            plan.cf_midis[prev_strong_idx // 4], plan.cf_midis[cf_idx], midis[prev_strong_idx]
+        )
     
-    # Shuffle each group separately
-    if preferred:
-        random.shuffle(preferred)
-    random.shuffle(candidates)
-    return preferred + candidates if preferred else candidates
+    # Prefer 3rd or 6th for penultimate strong beat
+    if cf_idx == len(plan.cf_midis) - 2 and beat == 2:
+        return [candidates & plan.penultimate_mask, candidates]
+    return [candidates]
@@ -0,0 +1,117 @@
+"""Tonic-relative canonical form of two-voice problems.
+
+A counterpoint over a CF in E dorian is a counterpoint over the same CF in
+D dorian, a tone higher: the rules only look at intervals, the scale and
+the voice ranges. The API therefore solves every two-voice problem in a
+canonical key, with the tonic moved to C and the CF moved with it, and
+transposes the answer back. Response cache entries (see response_cache.py)
+and generation plans (see generation_plan.py) are then shared by the 12
+transpositions of a CF shape instead of being built once per tonic.
+
+Voice ranges are the exception: they are absolute. The canonical problem
+moves the CF by at most a tritone, and is not used at all if that would
+give the CF a different counterpoint range (see `canonical_shift`), since
+its answer could then never be moved back. A transposed answer is still
+rejected, and the original problem solved directly, if
+
+- a counterpoint note moved back falls outside its range, or
+- the canonical answer reports a range violation, whose pitch would be wrong.
+"""
+
+import threading
+from typing import Sequence
+from app.models import VoiceRange
+
+# Canonical tonic pitch class
+CANONICAL_TONIC = 0
+
+
+def canonical_offset(tonic: int) -> int:
+    """Semitones from the canonical tonic up to `tonic`, in -5..6 so the CF moves at most a tritone."""
+    return (tonic - CANONICAL_TONIC + 5) % 12 - 5
+
+
+def canonical_shift(tonic: int, cf_midis: Sequence[int]) -> int:
+    """The `canonical_offset` to solve this problem at, or 0 to solve it as asked.
+
+    Moving the CF across the middle of the keyboard flips its counterpoint
+    between soprano and bass, and the canonical answer would be rejected.
+    """
+    offset = canonical_offset(tonic)
+    if counterpoint_range([m - offset for m in cf_midis]) != counterpoint_range(cf_midis):
+        return 0
+    return offset
+
+
+def counterpoint_range(cf_midis: Sequence[int]) -> VoiceRange:
+    """The range the two-voice species generators give a counterpoint to this CF."""
+    cf_avg = sum(cf_midis) / len(cf_midis)
+    return VoiceRange.SOPRANO if cf_avg < 60 else VoiceRange.BASS
+
+
+def transpose_midis(payload, semitones: int):
+    """Copy of a JSON-like payload with every "midi" value moved by `semitones`."""
+    if isinstance(payload, dict):
+        return {
+            k: v + semitones if k == "midi" else transpose_midis(v, semitones)
+            for k, v in payload.items()
+        }
+    if isinstance(payload, list):
+        return [transpose_midis(v, semitones) for v in payload]
+    return payload
+
+
+def fits_transposition(cf_midis: Sequence[int], canonical_cf_midis: Sequence[int], response: dict) -> bool:
+    """Whether a response transposed back from the canonical problem is the answer to the original.
+
+    `response` is the transposed-back response payload; its counterpoint
+    notes are the "midi" values outside `cf_notes`.
+    """
+    cp_range = counterpoint_range(cf_midis)
+    if counterpoint_range(canonical_cf_midis) != cp_range:
+        return False
+    low, high = cp_range.get_range()
+    cp_midis = _midis({k: v for k, v in response.items() if k != "cf_notes"})
+    if any(not low <= midi <= high for midi in cp_midis):
+        return False
+    return not any(v.get("rule_code") == "RANGE_VIOLATION" for v in _violations(response))
+
+
+def _midis(payload) -> list[int]:
+    if isinstance(payload, dict):
+        return [payload["midi"]] if "midi" in payload else [m for v in payload.values() for m in _midis(v)]
+    if isinstance(payload, list):
+        return [m for v in payload for m in _midis(v)]
+    return []
+
+
+def _violations(payload) -> list[dict]:
+    if isinstance(payload, dict):
+        found = list(payload.get("violations") or [])
+        return found + [v for k, item in payload.items() if k != "violations" for v in _violations(item)]
+    if isinstance(payload, list):
+        return [v for item in payload for v in _violations(item)]
+    return []
+
+
+class TranspositionStats:
+    """Counts of canonical answers used and rejected, for /api/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transposed = 0
+        self.rejected = 0
+
+    def record(self, accepted: bool) -> None:
+        with self._lock:
+            if accepted:
+                self.transposed += 1
+            else:
+                self.rejected += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"transposed": self.transposed, "rejected": self.rejected}
+
+
+transposition_stats = TranspositionStats()
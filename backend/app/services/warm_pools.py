@@ -0,0 +1,210 @@
+"""Warm pools of pre-generated solutions for hot problems.
+
+Unseeded requests for the same CF come in runs: the CF a class is working
+on is generated over and over with fresh seeds. Instead of searching at
+request time, the API keeps a small pool of ready solutions per hot
+(request class, CF, key, species, voices, options) and pops one in O(1);
+an empty pool falls back to live generation.
+
+Which problems are hot is decided by frequency over a sliding window of
+recent unseeded requests. A background task, started in the application
+lifespan (see main.py), refills the pools of hot problems one solution at
+a time and drops the pools of problems that went cold. A problem whose
+refills keep failing (no complete solution within the refill budget) is
+given up on until it goes cold, so an unsatisfiable CF does not keep a
+worker busy for as long as it is requested. Refills run in the
+portfolio worker processes (see portfolio.py), off the request path and
+away from the generators' global random state.
+"""
+
+import asyncio
+import os
+import random
+import threading
+from collections import Counter, deque
+from typing import Awaitable, Callable, NamedTuple, Optional
+from app.models import CounterpointProblem, CounterpointSolution
+from .portfolio import PORTFOLIOS, get_pool
+from .response_cache import request_key
+
+# Solutions kept per hot problem
+DEFAULT_POOL_SIZE = 4
+# Hot problems kept warm at once
+DEFAULT_MAX_POOLS = 16
+# Unseeded requests the frequency window covers
+RECENT_REQUESTS = 256
+# Requests in the window that make a problem hot
+HOT_MIN_REQUESTS = 3
+# Budget of one refill run, and the refiller's sleep when there is nothing to do
+REFILL_BUDGET_MS = 10_000
+IDLE_SECONDS = 1.0
+# Failed refills in a row after which a problem is not refilled until it goes cold
+MAX_REFILL_FAILURES = 3
+
+
+class PoolSpec(NamedTuple):
+    """What to generate for a pool."""
+    request_class: str
+    problem: CounterpointProblem
+    options: dict
+
+
+def pool_key(spec: PoolSpec) -> str:
+    """Identity of a pool: the problem and options, not the seed."""
+    problem = spec.problem
+    return request_key("warm-pool", {
+        "request_class": spec.request_class,
+        "tonic": problem.key.tonic,
+        "mode": problem.key.mode.value,
+        "cf_notes": [note.pitch.midi for note in problem.cantus_firmus.notes],
+        "cf_voice_range": problem.cantus_firmus.voice_range.value,
+        "num_voices": problem.num_voices,
+        "species": [species.value for species in problem.species_per_voice],
+        "options": spec.options,
+    })
+
+
+async def solve_in_pool(spec: PoolSpec, seed: int) -> Optional[CounterpointSolution]:
+    """Run the request class's default strategy once in the portfolio pool."""
+    pool = get_pool()
+    strategy = PORTFOLIOS[spec.request_class][0]
+    extra = {k: v for k, v in spec.options.items() if k not in strategy.options}
+    future = pool.submit(
+        spec.request_class, spec.problem, strategy, seed, extra, pool.next_run_id(), REFILL_BUDGET_MS
+    )
+    solution, _ = await asyncio.wrap_future(future)
+    return solution
+
+
+class WarmPools:
+    """Bounded solution pools for the most requested problems."""
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_pools: int = DEFAULT_MAX_POOLS,
+        solve: Callable[[PoolSpec, int], Awaitable[Optional[CounterpointSolution]]] = solve_in_pool
+    ):
+        self.pool_size = pool_size
+        self.max_pools = max_pools
+        self._solve = solve
+        self._recent: deque[str] = deque()
+        self._counts: Counter[str] = Counter()
+        self._specs: dict[str, PoolSpec] = {}
+        self._pools: dict[str, deque[CounterpointSolution]] = {}
+        self._failures: Counter[str] = Counter()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Routes may take from any thread; the refiller runs on the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.failed_refills = 0
+
+    def take(self, request_class: str, problem: CounterpointProblem, options: dict) -> Optional[CounterpointSolution]:
+        """Pop a ready solution, or None; counts the request towards the problem's heat."""
+        spec = PoolSpec(request_class, problem, options)
+        key = pool_key(spec)
+        with self._lock:
+            self._record(key, spec)
+            pool = self._pools.get(key)
+            solution = pool.popleft() if pool else None
+            if solution is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wake.set)
+        return solution
+
+    def hot_keys(self) -> list[str]:
+        """The hottest problems, most requested first."""
+        return [
+            key for key, count in self._counts.most_common(self.max_pools)
+            if count >= HOT_MIN_REQUESTS
+        ]
+
+    async def refill_once(self) -> bool:
+        """Generate one solution for the emptiest hot pool; False if none was added."""
+        with self._lock:
+            hot = self.hot_keys()
+            for key in list(self._pools):
+                if key not in hot:
+                    del self._pools[key]
+            wanting = [
+                key for key in hot
+                if len(self._pools.get(key, ())) < self.pool_size and self._failures[key] < MAX_REFILL_FAILURES
+            ]
+            if not wanting:
+                return False
+            key = min(wanting, key=lambda k: len(self._pools.get(k, ())))
+            spec = self._specs[key]
+        solution = await self._solve(spec, random.randrange(2 ** 31))
+        with self._lock:
+            self.refills += 1
+            if solution is None or not solution.complete:
+                self.failed_refills += 1
+                if key in self._counts:
+                    self._failures[key] += 1
+                return False
+            self._failures.pop(key, None)
+            # The problem may have gone cold while its solution was generated
+            if key not in self.hot_keys():
+                return False
+            pool = self._pools.setdefault(key, deque())
+            if len(pool) >= self.pool_size:
+                return False
+            pool.append(solution)
+        return True
+
+    async def run(self) -> None:
+        """Refill hot pools until cancelled, sleeping while there is nothing to do."""
+        self._wake = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    if await self.refill_once():
+                        continue
+                except Exception as e:
+                    print(f"Warm pool refill error: {e}")
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pools": len(self._pools),
+                "solutions": sum(len(pool) for pool in self._pools.values()),
+                "hot": len(self.hot_keys()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refills": self.refills,
+                "failed_refills": self.failed_refills,
+            }
+
+    def _record(self, key: str, spec: PoolSpec) -> None:
+        self._recent.append(key)
+        self._counts[key] += 1
+        self._specs[key] = spec
+        if len(self._recent) > RECENT_REQUESTS:
+            old = self._recent.popleft()
+            self._counts[old] -= 1
+            if not self._counts[old]:
+                del self._counts[old]
+                del self._specs[old]
+                self._failures.pop(old, None)
+
+
+# Global pools; WARM_POOL_SIZE=0 disables them
+warm_pools = WarmPools(
+    pool_size=int(os.getenv("WARM_POOL_SIZE", DEFAULT_POOL_SIZE)),
+    max_pools=int(os.getenv("WARM_POOL_MAX_POOLS", DEFAULT_MAX_POOLS)),
+)
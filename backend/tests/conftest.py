@@ -0,0 +1,30 @@
+"""Shared test fixtures."""
+
+import pytest
+from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import admission, attempt_history, generate_cantus_firmus
+
+
+@pytest.fixture(autouse=True)
+def fresh_attempt_history(monkeypatch):
+    """Give each test an empty, in-memory attempt history."""
+    history = attempt_history.AttemptHistory()
+    monkeypatch.setattr(attempt_history, "history", history)
+    monkeypatch.setattr(admission.cost_model, "history", history)
+    return history
+
+
+@pytest.fixture
+def make_problem():
+    """Build problems over an 8-note alto CF in D dorian.
+
+    `species` is that of every counterpoint voice, `num_voices` counts the
+    CF, and `seed` picks another CF of the same shape.
+    """
+    def make(species=SpeciesType.FIRST, num_voices=2, seed=42):
+        key = Key(tonic=2, mode=Mode.DORIAN)
+        cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=seed)
+        return CounterpointProblem(
+            key=key, cantus_firmus=cf, num_voices=num_voices, species_per_voice=[species] * (num_voices - 1)
+        )
+    return make
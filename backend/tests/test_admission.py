@@ -0,0 +1,124 @@
+"""Tests for request cost estimates and admission control."""
+
+import asyncio
+import pytest
+from app.services.admission import AdmissionController, AdmissionRejected, CostModel
+from app.services.attempt_history import MIN_SAMPLES, AttemptHistory, Bucket
+from app.services.scheduler import BULK, INTERACTIVE
+
+
+def _bucket(species="first", num_voices=2, length=8):
+    return Bucket(species, num_voices, length, "ionian", "alto")
+
+
+def test_prior_grows_with_species_voices_and_length():
+    """Without history, cost follows the request's shape."""
+    model = CostModel(AttemptHistory())
+
+    assert model.estimate_ms(_bucket("first")) < model.estimate_ms(_bucket("third")) < model.estimate_ms(_bucket("fifth"))
+    assert model.estimate_ms(_bucket(length=16)) == 2 * model.estimate_ms(_bucket(length=8))
+    assert model.estimate_ms(_bucket(num_voices=2)) < model.estimate_ms(_bucket(num_voices=3)) < model.estimate_ms(_bucket(num_voices=4))
+
+
+def test_estimate_calibrated_from_recorded_timings():
+    """Once a bucket has enough runs, its mean recorded time is the estimate."""
+    history = AttemptHistory()
+    model = CostModel(history)
+    bucket = _bucket()
+    for _ in range(MIN_SAMPLES):
+        history.record(bucket, None, 120.0)
+
+    assert model.estimate_ms(bucket) == pytest.approx(120.0)
+    assert model.estimate_ms(_bucket(length=9)) == model.prior_ms(_bucket(length=9))
+
+
+@pytest.mark.asyncio
+async def test_cheap_requests_bypass_capacity():
+    """Cheap requests run even when the expensive capacity is taken."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10, max_queued=0)
+    async with controller.admit(100):
+        async with controller.admit(5):
+            pass
+
+    assert controller.stats()["admitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_expensive_requests_queue_in_order():
+    """Expensive requests beyond the capacity wait for running ones, first come first served."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10)
+    order = []
+
+    async def job(name, cost_ms):
+        async with controller.admit(cost_ms):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(job("a", 80), job("b", 80), job("c", 20))
+
+    assert order == ["a", "b", "c"]
+    assert controller.stats()["queued"] == 2
+    assert controller.stats()["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected_with_429():
+    """A request that finds the queue full is refused at once."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10, max_queued=0)
+    async with controller.admit(1500):
+        with pytest.raises(AdmissionRejected) as e:
+            async with controller.admit(50):
+                pass
+
+    assert e.value.status_code == 429
+    assert e.value.retry_after_s == 2
+    assert controller.stats()["rejected_full"] == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_is_rejected_with_503():
+    """A request that waits too long is refused, and leaves the queue."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10, queue_timeout_s=0.01)
+    async with controller.admit(100):
+        with pytest.raises(AdmissionRejected) as e:
+            async with controller.admit(50):
+                pass
+
+    assert e.value.status_code == 503
+    assert controller.stats()["queued_now"] == 0
+    assert controller.stats()["rejected_timeout"] == 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_work_leaves_capacity_for_interactive_requests():
+    """Bulk requests may only fill their share; interactive ones are admitted in the rest."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10, max_queued=0, bulk_capacity_share=0.5)
+    async with controller.admit(40, BULK):
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit(40, BULK):
+                pass
+        async with controller.admit(60, INTERACTIVE):
+            assert controller.stats()["bulk_running_ms"] == 40
+
+    assert controller.stats()["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queued_interactive_requests_go_first():
+    """When capacity frees up, queued interactive requests are admitted before bulk ones queued earlier."""
+    controller = AdmissionController(capacity_ms=100, cheap_ms=10, bulk_capacity_share=1.0)
+    order = []
+
+    async def job(name, cost_ms, lane):
+        async with controller.admit(cost_ms, lane):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    running = asyncio.create_task(job("running", 100, INTERACTIVE))
+    await asyncio.sleep(0)
+    bulk = asyncio.create_task(job("bulk", 100, BULK))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(job("interactive", 100, INTERACTIVE))
+    await asyncio.gather(running, bulk, interactive)
+
+    assert order == ["running", "interactive", "bulk"]
@@ -0,0 +1,186 @@
+"""Tests for anytime generation with deadlines."""
+
+import random
+import time
+from fastapi.testclient import TestClient
+from app.api.routes import _deadline
+from app.main import app
+from app.models import VoiceRange, SpeciesType
+from app.services import generate_first_species
+from app.services.anytime import BestSoFar, Deadline, best_effort_line, best_effort_solution, expired, species_rhythm
+from app.services.beam_search import beam_search
+from app.services.fifth_species_generator import generate_fifth_species
+from app.services.multi_voice_generator import generate_multi_voice_first_species
+from app.services.repair import repair_line
+from app.services.scheduler import Priority, generation_scheduler
+from app.services.second_species_generator import generate_second_species
+from app.services.third_species_generator import generate_third_species
+
+
+class _Countdown:
+    """A deadline that expires after a number of checks."""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def expired(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+def test_deadline_expiry():
+    """A deadline expires after its budget; no deadline never does."""
+    deadline = Deadline(20)
+    assert not deadline.expired()
+    assert 0 < deadline.remaining_ms() <= 20
+    time.sleep(0.03)
+    assert deadline.expired()
+    assert deadline.remaining_ms() == 0.0
+    assert not expired(None)
+    assert Deadline.from_ms(None) is None
+
+
+def test_tighter_deadline_wins():
+    """The request field and header combine to the tighter budget."""
+    assert _deadline(None, None) is None
+    assert _deadline(500, 100).budget_ms == 100
+    assert _deadline(None, 250).budget_ms == 250
+
+
+def test_deadline_counts_queue_time():
+    """The deadline starts when the request arrives, not when its job leaves the queue."""
+    client = TestClient(app)
+    blocker = generation_scheduler.submit(time.sleep, (0.3,), Priority())
+    response = client.post("/api/generate-second-species", json={
+        "tonic": 0,
+        "mode": "ionian",
+        "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+        "cf_voice_range": "alto",
+        "seed": 46,
+        "deadline_ms": 100
+    })
+    blocker.result()
+
+    assert response.status_code == 200
+    assert response.json()["complete"] is False
+
+
+def test_species_rhythm_fills_every_measure():
+    """Best-effort rhythms span exactly one whole note per CF note."""
+    for species in SpeciesType:
+        durations = species_rhythm(species, 8)
+        assert sum(d.to_beats() for d in durations) == 8 * 4
+
+
+def test_best_effort_lines(make_problem):
+    """Best-effort lines have the species rhythm and few violations."""
+    random.seed(0)
+    problem = make_problem(SpeciesType.FIRST)
+    for species in (SpeciesType.FIRST, SpeciesType.SECOND, SpeciesType.THIRD):
+        notes = best_effort_line(problem.cantus_firmus, problem.key, VoiceRange.SOPRANO, species)
+        assert [n.duration for n in notes] == species_rhythm(species, 8)
+        result = repair_line(problem.cantus_firmus, notes, problem.key, VoiceRange.SOPRANO, species, max_iterations=0)
+        assert len(result.violations) <= 3
+
+
+def test_best_so_far_ranking(make_problem):
+    """Any complete line beats every partial one; then fewer violations, then longer prefixes."""
+    problem = make_problem(SpeciesType.FIRST)
+    cf, key = problem.cantus_firmus, problem.key
+    better = generate_first_species(problem, seed=1).voice_lines[1].notes
+    worse = [better[0]] * len(better)
+    worse_violations = repair_line(cf, worse, key, VoiceRange.SOPRANO, SpeciesType.FIRST, max_iterations=0).violations
+    assert worse_violations
+
+    best = BestSoFar()
+    best.offer(worse[:3])
+    best.offer(worse[:5])
+    best.offer(worse[:4])
+    assert best.notes == worse[:5] and not best.complete
+    best.offer(worse, worse_violations)
+    best.offer(better[:7])
+    assert best.notes == worse and best.complete
+    best.offer(better, [])
+    best.offer(worse, worse_violations)
+    assert best.notes == better
+
+
+def test_best_effort_solution_keeps_what_the_search_reached(make_problem):
+    """A complete best line is returned as it is; a partial one is kept and completed."""
+    problem = make_problem(SpeciesType.SECOND)
+    cf, key = problem.cantus_firmus, problem.key
+    line = best_effort_line(cf, key, VoiceRange.SOPRANO, SpeciesType.SECOND)
+    violations = repair_line(cf, line, key, VoiceRange.SOPRANO, SpeciesType.SECOND, max_iterations=0).violations
+
+    best = BestSoFar()
+    best.offer(line, violations)
+    solution = best_effort_solution(cf, key, VoiceRange.SOPRANO, SpeciesType.SECOND, best)
+    assert solution.voice_lines[1].notes == line
+    assert solution.message == "Deadline expired; best line found so far"
+
+    # A third species prefix ending mid-measure is cut back to where the second species rhythm allows
+    prefix = best_effort_line(cf, key, VoiceRange.SOPRANO, SpeciesType.THIRD)[:7]
+    best = BestSoFar()
+    best.offer(prefix)
+    notes = best_effort_solution(cf, key, VoiceRange.SOPRANO, SpeciesType.SECOND, best).voice_lines[1].notes
+    assert sum(n.duration.to_beats() for n in notes) == 8 * 4
+    # The kept quarters (repair may re-pitch them) and halves after them
+    assert [n.duration for n in notes[:6]] == [n.duration for n in prefix[:6]]
+
+    solution = best_effort_solution(cf, key, VoiceRange.SOPRANO, SpeciesType.SECOND)
+    assert solution.message.startswith("Deadline expired before any line was found")
+
+
+def test_beam_search_reports_its_partial_line():
+    """A beam cut short by its deadline passes on its best partial line."""
+    cf_midis = [60, 62, 64, 65, 64, 62, 60]
+    reached = []
+    midis = beam_search(
+        cf_midis, [True] * 7, lambda midis, pos: [0xFFF << 60], 4, deadline=_Countdown(3), partial=reached.append
+    )
+    assert midis is None
+    assert [len(r) for r in reached] == [3]
+
+
+def test_interrupted_search_returns_the_line_it_reached(make_problem):
+    """A deadline expiring mid-search yields the search's line, not one built from scratch."""
+    solution = generate_first_species(
+        make_problem(SpeciesType.FIRST), seed=1, beam_width=4, max_attempts=0, deadline=_Countdown(4)
+    )
+    assert not solution.complete
+    assert "partial" in solution.message
+    assert len(solution.voice_lines[1].notes) == 8
+
+
+def test_expired_deadline_returns_best_effort(make_problem):
+    """Every generator returns an incomplete solution instead of searching past its deadline."""
+    generators = [
+        (SpeciesType.FIRST, generate_first_species, 8),
+        (SpeciesType.SECOND, generate_second_species, 16),
+        (SpeciesType.THIRD, generate_third_species, 32),
+        (SpeciesType.FIFTH, generate_fifth_species, None),
+    ]
+    for species, generate, num_notes in generators:
+        solution = generate(make_problem(species), seed=1, deadline=Deadline(0))
+        assert solution is not None and not solution.complete
+        if num_notes:
+            assert len(solution.voice_lines[1].notes) == num_notes
+
+    solution = generate_multi_voice_first_species(
+        make_problem(SpeciesType.FIRST, num_voices=3), num_voices=3, seed=1, deadline=Deadline(0)
+    )
+    assert not solution.complete
+    assert [len(v.notes) for v in solution.voice_lines] == [8, 8, 8]
+
+
+def test_deadline_stops_optimal_search(make_problem):
+    """An expired deadline cuts branch-and-bound short and marks the result incomplete."""
+    solution = generate_first_species(make_problem(SpeciesType.FIRST), seed=1, optimize=True, deadline=Deadline(0))
+    assert not solution.complete
+    assert solution.search_stats == {} or not solution.search_stats["optimal"]
+
+
+def test_no_deadline_is_complete(make_problem):
+    """Without a deadline solutions are complete, as before."""
+    solution = generate_first_species(make_problem(SpeciesType.FIRST), seed=1)
+    assert solution.complete
@@ -1,5 +1,6 @@
 """Unit tests for API endpoints."""
 
+import json
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
@@ -97,3 +98,395 @@ class TestAPI:
         assert "violations" in data
         assert "is_valid" in data
         assert isinstance(data["is_valid"], bool)
+    
+    def test_generate_counterpoint_with_beam_width(self):
+        """Test that the beam width is accepted and bounded."""
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "seed": 1,
+            "beam_width": 8
+        }
+        response = client.post("/api/generate-counterpoint", json=request)
+        
+        assert response.status_code == 200
+        assert response.json()["violations"] == []
+        
+        response = client.post("/api/generate-counterpoint", json={**request, "beam_width": 0})
+        assert response.status_code == 422
+    
+    def test_generate_counterpoint_optimized(self):
+        """Test that optimize mode returns search statistics."""
+        response = client.post("/api/generate-counterpoint", json={
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "optimize": True
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["violations"] == []
+        assert data["search_stats"]["optimal"] is True
+    
+    def test_repair_counterpoint(self):
+        """Test repairing a submitted counterpoint."""
+        response = client.post("/api/repair-counterpoint", json={
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [48, 50, 52, 53, 52, 50, 48],
+            "cp_notes": [60, 65, 64, 62, 67, 62, 60],
+            "seed": 1
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["is_valid"] is True
+        assert data["violations"] == []
+        assert data["changed_indices"]
+        assert len(data["cp_notes"]) == 7
+    
+    def test_repair_fifth_species_needs_durations(self):
+        """Test that fifth species repair requires the counterpoint rhythm."""
+        response = client.post("/api/repair-counterpoint", json={
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [48, 50, 48],
+            "cp_notes": [60, 62, 60],
+            "species": "fifth"
+        })
+        
+        assert response.status_code == 422
+    
+    def test_repair_needs_a_counterpoint_that_fits_the_cf(self):
+        """Test that repair refuses counterpoints that do not fit the CF in the species rhythm."""
+        request = {"tonic": 0, "mode": "ionian", "cf_notes": [48, 50, 52, 53, 52, 50, 48]}
+        
+        response = client.post("/api/repair-counterpoint", json={**request, "cp_notes": [60, 62]})
+        assert response.status_code == 422
+        
+        response = client.post("/api/repair-counterpoint", json={
+            **request, "species": "second", "cp_notes": [60, 62, 64, 65, 67, 65, 64]
+        })
+        assert response.status_code == 422
+        
+        response = client.post("/api/repair-counterpoint", json={
+            **request, "cp_notes": [60, 65, 64, 62, 67, 62, 60], "cp_durations": ["half"] * 7
+        })
+        assert response.status_code == 422
+        
+        response = client.post("/api/repair-counterpoint", json={
+            **request, "species": "fifth", "cp_notes": [60, 62, 64], "cp_durations": ["whole"] * 3
+        })
+        assert response.status_code == 422
+    
+    def test_generate_with_deadline(self):
+        """Test that a generous deadline returns a complete solution."""
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "seed": 1,
+            "deadline_ms": 30000
+        }
+        response = client.post("/api/generate-counterpoint", json=request)
+        
+        assert response.status_code == 200
+        assert response.json()["complete"] is True
+        
+        response = client.post("/api/generate-counterpoint", json={**request, "deadline_ms": 0})
+        assert response.status_code == 422
+    
+    def test_generate_with_deadline_header(self):
+        """Test that the X-Deadline-Ms header is read and validated."""
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "seed": 1
+        }
+        response = client.post("/api/generate-second-species", json=request, headers={"X-Deadline-Ms": "30000"})
+        assert response.status_code == 200
+        assert response.json()["complete"] is True
+        
+        response = client.post("/api/generate-second-species", json=request, headers={"X-Deadline-Ms": "soon"})
+        assert response.status_code == 422
+    
+    def test_generate_with_portfolio(self):
+        """Test that portfolio mode returns a valid solution."""
+        response = client.post("/api/generate-third-species", json={
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "seed": 1,
+            "portfolio": True
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["violations"] == []
+        assert len(data["cp_notes"]) == 32
+    
+    def test_generate_batch(self):
+        """Test that a batch returns distinct solutions for one CF."""
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "species": "second",
+            "count": 3,
+            "seed": 1
+        }
+        response = client.post("/api/generate-batch", json=request)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["count"] == 3
+        lines = [tuple(n["midi"] for n in s["cp_notes"]) for s in data["solutions"]]
+        assert len(set(lines)) == 3
+        
+        response = client.post("/api/generate-batch", json={**request, "species": "fourth"})
+        assert response.status_code == 422
+        response = client.post("/api/generate-batch", json={**request, "count": 0})
+        assert response.status_code == 422
+    
+    def test_generate_stream(self):
+        """Test that a stream sends one event per solution, then a done event."""
+        import json
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "count": 3,
+            "seed": 1
+        }
+        response = client.post("/api/generate-stream", json=request)
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert events[-1] == {"done": True, "count": 3}
+        assert [e["index"] for e in events[:-1]] == [0, 1, 2]
+        assert len({tuple(n["midi"] for n in e["cp_notes"]) for e in events[:-1]}) == 3
+        
+        response = client.post(
+            "/api/generate-stream", json={**request, "count": 1},
+            headers={"Accept": "text/event-stream"}
+        )
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text.startswith("event: solution\ndata: ")
+        assert response.text.endswith("event: done\ndata: {\"done\":true,\"count\":1}\n\n")
+        
+        response = client.post("/api/generate-stream", json={**request, "all_keys": True, "cf_notes": [50, 51]})
+        assert response.status_code == 422
+    
+    def test_seeded_responses_are_cached(self):
+        """Test that a repeated seeded request is served from the cache."""
+        request = {
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+            "cf_voice_range": "alto",
+            "seed": 20260
+        }
+        before = client.get("/api/metrics").json()["response_cache"]
+        first = client.post("/api/generate-counterpoint", json=request)
+        second = client.post("/api/generate-counterpoint", json=request)
+        after = client.get("/api/metrics").json()["response_cache"]
+        
+        assert first.json() == second.json()
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+        
+        # Unseeded requests bypass the cache
+        unseeded = {k: v for k, v in request.items() if k != "seed"}
+        client.post("/api/generate-counterpoint", json=unseeded)
+        final = client.get("/api/metrics").json()["response_cache"]
+        assert (final["hits"], final["misses"]) == (after["hits"], after["misses"])
+    
+    def test_transpositions_share_cache_entries(self):
+        """Test that a CF shape in another key is answered from the canonical entry."""
+        cf = [50, 53, 52, 50, 55, 53, 52, 50]
+        request = {"tonic": 2, "mode": "dorian", "cf_notes": cf, "cf_voice_range": "tenor", "seed": 20441}
+        before = client.get("/api/metrics").json()
+        in_d = client.post("/api/generate-counterpoint", json=request).json()
+        in_e = client.post(
+            "/api/generate-counterpoint", json={**request, "tonic": 4, "cf_notes": [m + 2 for m in cf]}
+        ).json()
+        after = client.get("/api/metrics").json()
+        
+        assert [n["midi"] for n in in_e["cf_notes"]] == [m + 2 for m in cf]
+        assert [n["midi"] + 2 for n in in_d["cp_notes"]] == [n["midi"] for n in in_e["cp_notes"]]
+        assert after["response_cache"]["hits"] - before["response_cache"]["hits"] == 1
+        assert after["transposition"]["transposed"] - before["transposition"]["transposed"] == 2
+    
+    def test_transposed_requests_are_logged_as_asked(self, monkeypatch):
+        """Test that a request solved in its canonical key is logged once, in its own key."""
+        from app.api import routes
+        entries = []
+        monkeypatch.setattr(routes.logger, "log_voices", lambda *entry: entries.append(entry))
+        cf = [52, 55, 54, 52, 57, 55, 54, 52]
+        request = {"tonic": 4, "mode": "dorian", "cf_notes": cf, "cf_voice_range": "tenor", "seed": 20442}
+        
+        response = client.post("/api/generate-counterpoint", json=request).json()
+        
+        assert len(entries) == 1
+        voices, violations, params, endpoint = entries[0]
+        assert (params["tonic"], params["cf_notes"], endpoint) == (4, cf, "generate-counterpoint")
+        assert [n["midi"] for n in voices[0]["notes"]] == cf
+        assert voices[1]["notes"] == response["cp_notes"]
+        assert violations == response["violations"]
+    
+    def test_compact_format(self):
+        """Test that the compact format is chosen by query or Accept header."""
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [50, 53, 52, 50, 55, 53, 52, 50],
+            "cf_voice_range": "tenor",
+            "seed": 20470
+        }
+        default = client.post("/api/generate-second-species", json=request).json()
+        by_query = client.post("/api/generate-second-species?format=compact", json=request)
+        by_header = client.post(
+            "/api/generate-second-species", json=request,
+            headers={"Accept": "application/vnd.counterpoint.compact+json"}
+        )
+        
+        assert by_query.headers["content-type"] == "application/vnd.counterpoint.compact+json"
+        assert by_query.json() == by_header.json()
+        compact = by_query.json()
+        assert compact["cp_notes"]["midi"] == [n["midi"] for n in default["cp_notes"]]
+        assert compact["cp_notes"]["dur"] == "H" * len(default["cp_notes"])
+        assert compact["cf_notes"] == {"midi": request["cf_notes"], "dur": "W" * 8}
+        assert compact["violations"] == default["violations"]
+    
+    def test_solution_retrieval(self):
+        """Test that generated solutions can be fetched by ID with ETags."""
+        request = {
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+            "cf_voice_range": "alto",
+            "seed": 20480
+        }
+        generated = client.post("/api/generate-counterpoint", json=request).json()
+        solution_id = generated["solution_id"]
+        
+        response = client.get(f"/api/solutions/{solution_id}")
+        assert response.status_code == 200
+        assert response.headers["etag"] == f'"{solution_id}"'
+        assert "immutable" in response.headers["cache-control"]
+        assert response.json()["cp_notes"] == generated["cp_notes"]
+        
+        response = client.get(f"/api/solutions/{solution_id}", headers={"If-None-Match": f'"{solution_id}"'})
+        assert response.status_code == 304
+        
+        compact = client.get(f"/api/solutions/{solution_id}?format=compact")
+        assert compact.headers["etag"] == f'"{solution_id}-compact"'
+        assert compact.json()["cp_notes"]["midi"] == [n["midi"] for n in generated["cp_notes"]]
+        
+        batch = client.post("/api/generate-batch", json={**request, "count": 2}).json()
+        for solution in batch["solutions"]:
+            fetched = client.get(f"/api/solutions/{solution['solution_id']}").json()
+            assert fetched["cp_notes"] == solution["cp_notes"]
+            assert fetched["cf_notes"] == batch["cf_notes"]
+        
+        assert client.get("/api/solutions/unknown").status_code == 404
+    
+    def test_admission_control(self, monkeypatch):
+        """Test that expensive requests are refused when busy while cheap ones still run."""
+        from app.api import routes
+        from app.services.admission import AdmissionController
+        controller = AdmissionController(capacity_ms=100, cheap_ms=10, max_queued=0)
+        controller._start(5000)  # Expensive work already running
+        monkeypatch.setattr(routes, "admission", controller)
+        request = {
+            "tonic": 2,
+            "mode": "dorian",
+            "cf_notes": [62, 65, 64, 62, 67, 65, 64, 62],
+            "cf_voice_range": "alto",
+            "seed": 20490
+        }
+        
+        response = client.post("/api/generate-multi-voice", json={**request, "num_voices": 4})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "5"
+        
+        response = client.post("/api/generate-stream", json={**request, "species": "fifth"})
+        assert response.status_code == 429
+        
+        response = client.post("/api/generate-batch", json={**request, "species": "fifth"})
+        assert response.status_code == 429
+        
+        response = client.post("/api/generate-counterpoint", json=request)
+        assert response.status_code == 200
+        assert controller.stats()["rejected_full"] == 3
+    
+    def test_streams_are_admitted_one_solution_at_a_time(self, monkeypatch):
+        """Test that a stream holds no admission while its solutions are sent."""
+        from app.api import routes
+        from app.services.admission import AdmissionController
+        controller = AdmissionController(capacity_ms=100, cheap_ms=0)
+        monkeypatch.setattr(routes, "admission", controller)
+        request = {
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+            "cf_voice_range": "alto",
+            "seed": 20491,
+            "all_keys": True
+        }
+        
+        running = []
+        format_event = routes.format_event
+        
+        def record(*args):
+            running.append(controller.stats()["running"])
+            return format_event(*args)
+        
+        monkeypatch.setattr(routes, "format_event", record)
+        response = client.post("/api/generate-stream", json=request)
+        assert response.status_code == 200
+        
+        assert running == [0] * 85
+        # One admission per key, and one for the search that finds the stream is over
+        assert controller.stats()["admitted"] == 85
+        assert controller.stats()["running_ms"] == 0
+    
+    def test_stream_ends_with_an_error_when_refused_midway(self, monkeypatch):
+        """Test that a solution refused admission after the stream started ends it with an error event."""
+        from app.api import routes
+        from app.services.admission import AdmissionController
+        controller = AdmissionController(capacity_ms=100, cheap_ms=0, max_queued=0)
+        monkeypatch.setattr(routes, "admission", controller)
+        format_event = routes.format_event
+        
+        def occupy(*args):
+            # Expensive work arrives while the first solution is sent
+            controller._start(5000)
+            return format_event(*args)
+        
+        monkeypatch.setattr(routes, "format_event", occupy)
+        response = client.post("/api/generate-stream", json={
+            "tonic": 0,
+            "mode": "ionian",
+            "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+            "cf_voice_range": "alto",
+            "seed": 20492,
+            "count": 3
+        })
+        assert response.status_code == 200
+        
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert len(events) == 2
+        assert "cp_notes" in events[0]
+        assert events[1]["status_code"] == 429
@@ -0,0 +1,132 @@
+"""Tests for attempt budgets learned from history."""
+
+import asyncio
+import pytest
+from app.models import SpeciesType, CounterpointSolution
+from app.services import generate_first_species
+from app.services import attempt_history
+from app.services.attempt_history import (
+    BUDGET_MARGIN, MIN_BUDGET, MIN_SAMPLES, AttemptHistory, Bucket, generate_adaptive
+)
+from app.services.beam_search import DEFAULT_BEAM_WIDTH
+
+
+def _solved(problem, strategy="greedy", attempts=1, complete=True):
+    return CounterpointSolution(
+        voice_lines=[problem.cantus_firmus],
+        complete=complete,
+        search_stats={"strategy": strategy, "attempts": attempts}
+    )
+
+
+def test_bucket_of_a_problem(make_problem):
+    """Problems are bucketed by species, voices, length, mode and range."""
+    bucket = Bucket.for_problem(make_problem(SpeciesType.THIRD))
+    assert bucket == Bucket("third", 2, 8, "dorian", "alto")
+    assert bucket.key() == "third|2|8|dorian|alto"
+
+
+def test_no_plan_without_enough_history(make_problem):
+    """Buckets with little history keep the generator defaults."""
+    history = AttemptHistory()
+    bucket = Bucket.for_problem(make_problem())
+    for _ in range(MIN_SAMPLES - 1):
+        history.record(bucket, _solved(make_problem(), attempts=3), 1.0)
+
+    plan = history.plan(bucket)
+    assert plan.max_attempts is None and plan.beam_width is None
+
+
+def test_budget_follows_observed_attempts(make_problem):
+    """Once greedy reliably succeeds, the budget shrinks to a margin over what it needed."""
+    history = AttemptHistory()
+    problem = make_problem()
+    bucket = Bucket.for_problem(problem)
+    for attempts in [2] * (MIN_SAMPLES // 2) + [20] * (MIN_SAMPLES // 2):
+        history.record(bucket, _solved(problem, attempts=attempts), 1.0)
+
+    assert history.plan(bucket).max_attempts == BUDGET_MARGIN * 20
+    assert history.plan(bucket).beam_width is None
+
+    # A single outlier above the 95th percentile does not raise the budget
+    history.record(bucket, _solved(problem, attempts=100), 1.0)
+    assert history.plan(bucket).max_attempts == BUDGET_MARGIN * 20
+
+    # Deadline cut-offs say nothing; an exhausted greedy restores the default budget
+    history.record(bucket, _solved(problem, complete=False), 1.0)
+    assert history.plan(bucket).max_attempts == BUDGET_MARGIN * 20
+    history.record(bucket, None, 1.0)
+    assert history.plan(bucket).max_attempts is None
+
+
+def test_low_greedy_success_rate_switches_to_beam(make_problem):
+    """Buckets where greedy needs many restarts per success try the beam search first."""
+    history = AttemptHistory()
+    problem = make_problem()
+    bucket = Bucket.for_problem(problem)
+    for _ in range(MIN_SAMPLES):
+        history.record(bucket, _solved(problem, attempts=40), 1.0)
+
+    plan = history.plan(bucket)
+    assert plan.beam_width == DEFAULT_BEAM_WIDTH
+    assert plan.max_attempts >= MIN_BUDGET
+
+
+def test_history_persists(tmp_path, make_problem):
+    """The totals survive a reload from disk, and a corrupt file starts over."""
+    path = tmp_path / "history.json"
+    problem = make_problem()
+    bucket = Bucket.for_problem(problem)
+    history = AttemptHistory(str(path))
+    solution = generate_first_species(problem, seed=1)
+    history.record(bucket, solution, 12.5)
+    assert not path.exists()
+    history.save()
+
+    reloaded = AttemptHistory(str(path))
+    entry = reloaded.entry(bucket)
+    assert entry["runs"] == 1 and entry["total_ms"] == 12.5
+    assert entry["strategies"] == {solution.search_stats["strategy"]: 1}
+
+    assert list(tmp_path.iterdir()) == [path]
+    path.write_text("{not json")
+    assert AttemptHistory(str(path)).entry(bucket)["runs"] == 0
+
+
+@pytest.mark.asyncio
+async def test_history_is_saved_on_a_timer(tmp_path, monkeypatch, make_problem):
+    """The background saver writes a changed history without being asked."""
+    monkeypatch.setattr(attempt_history, "SAVE_INTERVAL_S", 0.01)
+    path = tmp_path / "history.json"
+    history = AttemptHistory(str(path))
+    history.record(Bucket.for_problem(make_problem()), None, 1.0)
+    saver = asyncio.create_task(history.run())
+    try:
+        for _ in range(100):
+            if path.exists():
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        saver.cancel()
+
+    assert AttemptHistory(str(path)).entry(Bucket.for_problem(make_problem()))["failures"] == 1
+
+
+def test_seeded_requests_keep_generator_defaults(fresh_attempt_history, make_problem):
+    """Learned budgets only apply to unseeded requests, and both are recorded."""
+    problem = make_problem()
+    bucket = Bucket.for_problem(problem)
+    for _ in range(MIN_SAMPLES):
+        fresh_attempt_history.record(bucket, _solved(problem, attempts=20), 1.0)
+    calls = []
+
+    def generate(problem, **kwargs):
+        calls.append(kwargs)
+        return _solved(problem)
+
+    generate_adaptive(generate, problem, seed=1)
+    generate_adaptive(generate, problem, seed=None)
+
+    assert "max_attempts" not in calls[0]
+    assert calls[1]["max_attempts"] == BUDGET_MARGIN * 20
+    assert fresh_attempt_history.entry(bucket)["runs"] == MIN_SAMPLES + 2
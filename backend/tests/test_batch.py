@@ -0,0 +1,60 @@
+"""Tests for batch generation of distinct solutions."""
+
+from app.models import SpeciesType
+from app.services.anytime import Deadline
+from app.services.batch import generate_batch, solution_key
+from app.services.monte_carlo import RANK_TEMPERATURE
+from app.services.portfolio import GENERATORS, PortfolioPool
+from app.services.repair import SPECIES_EVALUATORS
+
+
+def test_distinct_valid_solutions(make_problem):
+    """A batch returns the requested number of distinct, valid solutions."""
+    for species in (SpeciesType.FIRST, SpeciesType.SECOND, SpeciesType.THIRD):
+        problem = make_problem(species)
+        solutions = generate_batch(species.value, problem, 5, seed=1, workers=1)
+
+        assert len(solutions) == 5
+        assert len({solution_key(s) for s in solutions}) == 5
+        for solution in solutions:
+            assert SPECIES_EVALUATORS[species](problem.cantus_firmus, solution.voice_lines[1]) == []
+
+
+def test_batch_is_reproducible(make_problem):
+    """The same seed gives the same batch."""
+    problem = make_problem(SpeciesType.FIRST)
+    first = generate_batch("first", problem, 3, seed=7, workers=1)
+    second = generate_batch("first", problem, 3, seed=7, workers=1)
+    assert [solution_key(s) for s in first] == [solution_key(s) for s in second]
+
+
+def test_expired_deadline_returns_best_effort(make_problem):
+    """With no time left a batch still returns one incomplete solution."""
+    solutions = generate_batch("second", make_problem(SpeciesType.SECOND), 4, seed=1, deadline=Deadline(0), workers=1)
+    assert len(solutions) == 1
+    assert not solutions[0].complete
+
+
+def test_batch_over_the_pool(make_problem):
+    """Runs spread over pool workers still deduplicate."""
+    pool = PortfolioPool(2)
+    try:
+        solutions = generate_batch("first", make_problem(SpeciesType.FIRST), 4, seed=3, workers=2, pool=pool)
+    finally:
+        pool.shutdown()
+    assert len(solutions) == 4
+    assert len({solution_key(s) for s in solutions}) == 4
+
+
+def test_batches_ask_sampling_generators_for_variety(monkeypatch, make_problem):
+    """Batch runs ask the generator to draw sampled lines at a temperature."""
+    calls = []
+    generate = GENERATORS["first"]
+
+    def recording(problem, **kwargs):
+        calls.append(kwargs.get("rank_temperature"))
+        return generate(problem, **kwargs)
+
+    monkeypatch.setitem(GENERATORS, "first", recording)
+    generate_batch("first", make_problem(SpeciesType.FIRST), 2, seed=1, workers=1)
+    assert calls and all(t == RANK_TEMPERATURE for t in calls)
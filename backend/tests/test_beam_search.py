@@ -0,0 +1,100 @@
+"""Tests for the score-guided beam search."""
+
+import random
+import pytest
+from app.models import Key, Mode, Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import generate_cantus_firmus, generate_first_species, evaluate_first_species
+from app.services.beam_search import LineScore, beam_search, score_line
+from app.services.bitsets import mask_of
+from app.services.melodic_rules import check_leap_compensation, check_melodic_climax
+from app.services.second_species_generator import generate_second_species
+from app.services.second_species_rules import evaluate_second_species
+from app.services.third_species_generator import generate_third_species
+from app.services.third_species_rules import evaluate_third_species
+from app.services.fifth_species_generator import generate_fifth_species
+from app.services.fifth_species_rules import evaluate_fifth_species
+
+
+def _line(midis):
+    return VoiceLine(
+        notes=[Note(pitch=Pitch.from_midi(m), duration=Duration.WHOLE) for m in midis],
+        voice_index=1,
+        voice_range=VoiceRange.SOPRANO
+    )
+
+
+def _score(midis):
+    score = LineScore()
+    for midi in midis:
+        score = score.extend(midi, 48, strong=False)
+    return score
+
+
+def test_incremental_penalties_follow_the_rule_checks():
+    """Leap compensation and climax penalties agree with the melodic rule checks."""
+    for midis in [
+        [60, 62, 64, 65, 67, 65, 64, 62, 60],
+        [60, 67, 65, 64, 62, 60],
+        [60, 67, 69, 67, 65, 64],
+        [60, 64, 62, 64, 60, 62, 64, 62],
+        [60, 62, 64, 64, 62, 60],
+    ]:
+        score = _score(midis)
+        assert score.climax_repeated == bool(check_melodic_climax(_line(midis)))
+        uncompensated = len(check_leap_compensation(_line(midis)))
+        leaps = sum(abs(b - a) > 2 for a, b in zip(midis, midis[1:]))
+        assert score.fixed == leaps + 4.0 * uncompensated
+
+
+def test_stepwise_and_perfect_shares_are_penalised():
+    """Leapy lines and strong-beat perfect consonances score worse."""
+    assert _score([60, 62, 64, 65, 64]).total() < _score([60, 64, 67, 72, 67]).total()
+
+    octaves, thirds = [48, 50, 52, 50, 48], [48, 59, 60, 59, 48]
+    strong = [True] * 5
+    assert score_line([60, 62, 64, 62, 60], thirds, strong) < score_line([60, 62, 64, 62, 60], octaves, strong)
+
+
+def test_beam_search_finds_the_lowest_penalty_line():
+    """A wide beam finds a stepwise line through a small candidate space."""
+    random.seed(0)
+    pitches = mask_of([60, 62, 64, 67, 72])
+
+    def expand(midis, pos):
+        return [mask_of([60])] if pos in (0, 4) else [pitches]
+
+    best = beam_search([48] * 5, [False] * 5, expand, beam_width=16)
+
+    assert all(abs(b - a) <= 2 for a, b in zip(best, best[1:]))
+    assert _score(best).total() == 0
+    assert beam_search([48] * 3, [False] * 3, lambda midis, pos: [0], beam_width=4) is None
+
+
+def test_later_tiers_cost_extra():
+    """A pitch from a fallback tier loses to an equal pitch from the preferred tier."""
+    random.seed(0)
+
+    def expand(midis, pos):
+        if pos == 0:
+            return [mask_of([60])]
+        return [mask_of([58]), mask_of([62])]
+
+    assert beam_search([48, 48], [False, False], expand, beam_width=4) == (60, 58)
+
+
+@pytest.mark.parametrize("species,generate,evaluate", [
+    (SpeciesType.FIRST, generate_first_species, evaluate_first_species),
+    (SpeciesType.SECOND, generate_second_species, evaluate_second_species),
+    (SpeciesType.THIRD, generate_third_species, evaluate_third_species),
+    (SpeciesType.FIFTH, generate_fifth_species, evaluate_fifth_species),
+])
+def test_generators_accept_a_beam_width(species, generate, evaluate):
+    """Beam lines pass species evaluation at any width."""
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=5)
+    problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[species])
+
+    for beam_width in (1, 16):
+        solution = generate(problem, seed=1, beam_width=beam_width)
+        assert solution is not None
+        assert evaluate(cf, solution.voice_lines[1]) == []
@@ -0,0 +1,56 @@
+"""Tests for MIDI pitch bitsets used in candidate filtering."""
+
+import random
+from app.services.bitsets import (
+    ALL_PITCHES, interval_mask, mask_of, parallel_mask, pick, pitches_of, random_pitch, range_mask
+)
+from app.services.nogoods import NogoodStore
+from app.services.second_species_dp import is_parallel_perfect
+
+
+def test_mask_round_trip():
+    """Pitches survive a round trip; out-of-range pitches are dropped."""
+    assert pitches_of(mask_of([67, 60, 64, 60])) == [60, 64, 67]
+    assert mask_of([-1, 128]) == 0
+    assert pitches_of(range_mask(60, 64)) == [60, 61, 62, 63, 64]
+    assert range_mask(70, 60) == 0
+    assert range_mask(-5, 200) == ALL_PITCHES
+
+
+def test_interval_mask_shifts_both_ways():
+    """Intervals are applied relative to the previous pitch and clipped to MIDI."""
+    assert pitches_of(interval_mask(60, (-2, -1, 1, 2))) == [58, 59, 61, 62]
+    assert pitches_of(interval_mask(10, (-12, 2))) == [12]
+    assert pitches_of(interval_mask(126, (-1, 1, 2))) == [125, 127]
+
+
+def test_parallel_mask_matches_rule_check():
+    """Masked pitches are exactly those the parallel-perfect check rejects."""
+    for prev_cf, cf, prev_cp in [(60, 62, 67), (60, 62, 72), (60, 58, 53), (60, 60, 67), (60, 62, 64)]:
+        blocked = parallel_mask(prev_cf, cf, prev_cp)
+        for cp in range(40, 90):
+            expected = is_parallel_perfect(prev_cf, cf, prev_cp, cp)
+            assert bool(blocked >> cp & 1) == expected, (prev_cf, cf, prev_cp, cp)
+
+
+def test_pick_prefers_earlier_tiers():
+    """The first tier with an allowed pitch wins; empty results return None."""
+    random.seed(0)
+    preferred, fallback = mask_of([60, 62]), mask_of([64, 65])
+
+    assert all(pick([preferred, fallback]) in (60, 62) for _ in range(20))
+    assert pick([preferred, fallback], allowed=mask_of([65])) == 65
+    assert pick([preferred], allowed=mask_of([64])) is None
+    assert random_pitch(0) is None
+    assert {random_pitch(preferred) for _ in range(50)} == {60, 62}
+
+
+def test_prune_mask_records_exhausted_state():
+    """Mask pruning drops pitches leading into nogoods, like the list version."""
+    store = NogoodStore()
+    store.add((2, 62))
+    store.add((2, 64))
+
+    assert pitches_of(store.prune_mask(mask_of([62, 64, 65]), (1, 60), lambda c: (2, c))) == [65]
+    assert store.prune_mask(mask_of([62, 64]), (1, 60), lambda c: (2, c)) == 0
+    assert (1, 60) in store
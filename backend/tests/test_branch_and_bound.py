@@ -0,0 +1,95 @@
+"""Tests for branch-and-bound minimum-penalty search."""
+
+import math
+from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import generate_cantus_firmus, generate_first_species, evaluate_first_species
+from app.services.beam_search import LineScore
+from app.services.bitsets import masks_of, pitches_of
+from app.services.branch_and_bound import branch_and_bound
+from app.services.cadences import cadence_masks
+from app.services.first_species_generator import _get_candidates, _get_end_candidates
+from app.services.generation_plan import plan_for
+
+
+def _first_species_search(tonic=0, mode=Mode.IONIAN, length=6, seed=42):
+    key = Key(tonic=tonic, mode=mode)
+    cf = generate_cantus_firmus(key, length=length, voice_range=VoiceRange.ALTO, seed=seed)
+    plan = plan_for(cf, key, VoiceRange.SOPRANO)
+    reachable = masks_of(cadence_masks(list(plan.cf_midis), key, VoiceRange.SOPRANO, SpeciesType.FIRST)[-1])
+    last_idx = len(plan.cf_midis) - 1
+
+    def expand(prev, idx):
+        if idx == 0:
+            tiers = [plan.start_mask]
+        elif idx == last_idx:
+            tiers = _get_end_candidates(plan, prev)
+        else:
+            tiers = _get_candidates(plan, idx, prev)
+        return [tier & reachable[idx] for tier in tiers]
+
+    return plan.cf_midis, expand
+
+
+def _exhaustive_minimum(cf_midis, expand):
+    """Score every legal line the slow way."""
+    best = math.inf
+    last_idx = len(cf_midis) - 1
+
+    def visit(idx, prev, score):
+        nonlocal best
+        if idx == len(cf_midis):
+            best = min(best, score.total())
+            return
+        seen = 0
+        for tier_idx, tier in enumerate(expand(prev, idx)):
+            for midi in pitches_of(tier & ~seen):
+                visit(idx + 1, midi, score.extend(midi, cf_midis[idx], True, 0 < idx < last_idx, tier_idx))
+            seen |= tier
+
+    visit(0, None, LineScore())
+    return best
+
+
+def test_matches_exhaustive_search():
+    """The returned penalty is the true minimum over every legal line."""
+    for tonic, mode, seed in [(0, Mode.IONIAN, 42), (2, Mode.DORIAN, 7), (9, Mode.AEOLIAN, 3)]:
+        cf_midis, expand = _first_species_search(tonic, mode, seed=seed)
+        line, stats = branch_and_bound(cf_midis, [True] * len(cf_midis), expand)
+
+        assert line is not None
+        assert stats["optimal"]
+        assert stats["penalty"] == round(_exhaustive_minimum(cf_midis, expand), 6)
+
+
+def test_node_budget_caps_the_search():
+    """An exhausted budget is reported as not proven optimal."""
+    cf_midis, expand = _first_species_search(length=8)
+    line, stats = branch_and_bound(cf_midis, [True] * len(cf_midis), expand, max_nodes=3)
+
+    assert not stats["optimal"]
+    assert stats["nodes"] == 3
+    assert line is None
+
+
+def test_no_legal_line():
+    """With no candidates the search proves there is nothing to return."""
+    line, stats = branch_and_bound([60, 62], [True, True], lambda prev, pos: [0])
+
+    assert line is None
+    assert stats["optimal"] and stats["penalty"] is None
+
+
+def test_optimize_mode_is_deterministic():
+    """Optimal lines pass evaluation, carry stats and do not depend on the seed."""
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf = generate_cantus_firmus(key, length=10, voice_range=VoiceRange.ALTO, seed=11)
+    problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[SpeciesType.FIRST])
+
+    first = generate_first_species(problem, seed=1, optimize=True)
+    second = generate_first_species(problem, seed=2, optimize=True)
+
+    assert first is not None and second is not None
+    assert evaluate_first_species(cf, first.voice_lines[1]) == []
+    assert first.search_stats["optimal"]
+    assert first.search_stats["nodes"] > 0
+    assert [n.pitch.midi for n in first.voice_lines[1].notes] == [n.pitch.midi for n in second.voice_lines[1].notes]
@@ -0,0 +1,86 @@
+"""Tests for modal cadence formulas and cadence-first generation."""
+
+import pytest
+from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import generate_cantus_firmus
+from app.services.cadences import (
+    CADENCE_LENGTH,
+    cadence_formulas,
+    cadence_masks,
+    cadence_options,
+)
+from app.services.first_species_generator import generate_first_species
+from app.services.second_species_generator import generate_second_species
+from app.services.third_species_generator import generate_third_species
+from app.services.fifth_species_generator import generate_fifth_species
+from app.services.intervals import is_imperfect_consonance, is_perfect_consonance
+
+GENERATORS = {
+    SpeciesType.FIRST: generate_first_species,
+    SpeciesType.SECOND: generate_second_species,
+    SpeciesType.THIRD: generate_third_species,
+    SpeciesType.FIFTH: generate_fifth_species,
+}
+
+
+@pytest.mark.parametrize("mode", list(Mode))
+@pytest.mark.parametrize("species", list(CADENCE_LENGTH))
+def test_every_mode_has_formulas(mode, species):
+    """Each mode, species and placement has formulas ending on the final."""
+    for above in (True, False):
+        formulas = cadence_formulas(mode, species, above)
+        assert formulas
+        for formula in formulas:
+            assert len(formula.semitones) == CADENCE_LENGTH[species]
+            assert formula.semitones[-1] == 0
+            assert formula.degrees[-2] != 0
+
+
+def test_placement_prefers_clausula():
+    """Upper voices prefer approaching the final from below, lower voices from above."""
+    assert cadence_formulas(Mode.IONIAN, SpeciesType.FIRST, True)[0].semitones[-2] == -1
+    assert cadence_formulas(Mode.IONIAN, SpeciesType.FIRST, False)[0].semitones[-2] > 0
+
+
+def test_first_species_options_fit_cf():
+    """Realized first species cadences end on a perfect tonic after a 3rd or 6th."""
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=5)
+    midis = [n.pitch.midi for n in cf.notes]
+
+    options = cadence_options(midis, key, VoiceRange.SOPRANO, SpeciesType.FIRST)
+    assert options
+    for penultimate, final in options:
+        assert final % 12 == key.tonic
+        assert is_perfect_consonance(abs(final - midis[-1]))
+        assert is_imperfect_consonance(abs(penultimate - midis[-2]))
+
+
+def test_cadence_masks_pin_last_positions():
+    """Pinned masks hold the cadence pitches; the unpinned mask comes last."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=3)
+    midis = [n.pitch.midi for n in cf.notes]
+
+    masks = cadence_masks(midis, key, VoiceRange.SOPRANO, SpeciesType.SECOND)
+    assert len(masks) >= 2
+    assert all(len(mask[-1]) == 1 and len(mask[-3]) == 1 for mask in masks[:-1])
+    assert len(masks[-1][-3]) > 1
+
+
+@pytest.mark.parametrize("species", list(GENERATORS))
+def test_generated_lines_end_on_pinned_cadence(species):
+    """Generators fill toward one of the realized cadence formulas."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=11)
+    midis = [n.pitch.midi for n in cf.notes]
+    problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[species])
+
+    solution = GENERATORS[species](problem, seed=1)
+    assert solution is not None
+
+    cp_line = solution.voice_lines[1]
+    cp = [n.pitch.midi for n in cp_line.notes]
+    options = cadence_options(midis, key, cp_line.voice_range, species)
+    length = CADENCE_LENGTH[species]
+    assert tuple(cp[-length:]) in options
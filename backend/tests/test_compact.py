@@ -0,0 +1,51 @@
+"""Tests for the compact response format."""
+
+import json
+from app.api.compact import COMPACT_MEDIA_TYPE, compact_payload, encode_response
+from app.api.routes import GenerateBatchResponse
+
+
+def _notes(midis, duration="whole", **extra):
+    return [{"midi": m, "duration": duration, **{k: v[i] for k, v in extra.items()}} for i, m in enumerate(midis)]
+
+
+def test_note_lists_become_parallel_arrays():
+    """Every note list, at any depth, is turned into midi and dur arrays."""
+    payload = {
+        "cf_notes": _notes([62, 65]),
+        "solutions": [{"cp_notes": _notes([69, 74], "half"), "violations": [], "complete": True}],
+        "count": 1,
+    }
+
+    compact = compact_payload(payload)
+    assert compact["cf_notes"] == {"midi": [62, 65], "dur": "WW"}
+    assert compact["solutions"][0]["cp_notes"] == {"midi": [69, 74], "dur": "HH"}
+    assert compact["solutions"][0]["violations"] == []
+    assert compact["count"] == 1
+
+
+def test_other_note_fields_are_kept():
+    """Extra per-note fields become arrays under their own names."""
+    notes = _notes([60, 62], "quarter", is_extended=[False, True])
+
+    assert compact_payload({"notes": notes})["notes"] == {
+        "midi": [60, 62], "dur": "QQ", "is_extended": [False, True]
+    }
+
+
+def test_encode_response():
+    """Both formats encode the same content."""
+    response = GenerateBatchResponse(
+        cf_notes=_notes([62, 65]),
+        solutions=[{"cp_notes": _notes([69, 74]), "violations": []}],
+        count=1,
+    )
+
+    default = encode_response(response, compact=False)
+    assert default.media_type == "application/json"
+    assert json.loads(default.body) == response.model_dump(mode="json")
+
+    compact = encode_response(response, compact=True)
+    assert compact.media_type == COMPACT_MEDIA_TYPE
+    assert json.loads(compact.body)["solutions"][0]["cp_notes"] == {"midi": [69, 74], "dur": "WW"}
+    assert len(compact.body) < len(default.body)
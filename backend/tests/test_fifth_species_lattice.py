@@ -0,0 +1,48 @@
+"""Tests for the fifth species rhythm lattice."""
+
+import random
+from app.models import Key, Mode, Duration, VoiceLine, VoiceRange
+from app.services import generate_cantus_firmus
+from app.services.fifth_species_lattice import (
+    RHYTHM_LATTICE,
+    SUCCESSORS,
+    pitch_cells,
+    generate_fifth_species_lattice,
+)
+from app.services.fifth_species_rules import evaluate_fifth_species
+
+
+def test_templates_fill_one_measure():
+    """Every rhythmic template lasts exactly one whole note."""
+    for template in RHYTHM_LATTICE:
+        assert sum(d.to_beats() for d in template.durations) == 4.0
+
+
+def test_ties_must_be_continued():
+    """Only tied-in templates may follow a tie."""
+    assert all(t.tied_in for t in SUCCESSORS[True])
+    assert not any(t.tied_in for t in SUCCESSORS[False])
+
+
+def test_pitch_cells_match_template_length():
+    """Pitch cells have one pitch per note of the template."""
+    for template in RHYTHM_LATTICE:
+        cells = pitch_cells(template.name, 60, 0, Mode.IONIAN, VoiceRange.SOPRANO)
+        assert cells
+        assert all(len(cell) == len(template.durations) for cell in cells)
+
+
+def test_lattice_lines_pass_evaluation():
+    """Lattice lines are florid and pass fifth species evaluation."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=42)
+
+    for seed in range(3):
+        random.seed(seed)
+        notes = generate_fifth_species_lattice(cf, key, VoiceRange.SOPRANO, beam_width=4)
+        assert notes is not None
+        assert sum(n.duration.to_beats() for n in notes) == 4.0 * len(cf.notes)
+        assert notes[-1].duration == Duration.WHOLE
+
+        cp = VoiceLine(notes=notes, voice_index=1, voice_range=VoiceRange.SOPRANO)
+        assert evaluate_fifth_species(cf, cp) == []
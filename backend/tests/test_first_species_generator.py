@@ -44,6 +44,24 @@ class TestFirstSpeciesGenerator:
         violations = evaluate_first_species(cf, solution.voice_lines[1])
         assert len(violations) == 0
     
+    def test_final_prefers_stepwise_approach(self):
+        """Test that steps into the final are tried before leaps."""
+        from app.services.bitsets import pitches_of
+        from app.services.first_species_generator import _get_end_candidates
+        from app.services.generation_plan import plan_for
+        key = Key(tonic=0, mode=Mode.IONIAN)
+        cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=42)
+        plan = plan_for(cf, key, VoiceRange.SOPRANO)
+        final = min(pitches_of(plan.finals_mask))
+        
+        step, leap = _get_end_candidates(plan, final + 2)
+        assert final in pitches_of(step)
+        assert final not in pitches_of(leap)
+        
+        step, leap = _get_end_candidates(plan, final + 4)
+        assert final not in pitches_of(step)
+        assert final in pitches_of(leap)
+    
     def test_generate_different_keys(self):
         """Test generation in different keys."""
         for tonic in [0, 2, 5, 7]:
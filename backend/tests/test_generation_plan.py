@@ -0,0 +1,51 @@
+"""Tests for the per-problem generation plan."""
+
+from app.models import Key, Mode, VoiceRange
+from app.services import generate_cantus_firmus
+from app.services.bitsets import pitches_of
+from app.services.generation_plan import build_generation_plan, plan_for
+from app.services.intervals import is_consonant, is_perfect_consonance
+
+
+def _plan(seed=42):
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=seed)
+    return key, cf, plan_for(cf, key, VoiceRange.SOPRANO)
+
+
+def test_masks_follow_the_cf():
+    """Consonant masks are per CF note and stay in range and key."""
+    key, cf, plan = _plan()
+    min_midi, max_midi = VoiceRange.SOPRANO.get_range()
+
+    assert pitches_of(plan.scale_mask) == list(plan.scale_pitches)
+    assert len(plan.consonant_masks) == len(cf.notes)
+    for cf_note, consonant in zip(cf.notes, plan.consonant_masks):
+        assert consonant & ~plan.scale_mask == 0
+        for midi in pitches_of(consonant):
+            assert min_midi <= midi <= max_midi
+            assert midi % 12 in key.get_scale_degrees()
+            assert is_consonant(abs(midi - cf_note.pitch.midi))
+
+
+def test_start_final_and_penultimate_masks():
+    """Start pitches are perfect, finals are tonics, the penultimate prefers 3rds and 6ths."""
+    key, cf, plan = _plan()
+    midis = [n.pitch.midi for n in cf.notes]
+
+    start = pitches_of(plan.start_mask)
+    assert start and plan.start_mask & ~plan.consonant_masks[0] == 0
+    assert all(is_perfect_consonance(abs(m - midis[0])) for m in start)
+    finals = pitches_of(plan.finals_mask)
+    assert finals
+    assert all(m % 12 == key.tonic and is_perfect_consonance(abs(m - midis[-1])) for m in finals)
+    assert all(abs(m - midis[-2]) % 12 in (3, 4, 8, 9) for m in pitches_of(plan.penultimate_mask))
+
+
+def test_plans_are_cached_across_requests():
+    """The same CF, key and range reuse one compiled plan."""
+    key, cf, plan = _plan()
+    again = build_generation_plan(tuple(n.pitch.midi for n in cf.notes), key.tonic, key.mode, VoiceRange.SOPRANO)
+
+    assert again is plan
+    assert plan_for(cf, key, VoiceRange.BASS) is not plan
@@ -0,0 +1,96 @@
+"""Tests for vectorized Monte Carlo line sampling."""
+
+import random
+import numpy as np
+from app.models import Key, Mode, Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import generate_cantus_firmus, generate_first_species, evaluate_first_species, is_consonant
+from app.services.bitsets import masks_of, parallel_mask
+from app.services.cadences import cadence_masks
+from app.services.generation_plan import plan_for
+from app.services.monte_carlo import RANK_TEMPERATURE, _parallels, sample_lines, species_spec
+from app.services.third_species_generator import FINAL_APPROACH, MELODIC_INTERVALS
+from app.services.third_species_rules import evaluate_third_species
+
+
+def _plan(species, seed=42):
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=seed)
+    plan = plan_for(cf, key, VoiceRange.SOPRANO)
+    masks = [masks_of(m) for m in cadence_masks(list(plan.cf_midis), key, VoiceRange.SOPRANO, species)]
+    return key, cf, plan, masks
+
+
+def test_parallels_match_bitset_mask():
+    """The vectorized parallel check agrees with parallel_mask row by row."""
+    pitches = np.arange(55, 80)
+    earlier = np.array([62, 67, 69, 74])
+    for earlier_cf, cf in [(50, 52), (55, 53), (50, 50)]:
+        forbidden = _parallels(pitches, earlier, earlier_cf, cf)
+        for row, prev_cp in enumerate(earlier):
+            mask = parallel_mask(earlier_cf, cf, int(prev_cp))
+            assert [int(p) for p in pitches[forbidden[row]]] == [p for p in pitches if mask >> int(p) & 1]
+
+
+def test_third_species_walks_follow_the_rules():
+    """Sampled third species lines keep to their domains and pass evaluation."""
+    random.seed(0)
+    key, cf, plan, masks = _plan(SpeciesType.THIRD)
+    spec = species_spec(plan, masks[-1], 4, MELODIC_INTERVALS, FINAL_APPROACH, resolve_leaps=True)
+    lines = sample_lines(spec, num_walks=256, top_k=8)
+
+    assert lines and len(set(lines)) == len(lines)
+    for line in lines:
+        assert len(line) == len(cf.notes) * 4
+        assert all(spec.domains[pos] >> midi & 1 for pos, midi in enumerate(line))
+        # Downbeats are consonant with the CF
+        assert all(is_consonant(abs(line[pos] - plan.cf_midis[pos // 4])) for pos in range(0, len(line), 2))
+    notes = [Note(pitch=Pitch.from_midi(m), duration=Duration.QUARTER) for m in lines[0]]
+    assert evaluate_third_species(cf, VoiceLine(notes=notes, voice_index=1, voice_range=VoiceRange.SOPRANO)) == []
+
+
+def test_ranked_by_leaps():
+    """Lines come back with the fewest leaps first."""
+    random.seed(1)
+    _, _, plan, masks = _plan(SpeciesType.FIRST)
+    spec = species_spec(plan, masks[-1], 1, (2, -2, 1, -1, 3, -3, 4, -4, 5, -5, 7, -7), FINAL_APPROACH)
+    lines = sample_lines(spec, num_walks=512, top_k=16)
+
+    leaps = [sum(abs(b - a) > 2 for a, b in zip(line, line[1:])) for line in lines]
+    assert leaps == sorted(leaps)
+
+
+def test_temperature_ranking_favours_few_leaps():
+    """Drawn at a temperature, the lines returned first still have fewer leaps than the sampled lines overall."""
+    _, _, plan, masks = _plan(SpeciesType.FIRST)
+    spec = species_spec(plan, masks[-1], 1, (2, -2, 1, -1, 3, -3, 4, -4, 5, -5, 7, -7), FINAL_APPROACH)
+
+    def mean_leaps(lines):
+        return sum(sum(abs(b - a) > 2 for a, b in zip(line, line[1:])) for line in lines) / len(lines)
+
+    random.seed(1)
+    best = sample_lines(spec, num_walks=512, top_k=8, temperature=RANK_TEMPERATURE)
+    random.seed(1)
+    everything = sample_lines(spec, num_walks=512, top_k=10_000, temperature=RANK_TEMPERATURE)
+    assert len(everything) > len(best)
+    assert mean_leaps(best) < mean_leaps(everything)
+
+
+def test_empty_domain_returns_nothing():
+    """With no legal pitch at some position every walk dies."""
+    _, _, plan, masks = _plan(SpeciesType.FIRST)
+    reachable = list(masks[-1])
+    reachable[3] = 0
+    assert sample_lines(species_spec(plan, reachable, 1, MELODIC_INTERVALS, FINAL_APPROACH)) == []
+
+
+def test_seeded_generation_is_reproducible():
+    """Walks draw from the global seed, so seeded first species lines repeat."""
+    key, cf, _, _ = _plan(SpeciesType.FIRST, seed=5)
+    problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[SpeciesType.FIRST])
+    # Without greedy attempts first species falls back to the walks
+    first = generate_first_species(problem, seed=11, max_attempts=0)
+    second = generate_first_species(problem, seed=11, max_attempts=0)
+
+    assert first.search_stats["strategy"] == "monte-carlo"
+    assert evaluate_first_species(cf, first.voice_lines[1]) == []
+    assert [n.pitch.midi for n in first.voice_lines[1].notes] == [n.pitch.midi for n in second.voice_lines[1].notes]
@@ -0,0 +1,79 @@
+"""Tests for the nogood store shared across generator restarts."""
+
+import random
+from app.models import Key, Mode, VoiceRange, SpeciesType, CounterpointProblem
+from app.services import generate_cantus_firmus
+from app.services.bitsets import masks_of
+from app.services.first_species_generator import _generate_greedy, generate_first_species
+from app.services.third_species_generator import generate_third_species
+from app.services.fifth_species_generator import generate_fifth_species
+from app.services.nogoods import NogoodStore
+from app.services.reachability import reachability_for
+
+
+def test_store_counts_hits_and_entries():
+    """Lookups of stored states count as hits; duplicates are not stored twice."""
+    store = NogoodStore()
+    store.add((1, 60, 0))
+    store.add((1, 60, 0))
+
+    assert store.entries == 1
+    assert (1, 60, 0) in store
+    assert (1, 62, 0) not in store
+    assert store.stats() == {"entries": 1, "hits": 1, "evictions": 0}
+
+
+def test_store_is_bounded():
+    """The oldest states are evicted once the store is full."""
+    store = NogoodStore(max_entries=2)
+    for state in [(0,), (1,), (2,)]:
+        store.add(state)
+
+    assert store.entries == 2
+    assert store.evictions == 1
+    assert (0,) not in store
+    assert (2,) in store
+
+
+def test_prune_records_exhausted_state():
+    """A state whose candidates all lead into nogoods becomes a nogood."""
+    store = NogoodStore()
+    store.add((2, 62))
+    store.add((2, 64))
+
+    assert store.prune([62, 64, 65], (1, 60), lambda c: (2, c)) == [65]
+    assert store.prune([62, 64], (1, 60), lambda c: (2, c)) == []
+    assert (1, 60) in store
+
+
+def test_failures_propagate_to_the_start():
+    """With no legal final, learning eventually marks the opening state as dead."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=42)
+    reach = reachability_for([n.pitch.midi for n in cf.notes], key, VoiceRange.SOPRANO, SpeciesType.FIRST)
+    dead_end = masks_of(reach[:-1]) + (0,)
+
+    store = NogoodStore()
+    random.seed(0)
+    for _ in range(500):
+        assert _generate_greedy(cf, key, VoiceRange.SOPRANO, dead_end, store) is None
+        if (0, None, 0) in store:
+            break
+
+    assert (0, None, 0) in store
+    assert store.hits > 0
+
+
+def test_generators_accept_a_store():
+    """Generators still succeed when handed a store to inspect."""
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=9)
+
+    for species, generate in [
+        (SpeciesType.FIRST, generate_first_species),
+        (SpeciesType.THIRD, generate_third_species),
+        (SpeciesType.FIFTH, generate_fifth_species),
+    ]:
+        problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[species])
+        store = NogoodStore()
+        assert generate(problem, seed=3, nogoods=store) is not None
@@ -0,0 +1,79 @@
+"""Tests for parallel portfolio solving."""
+
+import asyncio
+import threading
+import pytest
+from app.models import SpeciesType
+from app.services import portfolio
+from app.services.portfolio import PortfolioPool, RunDeadline, solve_portfolio, workers_for
+from app.services.scheduler import run_generation
+
+
+def test_workers_are_configurable(monkeypatch):
+    """Worker counts come from the per-class table, the environment, and the CPU count."""
+    monkeypatch.setattr(portfolio.os, "cpu_count", lambda: 8)
+    assert workers_for("first") == 1
+    assert workers_for("fifth") == 4
+    monkeypatch.setenv("PORTFOLIO_WORKERS_FIFTH", "16")
+    assert workers_for("fifth") == 8
+    monkeypatch.setenv("PORTFOLIO_WORKERS_FIFTH", "2")
+    assert workers_for("fifth") == 2
+
+
+@pytest.mark.asyncio
+async def test_single_worker_runs_inline(make_problem):
+    """One worker runs the first strategy in-process."""
+    result = await solve_portfolio("second", make_problem(SpeciesType.SECOND), seed=3, workers=1)
+
+    assert result.valid
+    assert result.strategy == "dp"
+    assert result.launched == result.finished == 1
+
+
+def test_run_deadline_follows_cancellation(monkeypatch):
+    """A run's deadline expires once the parent marks the run decided."""
+    slots = [-1] * portfolio.CANCEL_SLOTS
+    monkeypatch.setattr(portfolio, "_cancelled", slots)
+    deadline = RunDeadline(60_000, run_id=7)
+    assert not deadline.expired()
+    slots[7] = 7
+    assert deadline.expired()
+    # A later run sharing the slot is not affected
+    assert not RunDeadline(60_000, run_id=7 + portfolio.CANCEL_SLOTS).expired()
+
+
+@pytest.mark.asyncio
+async def test_pool_returns_first_valid_result(make_problem):
+    """Strategies race across processes and a valid solution comes back."""
+    pool = PortfolioPool(2)
+    try:
+        result = await solve_portfolio("fifth", make_problem(SpeciesType.FIFTH), seed=5, workers=2, pool=pool)
+        assert result.valid and result.solution.complete
+        assert result.strategy in ("lattice", "wide-lattice")
+        assert result.launched == 2 and result.finished >= 1
+
+        result = await solve_portfolio(
+            "multi_voice", make_problem(num_voices=3), seed=5, options={"num_voices": 3}, workers=2, pool=pool
+        )
+        assert result.solution is not None
+        assert len(result.solution.voice_lines) == 3
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_leave_the_generation_thread_free(make_problem):
+    """Other generation jobs run while a portfolio waits on its workers."""
+    pool = PortfolioPool(2)
+    try:
+        run = asyncio.create_task(
+            solve_portfolio("fifth", make_problem(SpeciesType.FIFTH), seed=5, workers=2, pool=pool)
+        )
+        await asyncio.sleep(0)
+        # Worker processes take far longer to start than a generation job takes to run
+        name = await run_generation(lambda: threading.current_thread().name)
+        assert not run.done()
+        assert (await run).valid
+        assert name.startswith("generation")
+    finally:
+        pool.shutdown()
@@ -0,0 +1,58 @@
+"""Tests for backward reachability masks."""
+
+import random
+import pytest
+from app.models import Key, Mode, VoiceRange, SpeciesType
+from app.services import generate_cantus_firmus
+from app.services.bitsets import masks_of
+from app.services.first_species_generator import _generate_greedy
+from app.services.intervals import is_consonant, is_perfect_consonance
+from app.services.reachability import reachability_for, MAX_FINAL_APPROACH
+
+
+def _cf_midis(key):
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=42)
+    return cf, [n.pitch.midi for n in cf.notes]
+
+
+def test_mask_length_per_species():
+    """The table has one entry per counterpoint position."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    _, midis = _cf_midis(key)
+
+    assert len(reachability_for(midis, key, VoiceRange.SOPRANO, SpeciesType.FIRST)) == 8
+    assert len(reachability_for(midis, key, VoiceRange.SOPRANO, SpeciesType.SECOND)) == 16
+    assert len(reachability_for(midis, key, VoiceRange.SOPRANO, SpeciesType.THIRD)) == 32
+
+
+def test_final_and_penultimate_sets():
+    """Finals are tonic perfect consonances; penultimates lie close to one."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    _, midis = _cf_midis(key)
+    reach = reachability_for(midis, key, VoiceRange.SOPRANO, SpeciesType.FIRST)
+
+    assert reach[-1]
+    assert all(m % 12 == 0 and is_perfect_consonance(abs(m - midis[-1])) for m in reach[-1])
+    for midi in reach[-2]:
+        assert is_consonant(abs(midi - midis[-2]))
+        assert any(abs(final - midi) <= MAX_FINAL_APPROACH for final in reach[-1])
+
+
+def test_unsupported_species():
+    """Fourth species has no reachability table."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    with pytest.raises(ValueError):
+        reachability_for([60, 62, 60], key, VoiceRange.SOPRANO, SpeciesType.FOURTH)
+
+
+def test_masked_greedy_never_fails_at_cadence():
+    """With the mask, first species greedy attempts never dead-end."""
+    key = Key(tonic=2, mode=Mode.DORIAN)
+    cf, midis = _cf_midis(key)
+    reach = reachability_for(midis, key, VoiceRange.SOPRANO, SpeciesType.FIRST)
+
+    random.seed(0)
+    for _ in range(50):
+        notes = _generate_greedy(cf, key, VoiceRange.SOPRANO, masks_of(reach))
+        assert notes is not None
+        assert all(n.pitch.midi in reach[i] for i, n in enumerate(notes))
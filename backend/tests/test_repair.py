@@ -0,0 +1,110 @@
+"""Tests for min-conflicts counterpoint repair."""
+
+import random
+from app.models import (
+    Key, Mode, Pitch, Note, Duration, VoiceLine, VoiceRange, SpeciesType, CounterpointProblem, RuleViolation
+)
+from app.services import generate_cantus_firmus, generate_first_species
+from app.services.repair import line_domains, min_conflicts, repair_line
+from app.services.second_species_generator import generate_second_species
+from app.services.second_species_rules import evaluate_second_species
+from app.services.species_rules import evaluate_first_species
+
+
+def _notes(midis, duration=Duration.WHOLE):
+    return [Note(pitch=Pitch.from_midi(m), duration=duration) for m in midis]
+
+
+def _solution(species, generate, seed=42):
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=seed)
+    problem = CounterpointProblem(key=key, cantus_firmus=cf, num_voices=2, species_per_voice=[species])
+    return key, cf, generate(problem, seed=seed).voice_lines[1]
+
+
+def test_repairs_a_dissonance():
+    """A first species line with one dissonant note is repaired at that note only."""
+    random.seed(0)
+    key, cf, cp = _solution(SpeciesType.FIRST, generate_first_species)
+    broken = list(cp.notes)
+    broken[3] = Note(pitch=Pitch.from_midi(cf.notes[3].pitch.midi + 13), duration=Duration.WHOLE)
+    assert evaluate_first_species(cf, VoiceLine(notes=broken, voice_index=1, voice_range=cp.voice_range))
+
+    result = repair_line(cf, broken, key, cp.voice_range, SpeciesType.FIRST)
+
+    assert result.violations == []
+    assert result.changed == [3]
+    assert evaluate_first_species(cf, VoiceLine(notes=result.notes, voice_index=1, voice_range=cp.voice_range)) == []
+
+
+def test_repairs_weak_beat_leaps():
+    """Weak-beat dissonances left by leap are repaired without touching the rhythm."""
+    random.seed(0)
+    key, cf, cp = _solution(SpeciesType.SECOND, generate_second_species)
+    midis = [n.pitch.midi for n in cp.notes]
+    # A dissonant 2nd above the CF on a weak beat, left by leap
+    midis[3] = cf.notes[1].pitch.midi + 14
+    broken = _notes(midis, Duration.HALF)
+    assert evaluate_second_species(cf, VoiceLine(notes=broken, voice_index=1, voice_range=cp.voice_range))
+
+    result = repair_line(cf, broken, key, cp.voice_range, SpeciesType.SECOND)
+
+    assert result.violations == []
+    assert all(n.duration == Duration.HALF for n in result.notes)
+
+
+def test_valid_lines_are_untouched():
+    """A line without violations is returned as-is without iterating."""
+    key, cf, cp = _solution(SpeciesType.FIRST, generate_first_species)
+    result = repair_line(cf, cp.notes, key, cp.voice_range, SpeciesType.FIRST)
+
+    assert result.iterations == 0
+    assert result.changed == []
+
+
+def test_budget_and_fixed_domains():
+    """The iteration budget is respected and notes with a single legal pitch never move."""
+    random.seed(0)
+    notes = _notes([60, 67, 60])
+
+    def evaluate(candidate):
+        # Wants the middle note within a step of its neighbours; only 62 and 64 are legal
+        if abs(candidate[1].pitch.midi - 60) <= 2:
+            return []
+        return [RuleViolation(rule_code="LEAP", description="leap", note_indices=[1])]
+
+    domains = [1 << 60, (1 << 62) | (1 << 64), 1 << 60]
+    assert min_conflicts(notes, domains, evaluate, max_iterations=0).iterations == 0
+
+    result = min_conflicts(notes, domains, evaluate)
+    assert [n.pitch.midi for n in result.notes] == [60, 62, 60]
+    assert result.changed == [1]
+
+
+def test_tied_notes_keep_their_pitch():
+    """Notes tied across a barline have a single-pitch domain."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cf = VoiceLine(notes=_notes([48, 50, 48]), voice_index=0, voice_range=VoiceRange.BASS)
+    notes = _notes([60, 62], Duration.HALF) + _notes([62, 64], Duration.HALF) + _notes([60])
+    notes[1] = notes[1].model_copy(update={"tie": True})
+
+    domains = line_domains(cf, notes, key, VoiceRange.SOPRANO, SpeciesType.FIFTH)
+
+    assert domains[1] == 1 << 62
+    assert domains[2] == 1 << 62
+
+
+def test_unrepaired_greedy_lines_are_not_returned(monkeypatch, make_problem):
+    """A greedy line the repair leaves with violations is not reported as a solution."""
+    from app.services import first_species_generator
+    from app.services.repair import RepairResult
+    problem = make_problem()
+    violation = RuleViolation(rule_code="PARALLEL_FIFTH", description="Parallel fifths", note_indices=[2, 3])
+
+    def leave_broken(cf, notes, key, cp_range, species, deadline=None):
+        return RepairResult(notes=notes, violations=[violation], iterations=0, changed=0)
+
+    monkeypatch.setattr(first_species_generator, "repair_line", leave_broken)
+    monkeypatch.setattr(first_species_generator, "_generate_monte_carlo", lambda *args: None)
+
+    assert generate_first_species(problem, seed=1, max_attempts=5) is None
@@ -0,0 +1,76 @@
+"""Tests for the seeded response cache."""
+
+import time
+from app.services.response_cache import ResponseCache, request_key
+
+
+def test_request_key_is_canonical():
+    """Key order does not matter; endpoint and values do."""
+    a = request_key("generate-counterpoint", {"tonic": 2, "seed": 1, "cf_notes": [50, 52]})
+    b = request_key("generate-counterpoint", {"cf_notes": [50, 52], "seed": 1, "tonic": 2})
+
+    assert a == b
+    assert a != request_key("generate-second-species", {"tonic": 2, "seed": 1, "cf_notes": [50, 52]})
+    assert a != request_key("generate-counterpoint", {"tonic": 2, "seed": 2, "cf_notes": [50, 52]})
+
+
+def test_hits_and_misses():
+    """Lookups are counted as hits or misses."""
+    cache = ResponseCache()
+
+    assert cache.get("a") is None
+    cache.put("a", "value", 5)
+    assert cache.get("a") == "value"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 1, 1, 5)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction_by_entries():
+    """The least recently used entry is evicted first."""
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", 1, 1)
+    cache.put("b", 2, 1)
+    cache.get("a")
+    cache.put("c", 3, 1)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_bytes():
+    """Entries are evicted until the cached bytes fit; oversized values are not stored."""
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", 1, 4)
+    cache.put("b", 2, 4)
+    cache.put("c", 3, 4)
+
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 8
+
+    cache.put("huge", 4, 11)
+    assert cache.get("huge") is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_ttl_expiry():
+    """Entries expire after the time to live."""
+    cache = ResponseCache(ttl_seconds=0.01)
+    cache.put("a", 1, 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    """A cache with no room is disabled."""
+    cache = ResponseCache(max_entries=0)
+    cache.put("a", 1, 1)
+
+    assert not cache.enabled
+    assert cache.get("a") is None
@@ -0,0 +1,131 @@
+"""Tests for the generation scheduler's lanes and fair queuing."""
+
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.scheduler import (
+    BULK, INTERACTIVE, GenerationScheduler, Priority, current_priority, generation_scheduler, run_generation
+)
+
+
+def _run_queued(jobs):
+    """Queue jobs behind a blocker and return the order they ran in."""
+    scheduler = GenerationScheduler()
+    release = threading.Event()
+    order = []
+    scheduler.submit(release.wait, (), Priority(BULK, "blocker"))
+    futures = [scheduler.submit(order.append, (name,), priority) for name, priority in jobs]
+    queued = scheduler.stats()
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    return order, queued, scheduler
+
+
+def test_interactive_lane_is_served_first_without_starving_bulk():
+    """While both lanes wait, interactive jobs get four picks for each bulk one."""
+    jobs = [(f"bulk{i}", Priority(BULK, "grader")) for i in range(3)]
+    jobs += [(f"ui{i}", Priority(INTERACTIVE, "student")) for i in range(6)]
+
+    order, _, _ = _run_queued(jobs)
+
+    assert order == ["ui0", "ui1", "bulk0", "ui2", "ui3", "ui4", "ui5", "bulk1", "bulk2"]
+
+
+def test_clients_take_turns_within_a_lane():
+    """One client's backlog does not hold up another's jobs."""
+    jobs = [(f"a{i}", Priority(INTERACTIVE, "a")) for i in range(4)]
+    jobs += [(f"b{i}", Priority(INTERACTIVE, "b")) for i in range(2)]
+
+    order, _, _ = _run_queued(jobs)
+
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_lane_metrics():
+    """Queue depth and wait times are reported per lane."""
+    jobs = [("a", Priority(INTERACTIVE, "a")), ("b", Priority(INTERACTIVE, "b")), ("c", Priority(BULK, "c"))]
+
+    _, queued, scheduler = _run_queued(jobs)
+    stats = scheduler.stats()
+
+    assert queued[INTERACTIVE]["queued"] == 2
+    assert queued[INTERACTIVE]["clients"] == 2
+    assert queued[BULK]["queued"] == 1
+    assert stats[INTERACTIVE]["queued"] == 0
+    assert stats[INTERACTIVE]["started"] == 2
+    assert stats[BULK]["started"] == 2
+    assert stats[INTERACTIVE]["max_wait_ms"] >= stats[INTERACTIVE]["mean_wait_ms"] > 0
+
+
+def test_cancelled_jobs_are_dropped():
+    """A job cancelled while queued never runs."""
+    scheduler = GenerationScheduler()
+    release = threading.Event()
+    ran = []
+    scheduler.submit(release.wait, (), Priority())
+    cancelled = scheduler.submit(ran.append, ("cancelled",), Priority())
+    kept = scheduler.submit(ran.append, ("kept",), Priority())
+
+    assert cancelled.cancel()
+    release.set()
+    kept.result(timeout=5)
+
+    assert ran == ["kept"]
+
+
+@pytest.mark.asyncio
+async def test_run_generation_uses_the_current_lane():
+    """Calls queue in the lane of the current context unless given one."""
+    before = generation_scheduler.stats()
+    token = current_priority.set(Priority(BULK, "test"))
+    try:
+        await run_generation(lambda: None)
+    finally:
+        current_priority.reset(token)
+    await run_generation(lambda: None, priority=Priority(INTERACTIVE, "test"))
+    after = generation_scheduler.stats()
+
+    assert after[BULK]["started"] - before[BULK]["started"] == 1
+    assert after[INTERACTIVE]["started"] - before[INTERACTIVE]["started"] == 1
+
+
+def test_api_requests_are_scheduled_by_lane():
+    """Batches run in the bulk lane, one job per solution; X-Priority overrides the lane."""
+    client = TestClient(app)
+    request = {
+        "tonic": 0,
+        "mode": "ionian",
+        "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+        "cf_voice_range": "alto",
+        "seed": 20500
+    }
+    before = client.get("/api/metrics").json()["scheduler"]
+    assert client.post("/api/generate-batch", json={**request, "count": 3}).status_code == 200
+    assert client.post(
+        "/api/generate-counterpoint", json=request, headers={"X-Priority": "bulk", "X-Client-Id": "grader"}
+    ).status_code == 200
+    after = client.get("/api/metrics").json()["scheduler"]
+
+    # Three solutions plus the end of the batch, then the counterpoint
+    assert after[BULK]["started"] - before[BULK]["started"] == 5
+    assert after[INTERACTIVE]["started"] == before[INTERACTIVE]["started"]
+
+
+def test_only_priority_hosts_may_raise_their_lane(monkeypatch):
+    """X-Priority can move any request to the bulk lane, but only allowlisted clients to interactive."""
+    from app.api import routes
+    client = TestClient(app)
+    request = {"tonic": 0, "mode": "ionian", "cf_notes": [60, 62, 64, 65, 64, 62, 60], "cf_voice_range": "alto", "count": 1}
+    headers = {"X-Priority": "interactive"}
+
+    before = client.get("/api/metrics").json()["scheduler"]
+    assert client.post("/api/generate-batch", json={**request, "seed": 20501}, headers=headers).status_code == 200
+    monkeypatch.setattr(routes, "PRIORITY_HOSTS", frozenset({"testclient"}))
+    assert client.post("/api/generate-batch", json={**request, "seed": 20502}, headers=headers).status_code == 200
+    after = client.get("/api/metrics").json()["scheduler"]
+
+    # One solution plus the end of each batch
+    assert after[BULK]["started"] - before[BULK]["started"] == 2
+    assert after[INTERACTIVE]["started"] - before[INTERACTIVE]["started"] == 2
@@ -0,0 +1,45 @@
+"""Tests for the second species measure-cell DP engine."""
+
+import random
+from app.models import Key, Mode, VoiceLine, VoiceRange
+from app.services import generate_cantus_firmus
+from app.services.second_species_dp import (
+    enumerate_measure_cells,
+    generate_second_species_dp,
+    is_parallel_perfect,
+)
+from app.services.second_species_rules import evaluate_second_species
+
+
+def test_enumerate_cells_dissonant_weak_beats_are_steps():
+    """Dissonant weak beats are only reached by step and carry a direction."""
+    key = Key(tonic=0, mode=Mode.IONIAN)
+    cells = enumerate_measure_cells(60, [64, 67], 58, 81, key.get_scale_degrees())
+
+    assert cells
+    for cell in cells:
+        if cell.passing:
+            assert abs(cell.weak - cell.strong) <= 2
+            assert cell.passing == (1 if cell.weak > cell.strong else -1)
+
+
+def test_is_parallel_perfect():
+    """Parallel fifths are detected, contrary fifths are not."""
+    assert is_parallel_perfect(60, 62, 67, 69)
+    assert not is_parallel_perfect(60, 62, 67, 62)
+    assert not is_parallel_perfect(60, 62, 64, 66)
+
+
+def test_dp_lines_pass_evaluation():
+    """Every DP line passes second species evaluation without retries."""
+    for mode in [Mode.IONIAN, Mode.DORIAN, Mode.PHRYGIAN, Mode.MIXOLYDIAN]:
+        key = Key(tonic=2, mode=mode)
+        cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=7)
+
+        for seed in range(5):
+            random.seed(seed)
+            notes = generate_second_species_dp(cf, key, VoiceRange.SOPRANO)
+            assert notes is not None
+
+            cp = VoiceLine(notes=notes, voice_index=1, voice_range=VoiceRange.SOPRANO)
+            assert evaluate_second_species(cf, cp) == []
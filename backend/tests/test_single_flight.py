@@ -0,0 +1,111 @@
+"""Tests for single-flight coalescing of identical requests."""
+
+import asyncio
+import threading
+import httpx
+import pytest
+from app.main import app
+from app.services.scheduler import run_generation
+from app.services.single_flight import SingleFlight, single_flight
+
+
+@pytest.mark.asyncio
+async def test_identical_calls_share_one_computation():
+    """Concurrent calls with one key run the computation once."""
+    flight = SingleFlight()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+
+    assert results == ["result"] * 5
+    assert len(runs) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+@pytest.mark.asyncio
+async def test_different_keys_are_not_coalesced():
+    """Each key gets its own computation, and finished calls are not reused."""
+    flight = SingleFlight()
+
+    async def compute(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    assert await asyncio.gather(flight.do("a", lambda: compute(1)), flight.do("b", lambda: compute(2))) == [1, 2]
+    assert await flight.do("a", lambda: compute(3)) == 3
+    assert flight.stats()["leaders"] == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter():
+    """Waiters get the leader's error."""
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("no solution")
+
+    results = await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_generation_runs_on_one_thread():
+    """Blocking generation calls leave the event loop and share a single thread."""
+    names = await asyncio.gather(*(run_generation(lambda: threading.current_thread().name) for _ in range(4)))
+
+    assert len(set(names)) == 1
+    assert names[0] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_concurrent_api_requests_are_coalesced():
+    """Identical seeded requests sent together are answered by one search."""
+    request = {
+        "tonic": 0,
+        "mode": "ionian",
+        "cf_notes": [60, 62, 64, 65, 64, 62, 60],
+        "cf_voice_range": "alto",
+        "seed": 20461
+    }
+    before = single_flight.stats()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *(client.post("/api/generate-third-species", json=request) for _ in range(4))
+        )
+    after = single_flight.stats()
+
+    assert all(r.status_code == 200 for r in responses)
+    assert len({r.text for r in responses}) == 1
+    assert after["leaders"] - before["leaders"] == 1
+    assert after["coalesced"] - before["coalesced"] == 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_leaves_followers_their_result():
+    """A leader whose client goes away does not fail the calls it coalesced."""
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return "result"
+
+    leader = asyncio.ensure_future(flight.do("key", compute))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flight.do("key", compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await follower == "result"
+    assert leader.cancelled()
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
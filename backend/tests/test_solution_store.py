@@ -0,0 +1,57 @@
+"""Tests for the content-addressed solution store."""
+
+from app.services.solution_store import SolutionStore, solution_id
+
+
+def _payload(midis, elapsed_ms=1.0):
+    return {
+        "cf_notes": [{"midi": 62, "duration": "whole"}],
+        "cp_notes": [{"midi": m, "duration": "whole"} for m in midis],
+        "violations": [],
+        "complete": True,
+        "search_stats": {"strategy": "greedy", "elapsed_ms": elapsed_ms},
+    }
+
+
+def test_ids_depend_on_content_only():
+    """Search statistics and key order do not change an ID; notes do."""
+    store = SolutionStore()
+
+    first = store.put(_payload([69, 74], elapsed_ms=1.0))
+    assert store.put(_payload([69, 74], elapsed_ms=7.5)) == first
+    assert store.put(dict(reversed(list(_payload([69, 74]).items())))) == first
+    assert store.put(_payload([69, 72])) != first
+    assert len(first) == 32
+
+
+def test_get_returns_content():
+    """Stored content comes back without the volatile fields."""
+    store = SolutionStore()
+    key = store.put({**_payload([69, 74]), "solution_id": None})
+
+    content = store.get(key)
+    assert "search_stats" not in content and "solution_id" not in content
+    assert solution_id(content) == key
+    assert store.get("0" * 32) is None
+
+
+def test_lru_bound():
+    """The least recently used solution is dropped first."""
+    store = SolutionStore(max_solutions=2)
+    a = store.put(_payload([60]))
+    b = store.put(_payload([62]))
+    store.get(a)
+    store.put(_payload([64]))
+
+    assert store.get(a) is not None
+    assert store.get(b) is None
+    assert len(store) == 2
+
+
+def test_disabled_store_still_assigns_ids():
+    """Without room, IDs are computed but nothing is kept."""
+    store = SolutionStore(max_solutions=0)
+    key = store.put(_payload([60]))
+
+    assert key == SolutionStore().put(_payload([60]))
+    assert store.get(key) is None
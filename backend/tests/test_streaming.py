@@ -0,0 +1,87 @@
+"""Tests for streaming generation."""
+
+import itertools
+import json
+import pytest
+from app.models import Key, Mode, SpeciesType
+from app.services.batch import solution_key
+from app.services.repair import SPECIES_EVALUATORS
+from app.services.streaming import all_keys, format_event, stream_solutions, transpose_shape
+
+
+def test_all_keys():
+    """Every tonic in every mode, once."""
+    keys = all_keys()
+
+    assert len(keys) == 84
+    assert len({(k.tonic, k.mode) for k in keys}) == 84
+
+
+def test_transpose_shape_keeps_degrees():
+    """A D dorian line lands on the same degrees of other keys."""
+    dorian = Key(tonic=2, mode=Mode.DORIAN)
+    line = [62, 65, 64, 62, 67, 69, 72, 74]
+
+    assert transpose_shape(line, dorian, dorian) == line
+    # Same degrees of C ionian: a tone lower throughout, but for the semitones
+    assert transpose_shape(line, dorian, Key(tonic=0, mode=Mode.IONIAN)) == [60, 64, 62, 60, 65, 67, 71, 72]
+    # Tonics more than a tritone up are taken from below
+    assert transpose_shape(line, dorian, Key(tonic=11, mode=Mode.DORIAN)) == [m - 3 for m in line]
+
+    with pytest.raises(ValueError):
+        transpose_shape([62, 63], dorian, dorian)
+
+
+def test_stream_yields_distinct_valid_solutions(make_problem):
+    """A stream yields the requested number of distinct, valid solutions."""
+    problem = make_problem(SpeciesType.SECOND)
+    items = list(stream_solutions("second", problem, 4, seed=1, workers=1))
+
+    assert len(items) == 4
+    assert len({solution_key(item.solution) for item in items}) == 4
+    for item in items:
+        assert item.key == problem.key
+        assert item.violations == SPECIES_EVALUATORS[SpeciesType.SECOND](
+            problem.cantus_firmus, item.solution.voice_lines[1]
+        )
+
+
+def test_stream_all_keys(make_problem):
+    """Streaming over every key solves the CF's shape in each of them."""
+    problem = make_problem()
+    items = list(stream_solutions("first", problem, 1, keys=all_keys(), seed=1, workers=1))
+
+    assert [item.key for item in items] == all_keys()
+    for item in items:
+        cf = item.problem.cantus_firmus
+        assert item.problem.key == item.key
+        assert all(n.pitch.pitch_class in item.key.get_scale_degrees() for n in cf.notes)
+        assert item.solution.voice_lines[0] == cf
+
+
+def test_stream_is_lazy(monkeypatch, make_problem):
+    """Nothing is generated beyond what the consumer takes."""
+    from app.services import portfolio
+    original = portfolio.GENERATORS["first"]
+    calls = []
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setitem(portfolio.GENERATORS, "first", counting)
+    stream = stream_solutions("first", make_problem(), 10, keys=all_keys(), seed=1, workers=1)
+    taken = list(itertools.islice(stream, 2))
+    stream.close()
+
+    assert len(taken) == 2
+    assert len(calls) == 2
+
+
+def test_format_event():
+    """Events encode as NDJSON lines or Server-Sent Events."""
+    payload = {"done": True, "count": 2}
+
+    assert json.loads(format_event("done", payload, sse=False)) == payload
+    assert format_event("done", payload, sse=False).endswith("}\n")
+    assert format_event("done", payload, sse=True) == 'event: done\ndata: {"done":true,"count":2}\n\n'
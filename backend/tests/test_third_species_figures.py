@@ -0,0 +1,42 @@
+"""Tests for the third species figure library."""
+
+import random
+from app.models import Key, Mode, VoiceLine, VoiceRange
+from app.services import generate_cantus_firmus
+from app.services.intervals import is_consonant
+from app.services.third_species_figures import build_figure_library, generate_third_species_figures
+from app.services.third_species_rules import evaluate_third_species
+
+
+def test_library_strong_beats_consonant():
+    """Beats 1 and 3 of every figure are consonant with the CF."""
+    library = build_figure_library(60, 0, Mode.IONIAN, VoiceRange.SOPRANO)
+
+    assert library.figures
+    for figure in library.figures:
+        assert is_consonant(abs(figure.pitches[0] - 60))
+        assert is_consonant(abs(figure.pitches[2] - 60))
+        assert figure.exits
+
+
+def test_library_models_classic_figures():
+    """Passing, neighbour and cambiata figures are present."""
+    library = build_figure_library(60, 0, Mode.IONIAN, VoiceRange.SOPRANO)
+    names = {figure.name for figure in library.figures}
+
+    assert {"consonant", "passing", "neighbour", "cambiata"} <= names
+
+
+def test_figure_search_lines_pass_evaluation():
+    """Lines built from figures pass third species evaluation in one pass."""
+    for mode in [Mode.IONIAN, Mode.DORIAN, Mode.AEOLIAN]:
+        key = Key(tonic=0, mode=mode)
+        cf = generate_cantus_firmus(key, length=8, voice_range=VoiceRange.ALTO, seed=42)
+
+        for seed in range(3):
+            random.seed(seed)
+            notes = generate_third_species_figures(cf, key, VoiceRange.SOPRANO)
+            assert notes is not None
+
+            cp = VoiceLine(notes=notes, voice_index=1, voice_range=VoiceRange.SOPRANO)
+            assert evaluate_third_species(cf, cp) == []
@@ -0,0 +1,72 @@
+"""Tests for the tonic-relative canonical form."""
+
+from app.models import VoiceRange
+from app.services.transposition import (
+    TranspositionStats, canonical_offset, canonical_shift, counterpoint_range, fits_transposition, transpose_midis
+)
+
+
+def test_canonical_offset():
+    """Every tonic moves to C by at most a tritone."""
+    offsets = [canonical_offset(tonic) for tonic in range(12)]
+
+    assert offsets[0] == 0
+    assert offsets[2] == 2  # D moves down a tone
+    assert offsets[11] == -1  # B moves up a semitone
+    assert all(-5 <= offset <= 6 for offset in offsets)
+    assert all((tonic - offset) % 12 == 0 for tonic, offset in enumerate(offsets))
+
+
+def test_counterpoint_range():
+    """Counterpoints go above low CFs and below high ones."""
+    assert counterpoint_range([50, 53, 52, 50]) == VoiceRange.SOPRANO
+    assert counterpoint_range([67, 69, 71, 67]) == VoiceRange.BASS
+
+
+def test_transpose_midis():
+    """Only "midi" values move, at any depth."""
+    payload = {
+        "cf_notes": [{"midi": 50, "duration": "whole"}],
+        "solutions": [{"cp_notes": [{"midi": 62, "duration": "whole"}], "violations": []}],
+        "count": 1,
+    }
+
+    moved = transpose_midis(payload, 2)
+    assert moved["cf_notes"] == [{"midi": 52, "duration": "whole"}]
+    assert moved["solutions"][0]["cp_notes"] == [{"midi": 64, "duration": "whole"}]
+    assert moved["count"] == 1
+    assert payload["cf_notes"][0]["midi"] == 50
+
+
+def test_fits_transposition():
+    """Transposed answers must keep the counterpoint range and its bounds."""
+    cf = [50, 53, 52, 50]
+    response = {"cf_notes": [{"midi": m} for m in cf], "cp_notes": [{"midi": 62}, {"midi": 65}], "violations": []}
+
+    assert fits_transposition(cf, [m - 2 for m in cf], response)
+    # Moved back above the soprano range
+    high = {**response, "cp_notes": [{"midi": 82}]}
+    assert not fits_transposition(cf, [m - 2 for m in cf], high)
+    # The canonical CF would have had a bass counterpoint
+    assert not fits_transposition([58, 60, 61, 59], [62, 64, 65, 63], response)
+    # Range violations name pitches of the canonical key
+    flagged = {**response, "violations": [{"rule_code": "RANGE_VIOLATION"}]}
+    assert not fits_transposition(cf, [m - 2 for m in cf], flagged)
+
+
+def test_stats():
+    """Accepted and rejected transpositions are counted."""
+    stats = TranspositionStats()
+    stats.record(True)
+    stats.record(True)
+    stats.record(False)
+
+    assert stats.stats() == {"transposed": 2, "rejected": 1}
+
+
+def test_canonical_shift_keeps_the_counterpoint_range():
+    """A CF is only moved to the canonical key if its counterpoint keeps its range."""
+    assert canonical_shift(2, [62, 65, 64, 62]) == 2
+    # Moved down a tone, this CF's average falls below middle C and its counterpoint would flip to soprano
+    assert canonical_shift(2, [60, 62, 61, 60]) == 0
+    assert canonical_shift(0, [60, 62, 61, 60]) == 0
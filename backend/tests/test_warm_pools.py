@@ -0,0 +1,119 @@
+"""Tests for warm solution pools."""
+
+import asyncio
+import pytest
+from app.services import generate_first_species
+from app.services import warm_pools as warm_pools_module
+from app.services.warm_pools import HOT_MIN_REQUESTS, MAX_REFILL_FAILURES, WarmPools
+
+
+async def _solve_inline(spec, seed):
+    return generate_first_species(spec.problem, seed=seed, **spec.options)
+
+
+@pytest.mark.asyncio
+async def test_hot_problems_are_refilled(make_problem):
+    """A problem becomes hot after repeated requests and its pool is filled."""
+    pools = WarmPools(pool_size=2, solve=_solve_inline)
+    problem = make_problem()
+
+    for _ in range(HOT_MIN_REQUESTS - 1):
+        assert pools.take("first", problem, {}) is None
+    assert pools.hot_keys() == []
+    assert not await pools.refill_once()
+
+    assert pools.take("first", problem, {}) is None
+    assert len(pools.hot_keys()) == 1
+    assert await pools.refill_once()
+    assert await pools.refill_once()
+    assert not await pools.refill_once()
+
+    solution = pools.take("first", problem, {})
+    assert solution is not None and solution.complete
+    assert solution.voice_lines[0] == problem.cantus_firmus
+    assert pools.stats()["solutions"] == 1
+    assert pools.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_options_are_part_of_the_key(make_problem):
+    """Requests with other generator options do not share a pool."""
+    pools = WarmPools(solve=_solve_inline)
+    problem = make_problem()
+    for _ in range(HOT_MIN_REQUESTS):
+        pools.take("first", problem, {})
+    await pools.refill_once()
+
+    assert pools.take("first", problem, {"optimize": True}) is None
+    assert pools.take("first", problem, {}) is not None
+
+
+@pytest.mark.asyncio
+async def test_cold_pools_are_dropped(monkeypatch, make_problem):
+    """Pools of problems that left the request window are discarded."""
+    monkeypatch.setattr(warm_pools_module, "RECENT_REQUESTS", HOT_MIN_REQUESTS + 1)
+    pools = WarmPools(solve=_solve_inline)
+    for _ in range(HOT_MIN_REQUESTS):
+        pools.take("first", make_problem(seed=42), {})
+    await pools.refill_once()
+    assert pools.stats()["pools"] == 1
+
+    for _ in range(HOT_MIN_REQUESTS):
+        pools.take("first", make_problem(seed=7), {})
+    await pools.refill_once()
+
+    assert pools.stats()["pools"] == 1
+    assert pools.take("first", make_problem(seed=42), {}) is None
+
+
+@pytest.mark.asyncio
+async def test_incomplete_solutions_are_not_pooled(make_problem):
+    """Best-effort lines cut short by a deadline are never served from a pool."""
+    async def solve_incomplete(spec, seed):
+        solution = await _solve_inline(spec, seed)
+        return solution.model_copy(update={"complete": False})
+
+    pools = WarmPools(solve=solve_incomplete)
+    for _ in range(HOT_MIN_REQUESTS):
+        pools.take("first", make_problem(), {})
+    await pools.refill_once()
+
+    assert pools.take("first", make_problem(), {}) is None
+
+
+@pytest.mark.asyncio
+async def test_failing_problems_are_given_up_on(make_problem):
+    """A hot problem that yields no solution is retried a few times, then left alone."""
+    attempts = []
+
+    async def solve_nothing(spec, seed):
+        attempts.append(seed)
+        return None
+
+    pools = WarmPools(solve=solve_nothing)
+    for _ in range(HOT_MIN_REQUESTS):
+        pools.take("first", make_problem(), {})
+
+    for _ in range(MAX_REFILL_FAILURES + 2):
+        assert not await pools.refill_once()
+
+    assert len(attempts) == MAX_REFILL_FAILURES
+    assert pools.stats()["failed_refills"] == MAX_REFILL_FAILURES
+
+
+@pytest.mark.asyncio
+async def test_background_refill(make_problem):
+    """The background task fills hot pools without being asked twice."""
+    pools = WarmPools(pool_size=3, solve=_solve_inline)
+    task = asyncio.create_task(pools.run())
+    try:
+        for _ in range(HOT_MIN_REQUESTS):
+            pools.take("first", make_problem(), {})
+        for _ in range(100):
+            if pools.stats()["solutions"] == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+
+    assert pools.stats()["solutions"] == 3